@@ -0,0 +1,247 @@
+import hashlib
+from decimal import Decimal
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.views import View
+
+from .cache import aget_cached_valuation
+from .models import Ware, Factor, StockBalance, ValuationSnapshot, LedgerCarryForward
+from .serializers import (
+    InventoryValuationSerializer,
+    WarehouseValuationQuerySerializer,
+    FactorHistoryQuerySerializer,
+)
+from .views import (
+    parse_as_of,
+    warehouse_valuation_querysets,
+    warehouse_totals_aggregates,
+    warehouse_valuation_body,
+    factor_history_queryset,
+    factor_history_body,
+    ledger_aggregates,
+    ledger_totals,
+    check_as_of_archive,
+)
+
+# Async versions of the read endpoints, for deployments served through asgi.py
+# They use the async ORM, so a slow read waits on the database without holding a worker thread,
+# and they return the same bodies as the sync views. Writes stay on the sync views.
+# The async ORM runs every query on one shared thread, so the queries of a request run one after
+# another; a view needing several rows reads them in one query rather than gathering queries.
+
+NOT_FOUND = {"detail": "No Ware matches the given query."}
+
+
+# Decorator for async view methods that answers If-None-Match with 304, like condition(etag_func=...)
+# Django's condition() calls the ETag function synchronously, which cannot query the database here
+def async_condition(etag_func):
+    def decorator(method):
+        @wraps(method)
+        async def wrapper(self, request, *args, **kwargs):
+            etag = await etag_func(request, *args, **kwargs)
+            response = get_conditional_response(request, etag=etag) if etag else None
+            if response is None:
+                response = await method(self, request, *args, **kwargs)
+                if etag and request.method in ('GET', 'HEAD'):
+                    response.headers.setdefault('ETag', etag)
+            return response
+        return wrapper
+    return decorator
+
+
+# Async version of get_ware_version
+async def aget_ware_version(ware_id):
+    version = await StockBalance.objects.filter(ware_id=ware_id).values_list('version', flat=True).afirst()
+    if version is None:
+        if not await Ware.objects.filter(id=ware_id).aexists():
+            return None
+        version = 0
+    return version
+
+
+# Async version of ware_etag
+async def aware_etag(request, ware_id):
+    try:
+        ware_id = int(ware_id)
+    except (TypeError, ValueError):
+        return None
+    version = await aget_ware_version(ware_id)
+    if version is None:
+        return None
+    digest = hashlib.sha1(request.get_full_path().encode()).hexdigest()[:16]
+    return f'"{ware_id}-{version}-{digest}"'
+
+
+async def avaluation_etag(request, *args, **kwargs):
+    return await aware_etag(request, request.GET.get('ware_id'))
+
+
+async def aware_history_etag(request, ware_id, *args, **kwargs):
+    return await aware_etag(request, ware_id)
+
+
+# View to handle inventory valuation
+# Takes one ware (?ware_id=) or a comma-separated list (?ware_ids=); the valuations of a list
+# are returned in the order asked for, their balances read in one query
+class AsyncInventoryValuationView(View):
+    @async_condition(avaluation_etag)
+    async def get(self, request):
+        try:
+            as_of = parse_as_of(request.GET.get('as_of'))
+        except ValueError:
+            return JsonResponse({"error": "as_of must be an ISO 8601 datetime"}, status=400)
+
+        if request.GET.get('ware_ids'):
+            try:
+                ware_ids = [int(ware_id) for ware_id in request.GET['ware_ids'].split(',')]
+            except ValueError:
+                return JsonResponse({"error": "ware_ids must be a comma-separated list of IDs"}, status=400)
+            max_size = getattr(settings, 'INVENTORY_BATCH_MAX_SIZE', 1000)
+            if len(ware_ids) > max_size:
+                return JsonResponse({"error": f"At most {max_size} ware_ids are allowed"}, status=400)
+        elif request.GET.get('ware_id'):
+            try:
+                ware_ids = [int(request.GET['ware_id'])]
+            except ValueError:
+                return JsonResponse(NOT_FOUND, status=404)
+        else:
+            return JsonResponse({"error": "ware_id is required"}, status=400)
+
+        wares = {ware.id: ware async for ware in Ware.objects.filter(id__in=ware_ids)}
+        if len(wares) < len(set(ware_ids)):
+            return JsonResponse(NOT_FOUND, status=404)
+
+        try:
+            if 'ware_ids' not in request.GET:
+                return JsonResponse(await avaluate(wares[ware_ids[0]], as_of))
+            if as_of:
+                # Each ware starts from its own snapshot, so these are valued one ware at a time
+                valuations = [await avaluate(wares[ware_id], as_of) for ware_id in ware_ids]
+            else:
+                valuations = await avaluate_balances(ware_ids)
+        except ValueError as error:
+            return JsonResponse({"error": str(error)}, status=400)
+        return JsonResponse({"results": valuations})
+
+
+# View to handle the valuation of every ware in the warehouse, keyset-paginated like WarehouseValuationView
+class AsyncWarehouseValuationView(View):
+    async def get(self, request):
+        query_serializer = WarehouseValuationQuerySerializer(data=request.GET)
+        if not query_serializer.is_valid():
+            return JsonResponse(query_serializer.errors, status=400)
+        params = query_serializer.validated_data
+
+        wares, page = warehouse_valuation_querysets(params)
+        rows = await alist(page)
+        totals = await StockBalance.objects.filter(ware__in=wares).aaggregate(**warehouse_totals_aggregates())
+        ware_count = await wares.acount()
+        return JsonResponse(warehouse_valuation_body(rows, params['limit'], totals, ware_count))
+
+
+# View to list the transaction history of a ware, keyset-paginated like WareFactorHistoryView
+class AsyncWareFactorHistoryView(View):
+    @async_condition(aware_history_etag)
+    async def get(self, request, ware_id):
+        query_serializer = FactorHistoryQuerySerializer(data=request.GET)
+        if not query_serializer.is_valid():
+            return JsonResponse(query_serializer.errors, status=400)
+        params = query_serializer.validated_data
+
+        if not await Ware.objects.filter(id=ware_id).aexists():
+            return JsonResponse(NOT_FOUND, status=404)
+        try:
+            factors = factor_history_queryset(ware_id, params)
+        except ValueError:
+            return JsonResponse({"cursor": ["Invalid cursor."]}, status=400)
+
+        page = await alist(factors)
+        carry = await LedgerCarryForward.objects.filter(ware_id=ware_id).afirst()
+        return JsonResponse(factor_history_body(page, params['limit'], carry))
+
+
+# Helper functions
+
+# Function to build the valuation body of one ware, like InventoryValuationView
+async def avaluate(ware, as_of=None):
+    if as_of and as_of <= timezone.now():
+        total_quantity, total_inventory_value = await aget_cached_valuation(ware, as_of, acalculate_valuation_as_of)
+    elif as_of:
+        total_quantity, total_inventory_value = await acalculate_valuation_as_of(ware, as_of)
+    else:
+        total_quantity, total_inventory_value = await acalculate_inventory_valuation(ware)
+    return valuation_body(ware.id, total_quantity, total_inventory_value, as_of)
+
+
+# Function to build the current valuation bodies of a list of wares from their balance rows
+async def avaluate_balances(ware_ids):
+    balances = StockBalance.objects.filter(ware_id__in=ware_ids).values_list('ware_id', 'quantity', 'total_value')
+    current = {ware_id: (quantity, total_value) async for ware_id, quantity, total_value in balances}
+    valuations = []
+    for ware_id in ware_ids:
+        # A ware without transactions has no balance row yet
+        total_quantity, total_inventory_value = current.get(ware_id, (0, Decimal('0.00')))
+        if total_quantity <= 0:
+            total_inventory_value = Decimal('0.00')
+        valuations.append(valuation_body(ware_id, total_quantity, total_inventory_value))
+    return valuations
+
+
+# Function to serialize one valuation like InventoryValuationView
+def valuation_body(ware_id, total_quantity, total_inventory_value, as_of=None):
+    valuation_data = {
+        "ware_id": ware_id,
+        "quantity_in_stock": total_quantity,
+        "total_inventory_value": total_inventory_value
+    }
+    if as_of:
+        valuation_data["as_of"] = as_of
+    return InventoryValuationSerializer(valuation_data).data
+
+
+# Async version of calculate_inventory_valuation
+async def acalculate_inventory_valuation(ware):
+    balance = await StockBalance.objects.filter(ware=ware).values_list('quantity', 'total_value').afirst()
+    if balance is None:
+        return 0, Decimal('0.00')
+
+    total_quantity, total_inventory_value = balance
+    if total_quantity <= 0:
+        total_inventory_value = Decimal('0.00')
+    return total_quantity, total_inventory_value
+
+
+# Async version of calculate_valuation_as_of
+async def acalculate_valuation_as_of(ware, as_of):
+    carry = await LedgerCarryForward.objects.filter(ware=ware).afirst()
+    cutoff = check_as_of_archive(carry, as_of)
+    factors = Factor.objects.filter(ware=ware, created_at__lte=as_of)
+    snapshots = ValuationSnapshot.objects.filter(ware=ware, taken_at__lte=as_of)
+    if cutoff is not None:
+        snapshots = snapshots.filter(taken_at__gte=cutoff)
+    snapshot = await snapshots.order_by('-taken_at').afirst()
+    if snapshot is not None:
+        factors = factors.filter(created_at__gt=snapshot.taken_at)
+        total_quantity, total_inventory_value = snapshot.quantity, snapshot.total_value
+    elif carry is not None:
+        total_quantity = carry.input_quantity - carry.output_quantity
+        total_inventory_value = carry.input_cost - carry.output_cost
+    else:
+        total_quantity, total_inventory_value = 0, Decimal('0.00')
+
+    totals = ledger_totals(await factors.aaggregate(**ledger_aggregates()))
+    total_quantity += totals['input_quantity'] - totals['output_quantity']
+    total_inventory_value += totals['input_cost'] - totals['output_cost']
+
+    if total_quantity <= 0:
+        total_inventory_value = Decimal('0.00')
+    return total_quantity, total_inventory_value
+
+
+# Function to fetch the rows of a queryset with async iteration
+async def alist(queryset):
+    return [row async for row in queryset]
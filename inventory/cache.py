@@ -0,0 +1,134 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Cache keys used by the inventory app
+LEDGER_VERSION_KEY = 'inventory:ledger-version:{ware_id}'
+VALUATION_KEY = 'inventory:valuation:{ware_id}:{version}:{as_of}'
+HITS_KEY = 'inventory:valuation-cache:hits'
+MISSES_KEY = 'inventory:valuation-cache:misses'
+
+
+# Function to get the cache backend configured for valuations
+def get_valuation_cache():
+    return caches[getattr(settings, 'INVENTORY_VALUATION_CACHE_ALIAS', 'default')]
+
+
+# Function to read the current ledger version of a ware
+# Cached valuations are keyed by this version, so bumping it invalidates them all at once
+def get_ledger_version(ware_id):
+    cache = get_valuation_cache()
+    key = LEDGER_VERSION_KEY.format(ware_id=ware_id)
+    version = cache.get(key)
+    if version is None:
+        # Never set or evicted: start from a fresh value so no older valuation entry can match
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+# Function to move a ware's ledger version forward after its ledger changed
+def bump_ledger_version(ware_id):
+    cache = get_valuation_cache()
+    key = LEDGER_VERSION_KEY.format(ware_id=ware_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The key is missing; a fresh value is as good as an increment
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+# Function to bump a ware's ledger version once the current transaction commits
+# Bumping only on commit means a rolled-back change never invalidates anything, and a reader
+# can never cache data from before the commit under the new version
+def bump_ledger_version_on_commit(ware_id):
+    transaction.on_commit(lambda: bump_ledger_version(ware_id))
+
+
+# Function to drop a ware's ledger version, e.g. when a ware is created or deleted
+# Makes sure a reused ware ID never sees valuations cached for an earlier ware
+def reset_ledger_version(ware_id):
+    get_valuation_cache().delete(LEDGER_VERSION_KEY.format(ware_id=ware_id))
+
+
+# Function to return a ware's valuation as of a past time from the cache, computing and storing it on a miss
+# Only point-in-time valuations are cached: the current one is a single balance row read, cheaper than the
+# cache lookups. A past valuation only changes when rebuild_costing corrects the ware's output costs (it
+# also drops the snapshots those costs went into) or through a transaction committing just after it was
+# read, so a per-process cache such as LocMemCache, which other workers' invalidations do not reach, can
+# at worst lag behind such a change for INVENTORY_VALUATION_CACHE_TTL.
+def get_cached_valuation(ware, as_of, compute):
+    cache = get_valuation_cache()
+    key = VALUATION_KEY.format(ware_id=ware.id, version=get_ledger_version(ware.id), as_of=as_of.isoformat())
+    valuation = cache.get(key)
+    if valuation is not None:
+        count(HITS_KEY)
+        return valuation
+
+    count(MISSES_KEY)
+    valuation = compute(ware, as_of)
+    cache.set(key, valuation, timeout=getattr(settings, 'INVENTORY_VALUATION_CACHE_TTL', 300))
+    return valuation
+
+
+# Async version of get_ledger_version, for the async views
+async def aget_ledger_version(ware_id):
+    cache = get_valuation_cache()
+    key = LEDGER_VERSION_KEY.format(ware_id=ware_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+# Async version of get_cached_valuation; compute is a coroutine function taking the ware and as_of
+# Shares its entries and counters with the sync version
+async def aget_cached_valuation(ware, as_of, compute):
+    cache = get_valuation_cache()
+    key = VALUATION_KEY.format(ware_id=ware.id, version=await aget_ledger_version(ware.id), as_of=as_of.isoformat())
+    valuation = await cache.aget(key)
+    if valuation is not None:
+        await acount(HITS_KEY)
+        return valuation
+
+    await acount(MISSES_KEY)
+    valuation = await compute(ware, as_of)
+    await cache.aset(key, valuation, timeout=getattr(settings, 'INVENTORY_VALUATION_CACHE_TTL', 300))
+    return valuation
+
+
+# Function to add one to a counter kept in the cache
+def count(key):
+    cache = get_valuation_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        # First count since the counter was created or evicted
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+# Async version of count
+async def acount(key):
+    cache = get_valuation_cache()
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        if not await cache.aadd(key, 1, timeout=None):
+            await cache.aincr(key)
+
+
+# Function to read the hit and miss counters of the valuation cache
+def get_cache_stats():
+    cache = get_valuation_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    lookups = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / lookups, 4) if lookups else None
+    }
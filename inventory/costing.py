@@ -0,0 +1,114 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from decimal import Decimal
+
+# Costing engine for FIFO lots, independent of Django and the database
+# Lots are kept in flat integer arrays: quantities, unit prices in cents and the running
+# (prefix) sums of both. Consuming units only moves a "consumed" counter forward, so the lots
+# an output takes from are found with two binary searches and its cost is a difference of
+# prefix sums: O(log n) per output however many small lots it spans.
+
+# Prices are stored with two decimal places, like FifoLayer.purchase_price
+PRICE_PLACES = 2
+CENT = Decimal(1).scaleb(-PRICE_PLACES)
+
+
+# Result of consuming units from a LotBook, for the caller to persist
+# exhausted: book indexes of the lots this consumption emptied
+# partial: (book index, remaining quantity) of the lot it took part of, if any
+ConsumptionPlan = namedtuple('ConsumptionPlan', ['quantity', 'cost', 'exhausted', 'partial'])
+
+
+# Class holding the lots of one ware, oldest first, with prefix sums of their quantities and costs
+class LotBook:
+    def __init__(self):
+        self.quantities = array('q')  # Units each lot had when it was added
+        self.prices = array('q')  # Unit price of each lot in cents
+        self.cumulative_quantities = array('q')  # Units in this lot and all older ones
+        self.cumulative_costs = array('q')  # Cost in cents of this lot and all older ones
+        self.consumed = 0  # Units taken so far, always from the oldest lots
+
+    def __len__(self):
+        return len(self.quantities)
+
+    # Units added and not consumed yet
+    @property
+    def available(self):
+        total = self.cumulative_quantities[-1] if self.quantities else 0
+        return total - self.consumed
+
+    # Appends a newer lot and returns its index
+    def add(self, quantity, unit_price):
+        if quantity <= 0:
+            raise ValueError("Lot quantity must be positive")
+        price = int(Decimal(unit_price).quantize(CENT).scaleb(PRICE_PLACES))
+        self.quantities.append(quantity)
+        self.prices.append(price)
+        previous_quantity = self.cumulative_quantities[-1] if self.cumulative_quantities else 0
+        previous_cost = self.cumulative_costs[-1] if self.cumulative_costs else 0
+        self.cumulative_quantities.append(previous_quantity + quantity)
+        self.cumulative_costs.append(previous_cost + quantity * price)
+        return len(self) - 1
+
+    # Units still left in a lot
+    def remaining(self, index):
+        left = self.cumulative_quantities[index] - self.consumed
+        return max(0, min(self.quantities[index], left))
+
+    # Index of the oldest lot that still has units left (len(self) when there is none)
+    def head(self):
+        return bisect_right(self.cumulative_quantities, self.consumed)
+
+    # Cost in cents of the first `units` units ever added
+    def cost_of_first(self, units):
+        if units == 0:
+            return 0
+        index = bisect_left(self.cumulative_quantities, units)  # The lot holding the last of these units
+        return self.cumulative_costs[index] - (self.cumulative_quantities[index] - units) * self.prices[index]
+
+    # Takes units from the oldest lots and returns the plan, or None if there are not enough units
+    def consume(self, quantity):
+        if quantity <= 0:
+            raise ValueError("Quantity must be positive")
+        if quantity > self.available:
+            return None
+
+        start = self.consumed
+        end = start + quantity
+        cost = self.cost_of_first(end) - self.cost_of_first(start)
+        first = bisect_right(self.cumulative_quantities, start)  # Oldest lot with units left
+        after = bisect_right(self.cumulative_quantities, end)  # Oldest lot that keeps units afterwards
+        self.consumed = end
+
+        partial = None
+        if after < len(self) and self.cumulative_quantities[after] - self.quantities[after] < end:
+            partial = (after, self.cumulative_quantities[after] - end)
+        return ConsumptionPlan(quantity, Decimal(cost).scaleb(-PRICE_PLACES), range(first, after), partial)
+
+
+# Class holding the perpetual (moving) average cost of a ware: units on hand and their total value
+# Inputs add their units and cost; outputs take units out at the current average
+class MovingAverage:
+    def __init__(self, total_quantity=0, total_cost=Decimal('0.00')):
+        self.total_quantity = total_quantity
+        self.total_cost = total_cost
+
+    # Returns the cost of the given quantity at the current average cost, or None if there is not enough stock
+    def consume(self, quantity):
+        if self.total_quantity < quantity:
+            return None
+        if quantity == self.total_quantity:
+            # The last units take all the remaining value, so no rounding remainder is left behind
+            cost = self.total_cost
+        else:
+            # Rounded like the stored cost, so the state keeps matching the balance row
+            cost = (self.total_cost * quantity / self.total_quantity).quantize(CENT)
+        self.total_quantity -= quantity
+        self.total_cost -= cost
+        return cost
+
+    # Adds an input to the running totals
+    def add(self, quantity, unit_price):
+        self.total_quantity += quantity
+        self.total_cost += quantity * unit_price
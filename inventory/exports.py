@@ -0,0 +1,73 @@
+import csv
+import json
+
+from .models import Factor
+
+# Columns written for every Factor row, in this order
+LEDGER_EXPORT_FIELDS = ['id', 'ware_id', 'type', 'quantity', 'purchase_price', 'total_cost', 'created_at']
+
+# Number of rows fetched from the database at a time while exporting
+EXPORT_CHUNK_SIZE = 2000
+
+
+# Function to build the queryset of Factor rows to export
+# Rows are ordered by ID so an interrupted export can be resumed with after_id
+def ledger_queryset(ware_id=None, factor_type=None, created_after=None, created_before=None, after_id=None):
+    factors = Factor.objects.order_by('id')
+    if ware_id is not None:
+        factors = factors.filter(ware_id=ware_id)
+    if factor_type is not None:
+        factors = factors.filter(type=factor_type)
+    if created_after is not None:
+        factors = factors.filter(created_at__gte=created_after)
+    if created_before is not None:
+        factors = factors.filter(created_at__lt=created_before)
+    if after_id is not None:
+        factors = factors.filter(id__gt=after_id)
+    return factors
+
+
+# Function to yield the rows of a queryset as plain values, a chunk at a time
+# Only EXPORT_CHUNK_SIZE rows are held in memory however large the ledger is
+def ledger_rows(factors, chunk_size=EXPORT_CHUNK_SIZE):
+    for row in factors.values_list(*LEDGER_EXPORT_FIELDS).iterator(chunk_size=chunk_size):
+        yield [format_value(value) for value in row]
+
+
+# Function to turn a database value into its exported text form
+def format_value(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, str)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)  # Decimals are exported as exact strings
+
+
+# Function to yield the rows as newline-delimited JSON, one object per line
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(LEDGER_EXPORT_FIELDS, row)), separators=(',', ':')) + '\n'
+
+
+# Function to yield the rows as CSV lines, starting with a header line
+def iter_csv(rows):
+    writer = csv.writer(LineBuffer())
+    yield writer.writerow(LEDGER_EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+# File-like object whose write() returns the line instead of storing it
+# Lets csv.writer produce lines for a generator without buffering the whole file
+class LineBuffer:
+    def write(self, value):
+        return value
+
+
+# Encoders and content types for each supported export format
+EXPORT_FORMATS = {
+    'ndjson': (iter_ndjson, 'application/x-ndjson'),
+    'csv': (iter_csv, 'text/csv'),
+}
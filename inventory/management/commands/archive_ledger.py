@@ -0,0 +1,137 @@
+import gzip
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from inventory.cache import bump_ledger_version_on_commit
+from inventory.exports import iter_ndjson, ledger_rows
+from inventory.models import Ware, Factor, StockBalance, LedgerCarryForward
+from inventory.views import aggregate_ledger, archive_cutoff, lock_stock_balances, rebuild_cogs_rollups
+
+# Number of Factor rows exported and deleted at a time
+ARCHIVE_BATCH_SIZE = 500
+
+
+# Command to move old transactions out of the Factor ledger into compressed NDJSON files
+# Archived are the rows created before --before that no later transaction depends on: every row of a
+# weighted-mean ware, and for a FIFO ware its outputs plus the oldest input lots those outputs used up.
+# Their totals are added to the ware's LedgerCarryForward row, so balances, point-in-time valuations
+# after the cutoff and cost replays stay exact; the COGS rollups of the archived days are kept.
+# Each ware is archived in its own transaction, to its own file, named
+# ware-<ID>-before-<DATE>-<TIMESTAMP>.ndjson.gz (the same columns as export_ledger).
+# Usage: python manage.py archive_ledger --before YYYY-MM-DD --output-dir DIR [--dry-run] [--ware ID ...]
+class Command(BaseCommand):
+    help = "Archive old, settled Factor rows to gzip NDJSON files and keep their totals as a carry-forward."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before',
+            type=parse_date,
+            required=True,
+            help="Date (YYYY-MM-DD, in TIME_ZONE); only rows created before it are archived."
+        )
+        parser.add_argument('--output-dir', required=True, help="Directory the archive files are written to.")
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Only report how many rows each ware would archive; nothing is written."
+        )
+        parser.add_argument('--ware', type=int, nargs='+', dest='ware_ids', help="Limit the command to these ware IDs.")
+
+    def handle(self, *args, **options):
+        before = options['before']
+        if before is None:
+            raise CommandError("--before must be a date in YYYY-MM-DD format.")
+        if before > timezone.localdate():
+            raise CommandError("--before cannot be in the future.")
+        if not options['dry_run']:
+            os.makedirs(options['output_dir'], exist_ok=True)
+
+        wares = Ware.objects.order_by('id')
+        if options['ware_ids']:
+            wares = wares.filter(id__in=options['ware_ids'])
+
+        stamp = timezone.now().strftime('%Y%m%d%H%M%S')
+        archived_wares = 0
+        archived_rows = 0
+        for ware in wares.iterator():
+            path = os.path.join(options['output_dir'], f"ware-{ware.id}-before-{before.isoformat()}-{stamp}.ndjson.gz")
+            count = archive_ware(ware, before, None if options['dry_run'] else path)
+            if count:
+                archived_wares += 1
+                archived_rows += count
+                self.stdout.write(f"Ware {ware.id} ({ware.name}): {count} row(s)")
+
+        action = "Would archive" if options['dry_run'] else "Archived"
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {archived_rows} row(s) of {archived_wares} ware(s) created before {before.isoformat()}."
+        ))
+
+
+# Function to archive the settled rows of one ware created before a day, in one transaction
+# Returns the number of rows archived; when path is None nothing is written
+def archive_ware(ware, before, path):
+    with transaction.atomic():
+        if path is not None:
+            # Outputs on the ware wait until the archive is done, so no lot changes underneath it
+            lock_stock_balances([ware.id])
+        carry = LedgerCarryForward.objects.filter(ware=ware).first()
+        factor_ids = archivable_factor_ids(ware, archive_cutoff(before), carry)
+        if not factor_ids or path is None:
+            return len(factor_ids)
+
+        # The archived days drop out of rollup rebuilds, so they are made exact from the ledger first
+        rebuild_cogs_rollups([ware.id])
+
+        if carry is None:
+            carry = LedgerCarryForward(ware=ware, archived_before=before)
+        carry.archived_before = max(carry.archived_before, before)
+        try:
+            with gzip.open(path, 'wt', encoding='utf-8') as archive:
+                for start in range(0, len(factor_ids), ARCHIVE_BATCH_SIZE):
+                    factors = Factor.objects.filter(id__in=factor_ids[start:start + ARCHIVE_BATCH_SIZE]).order_by('id')
+                    archive.writelines(iter_ndjson(ledger_rows(factors)))
+                    totals = aggregate_ledger(factors)
+                    for field in ('input_quantity', 'output_quantity', 'input_cost', 'output_cost'):
+                        setattr(carry, field, getattr(carry, field) + totals[field])
+                    factors.delete()  # Removes the FIFO layers of archived inputs too
+            carry.archived_rows += len(factor_ids)
+            carry.save()
+
+            # History pages change, so cached responses and ETags of the ware must change too
+            StockBalance.objects.filter(ware=ware).update(version=F('version') + 1)
+            bump_ledger_version_on_commit(ware.id)
+        except BaseException:
+            # Nothing was deleted, so the file would only duplicate rows that are still in the ledger
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+    return len(factor_ids)
+
+
+# Function to list the IDs of the rows of a ware that can be archived, oldest first
+# A FIFO ware keeps every input lot that still has units left, or that outputs after the cutoff
+# may take from; only the prefix of lots the archived outputs used up completely goes
+def archivable_factor_ids(ware, cutoff, carry):
+    factors = Factor.objects.filter(ware=ware, created_at__lt=cutoff).order_by('created_at', 'id')
+    if ware.cost_method != 'fifo':
+        return list(factors.values_list('id', flat=True))
+
+    outputs = list(factors.filter(type='output').values_list('id', 'quantity'))
+    consumed = sum(quantity for _, quantity in outputs)  # Units taken by every archived output
+    position = 0  # Units in every archived lot
+    if carry is not None:
+        consumed += carry.output_quantity
+        position = carry.input_quantity
+
+    inputs = []
+    lots = factors.filter(type='input').values_list('id', 'quantity', 'fifo_layer__remaining_quantity')
+    for factor_id, quantity, remaining in lots.iterator():
+        if remaining != 0 or position + quantity > consumed:
+            break
+        position += quantity
+        inputs.append(factor_id)
+    return sorted(inputs + [factor_id for factor_id, _ in outputs])
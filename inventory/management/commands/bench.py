@@ -0,0 +1,364 @@
+import json
+import math
+import platform
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, reset_queries, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.conf import settings
+from django.utils import timezone
+from inventory.costing import LotBook
+from inventory.models import Ware
+from inventory.views import output_queue, record_inputs
+
+
+# Command to generate synthetic wares and transactions and measure the API under that load
+# By default everything runs in a throwaway test database, so the real database is never touched.
+# Usage: python manage.py bench [--wares N] [--factors M] [--fifo-ratio R] [--lot-size SPEC] [--concurrency C]
+#        [--output-queue] [--fast-validation] [--engine] [--json FILE]
+class Command(BaseCommand):
+    help = "Load-test the inventory endpoints with synthetic data and report latency, throughput and query counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wares', type=int, default=50, help="Number of wares to create.")
+        parser.add_argument('--factors', type=int, default=2000, help="Number of input/output requests to send.")
+        parser.add_argument('--output-ratio', type=float, default=0.4, help="Share of those requests that are outputs.")
+        parser.add_argument('--fifo-ratio', type=float, default=0.5, help="Share of wares using FIFO; the rest use Weighted Mean.")
+        parser.add_argument(
+            '--lot-size',
+            type=Distribution,
+            default=Distribution('uniform:1:100'),
+            help="Input quantity distribution: fixed:N, uniform:LOW:HIGH or lognormal:MU:SIGMA."
+        )
+        parser.add_argument(
+            '--output-size',
+            type=Distribution,
+            default=Distribution('uniform:1:20'),
+            help="Output quantity distribution, same syntax as --lot-size."
+        )
+        parser.add_argument('--preload', type=int, default=0, help="Input lots bulk-loaded per ware before measuring, for deep ledgers.")
+        parser.add_argument('--valuations', type=int, default=500, help="Number of valuation requests to send.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, so runs can be compared.")
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=1,
+            help="Number of threads sending the input/output requests at the same time."
+        )
+        parser.add_argument(
+            '--output-queue',
+            action='store_true',
+            help="Send outputs through the output queue (INVENTORY_OUTPUT_QUEUE_ENABLED) and also time their completion."
+        )
+        parser.add_argument(
+            '--fast-validation',
+            action='store_true',
+            help="Validate single inputs and outputs without the serializers (INVENTORY_FAST_VALIDATION)."
+        )
+        parser.add_argument('--json', dest='json_path', help="Write the results to this JSON file.")
+        parser.add_argument(
+            '--engine',
+            action='store_true',
+            help="Benchmark only the FIFO costing engine: --factors lots, consumed by outputs until empty. No database is used."
+        )
+        parser.add_argument(
+            '--current-db',
+            action='store_true',
+            help="Run against the configured database instead of a throwaway test database (data is left behind)."
+        )
+
+    def handle(self, *args, **options):
+        if options['wares'] < 1:
+            raise CommandError("--wares must be at least 1.")
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1.")
+
+        if options['engine']:
+            results = Benchmark(options).run_engine()
+        else:
+            results = self.run_endpoints(options)
+
+        for name, stats in results['endpoints'].items():
+            latency = stats['latency_ms']
+            queries = f"{stats['queries']['mean']:>5.1f} queries/req" if stats['queries'] else ''
+            cpu = f"  cpu {stats['cpu_ms']['mean']:>6.2f} ms/req" if stats['cpu_ms'] else ''
+            self.stdout.write(
+                f"{name:<28} {stats['requests']:>6} req  {stats['throughput_rps']:>8.1f} req/s  "
+                f"p50 {latency['p50']:>7.2f} ms  p95 {latency['p95']:>7.2f} ms  p99 {latency['p99']:>7.2f} ms  "
+                f"{queries}{cpu}"
+            )
+        if results.get('transactions'):
+            transactions = results['transactions']
+            self.stdout.write(
+                f"{'inputs and outputs':<28} {transactions['requests']:>6} req  {transactions['throughput_rps']:>8.1f} req/s "
+                f"over {transactions['wall_seconds']:.2f} s with {transactions['concurrency']} thread(s)"
+            )
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['json_path']}."))
+
+
+    # Runs the endpoint benchmark, in a throwaway test database unless --current-db is given
+    def run_endpoints(self, options):
+        old_name = None
+        if not options['current_db']:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # The test client talks to the app as host "testserver"
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                INVENTORY_OUTPUT_QUEUE_ENABLED=options['output_queue'],
+                INVENTORY_FAST_VALIDATION=options['fast_validation']
+            ):
+                return Benchmark(options).run()
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+# Random quantity distribution parsed from "fixed:N", "uniform:LOW:HIGH" or "lognormal:MU:SIGMA"
+class Distribution:
+    def __init__(self, spec):
+        self.spec = spec
+        kind, *params = spec.split(':')
+        try:
+            params = [float(param) for param in params]
+        except ValueError:
+            raise ValueError(f"Invalid distribution {spec!r}")
+        if (kind, len(params)) not in (('fixed', 1), ('uniform', 2), ('lognormal', 2)):
+            raise ValueError(f"Invalid distribution {spec!r}")
+        self.kind = kind
+        self.params = params
+
+    # Draws a positive whole quantity
+    def sample(self, rng):
+        if self.kind == 'fixed':
+            value = self.params[0]
+        elif self.kind == 'uniform':
+            value = rng.randint(int(self.params[0]), int(self.params[1]))
+        else:
+            value = rng.lognormvariate(*self.params)
+        return max(1, int(round(value)))
+
+    def __str__(self):
+        return self.spec
+
+
+# Class that drives the endpoints and collects the measurements
+class Benchmark:
+    def __init__(self, options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.client = Client()
+        self.lock = threading.Lock()  # Guards the measurements while --concurrency threads record them
+        self.samples = {}  # Endpoint name -> list of (seconds, queries, status code, CPU seconds)
+        self.elapsed = {}  # Endpoint name -> total seconds spent in its requests
+        self.tickets = []  # IDs of the outputs accepted by the output queue
+        self.transactions = None  # Wall-clock totals of the input/output phase
+
+    def run(self):
+        started_at = timezone.now()
+        ware_ids = self.create_wares()
+        self.preload(ware_ids)
+        self.send_transactions(ware_ids)
+        self.send_valuations(ware_ids)
+        return self.results(started_at)
+
+    # Times the FIFO costing engine on its own: adding lots, then consuming them all
+    def run_engine(self):
+        started_at = timezone.now()
+        book = LotBook()
+        for _ in range(self.options['factors']):
+            quantity = self.options['lot_size'].sample(self.rng)
+            started = time.perf_counter()
+            book.add(quantity, self.random_price())
+            self.record('engine-add-lot', time.perf_counter() - started, 0, None)
+        while book.available:
+            quantity = min(self.options['output_size'].sample(self.rng), book.available)
+            started = time.perf_counter()
+            book.consume(quantity)
+            self.record('engine-consume', time.perf_counter() - started, 0, None)
+        return self.results(started_at)
+
+    def results(self, started_at):
+        return {
+            'meta': {
+                'started_at': started_at.isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': None if self.options['engine'] else connection.vendor,
+                'database_profile': getattr(settings, 'DATABASE_PROFILE', None),
+                'sqlite_pragmas': (
+                    getattr(settings, 'INVENTORY_SQLITE_PRAGMAS', {})
+                    if connection.vendor == 'sqlite' and not self.options['engine'] else None
+                ),
+                'parameters': {
+                    key: str(value) if isinstance(value, Distribution) else value
+                    for key, value in self.options.items()
+                    if key in ('wares', 'factors', 'output_ratio', 'fifo_ratio', 'lot_size',
+                               'output_size', 'preload', 'valuations', 'seed', 'concurrency',
+                               'output_queue', 'fast_validation', 'engine')
+                },
+            },
+            'endpoints': {name: self.summarize(name) for name in self.samples},
+            'transactions': self.transactions,
+        }
+
+    # Sends one request and records its latency, query count, status code and the CPU time of its thread
+    # Threads pass their own client; connection is already per thread
+    def request(self, name, method, path, data=None, client=None):
+        client = client or self.client
+        reset_queries()  # The query log is capped, and counts go wrong once it is full
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            cpu_started = time.thread_time()
+            if method == 'post':
+                response = client.post(path, data, content_type='application/json')
+            else:
+                response = client.get(path, data)
+            cpu_seconds = time.thread_time() - cpu_started
+            seconds = time.perf_counter() - started
+        self.record(name, seconds, len(queries), response.status_code, cpu_seconds)
+        return response
+
+    def record(self, name, seconds, queries, status_code, cpu_seconds=None):
+        with self.lock:
+            self.samples.setdefault(name, []).append((seconds, queries, status_code, cpu_seconds))
+            self.elapsed[name] = self.elapsed.get(name, 0.0) + seconds
+
+    def create_wares(self):
+        ware_ids = []
+        for index in range(self.options['wares']):
+            cost_method = 'fifo' if self.rng.random() < self.options['fifo_ratio'] else 'weighted_mean'
+            response = self.request('create-ware', 'post', '/api/wares/', {
+                'name': f"Bench ware {index}",
+                'cost_method': cost_method
+            })
+            ware_ids.append(response.json()['id'])
+        return ware_ids
+
+    # Bulk-loads input lots so the measured requests run against a deep ledger
+    def preload(self, ware_ids):
+        if not self.options['preload']:
+            return
+        wares = Ware.objects.in_bulk(ware_ids)
+        entries = [
+            (wares[ware_id], self.options['lot_size'].sample(self.rng), self.random_price())
+            for ware_id in ware_ids
+            for _ in range(self.options['preload'])
+        ]
+        for start in range(0, len(entries), 5000):
+            with transaction.atomic():
+                record_inputs(entries[start:start + 5000])
+
+    # Sends the input and output requests, from --concurrency threads at once when it is above 1
+    # The requests are drawn up front, so a seed gives the same requests at any concurrency
+    def send_transactions(self, ware_ids):
+        requests = []
+        for _ in range(self.options['factors']):
+            ware_id = self.rng.choice(ware_ids)
+            if self.rng.random() < self.options['output_ratio']:
+                requests.append(('inventory-output', '/api/inventory/output/', {
+                    'ware_id': ware_id,
+                    'quantity': self.options['output_size'].sample(self.rng)
+                }))
+            else:
+                requests.append(('inventory-input', '/api/inventory/input/', {
+                    'ware_id': ware_id,
+                    'quantity': self.options['lot_size'].sample(self.rng),
+                    'purchase_price': str(self.random_price())
+                }))
+
+        concurrency = self.options['concurrency']
+        started = time.perf_counter()
+        if concurrency == 1:
+            self.send_share(requests, self.client)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                shares = [requests[index::concurrency] for index in range(concurrency)]
+                for _ in pool.map(self.send_threaded_share, shares):
+                    pass
+        self.wait_for_tickets()
+        wall_seconds = time.perf_counter() - started
+        self.transactions = {
+            'requests': len(requests),
+            'concurrency': concurrency,
+            # Until the last queued output was recorded, not only accepted
+            'wall_seconds': round(wall_seconds, 3),
+            'throughput_rps': round(len(requests) / wall_seconds, 1) if wall_seconds else None,
+        }
+
+    def send_share(self, requests, client):
+        for name, path, data in requests:
+            response = self.request(name, 'post', path, data, client=client)
+            if response.status_code == 202:
+                self.tickets.append(response.json()['ticket_id'])
+
+    def send_threaded_share(self, requests):
+        try:
+            self.send_share(requests, Client())
+        finally:
+            connections.close_all()  # Connections of this thread would otherwise stay open
+
+    # Waits until every queued output is recorded and times each one from acceptance to completion
+    def wait_for_tickets(self):
+        for ticket_id in self.tickets:
+            ticket = output_queue.get(ticket_id)
+            if not ticket.finished.wait(timeout=60):
+                raise CommandError(f"Queued output {ticket_id} was not recorded within 60 seconds.")
+            self.record('inventory-output-completion', ticket.finished_at - ticket.enqueued_at, None, ticket.status)
+
+    def send_valuations(self, ware_ids):
+        for _ in range(self.options['valuations']):
+            self.request('inventory-valuation', 'get', '/api/inventory/valuation/', {'ware_id': self.rng.choice(ware_ids)})
+
+    def random_price(self):
+        return Decimal(self.rng.randint(100, 10000)) / 100
+
+    # Builds the statistics of one endpoint
+    def summarize(self, name):
+        samples = self.samples[name]
+        latencies = sorted(seconds * 1000 for seconds, _, _, _ in samples)
+        queries = [count for _, count, _, _ in samples if count is not None]  # Unknown for queued completions
+        cpu = sorted(cpu_seconds * 1000 for _, _, _, cpu_seconds in samples if cpu_seconds is not None)
+        status_counts = {}
+        for _, _, code, _ in samples:
+            if code is not None:
+                status_counts[str(code)] = status_counts.get(str(code), 0) + 1
+        return {
+            'requests': len(samples),
+            'status_counts': status_counts,
+            'throughput_rps': round(len(samples) / self.elapsed[name], 1) if self.elapsed[name] else None,
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 3),
+                'p50': round(percentile(latencies, 50), 3),
+                'p95': round(percentile(latencies, 95), 3),
+                'p99': round(percentile(latencies, 99), 3),
+                'max': round(latencies[-1], 3),
+            },
+            'queries': {
+                'mean': round(sum(queries) / len(queries), 2),
+                'max': max(queries),
+            } if queries else None,
+            # CPU time spent by the thread that served the request, including the test client itself
+            'cpu_ms': {
+                'mean': round(sum(cpu) / len(cpu), 3),
+                'p50': round(percentile(cpu, 50), 3),
+                'p99': round(percentile(cpu, 99), 3),
+            } if cpu else None,
+        }
+
+
+# Function to read a percentile from sorted values (nearest-rank method)
+def percentile(sorted_values, percent):
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
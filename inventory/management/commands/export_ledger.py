@@ -0,0 +1,54 @@
+import argparse
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from inventory.exports import EXPORT_FORMATS, EXPORT_CHUNK_SIZE, ledger_queryset, ledger_rows
+
+
+# Command to write the Factor ledger to a file (or stdout) as NDJSON or CSV
+# Usage: python manage.py export_ledger [--format csv] [--output FILE] [--ware ID] [--type input|output]
+#        [--created-after ISO] [--created-before ISO] [--after-id ID]
+class Command(BaseCommand):
+    help = "Stream the Factor ledger as NDJSON or CSV, optionally filtered and resumed after a factor ID."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson', dest='file_format')
+        parser.add_argument('--output', help="File to write to; defaults to standard output.")
+        parser.add_argument('--ware', type=int, dest='ware_id', help="Only export rows of this ware.")
+        parser.add_argument('--type', choices=['input', 'output'], dest='factor_type')
+        parser.add_argument('--created-after', type=aware_datetime, help="ISO timestamp; rows created at or after it.")
+        parser.add_argument('--created-before', type=aware_datetime, help="ISO timestamp; rows created before it.")
+        parser.add_argument('--after-id', type=int, help="Resume after this factor ID.")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        factors = ledger_queryset(
+            ware_id=options['ware_id'],
+            factor_type=options['factor_type'],
+            created_after=options['created_after'],
+            created_before=options['created_before'],
+            after_id=options['after_id']
+        )
+        encode, _ = EXPORT_FORMATS[options['file_format']]
+        lines = encode(ledger_rows(factors, chunk_size=options['chunk_size']))
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
+
+
+# Argument type for ISO timestamps; timestamps without a time zone are taken in TIME_ZONE
+def aware_datetime(value):
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None  # Well formed but out of range, e.g. month 13
+    if parsed is None:
+        raise argparse.ArgumentTypeError(f"{value!r} is not an ISO timestamp")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
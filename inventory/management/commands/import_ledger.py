@@ -0,0 +1,242 @@
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from django.db.models import Max
+from inventory.models import Ware, Factor, StockBalance, FifoLayer, LedgerCarryForward, ValuationSnapshot
+from inventory.views import (
+    PURCHASE_PRICE_FIELD,
+    archive_cutoff,
+    get_cost_state,
+    lock_stock_balances,
+    update_cogs_rollups,
+    update_stock_balance,
+)
+
+
+# Command to load a historical ledger from a CSV or NDJSON file
+# Each row needs: ware (name), type (input/output), quantity, purchase_price (inputs only) and
+# optionally created_at (ISO timestamp) and cost_method (used when the ware does not exist yet).
+# Rows must be in chronological order. The whole file is imported in one transaction.
+# Rows of an existing ware continue its ledger: they cannot be dated before its latest (or archived) row
+# or valuation snapshot, since its later outputs and snapshots were already computed without them. Outputs on the imported wares wait until the
+# import is done.
+# Usage: python manage.py import_ledger FILE [--format csv|ndjson] [--chunk-size N]
+class Command(BaseCommand):
+    help = (
+        "Bulk-import historical inputs and outputs, costing outputs in memory per ware. Rows of an existing "
+        "ware cannot be dated before its latest ledger row or valuation snapshot."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or NDJSON file to import.")
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'ndjson'],
+            dest='file_format',
+            help="File format; guessed from the file extension when omitted."
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Rows written per bulk insert.")
+
+    def handle(self, *args, **options):
+        file_format = options['file_format'] or ('csv' if options['path'].endswith('.csv') else 'ndjson')
+        importer = LedgerImporter(options['chunk_size'])
+        started = time.perf_counter()
+
+        with open(options['path'], newline='') as source, transaction.atomic():
+            for line_number, row in read_rows(source, file_format):
+                try:
+                    importer.add(row)
+                except (KeyError, ValueError, TypeError, InvalidOperation) as exc:
+                    raise CommandError(f"Line {line_number}: {exc}")
+            importer.finish()
+
+        elapsed = time.perf_counter() - started
+        rate = importer.rows / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {importer.rows} rows for {len(importer.wares)} wares "
+            f"({importer.created_wares} new) in {elapsed:.2f}s, {rate:.0f} rows/s."
+        ))
+
+
+# Function to yield (line number, row dict) pairs from the file without reading it all at once
+def read_rows(source, file_format):
+    if file_format == 'csv':
+        # Line 1 is the header
+        for line_number, row in enumerate(csv.DictReader(source), start=2):
+            yield line_number, row
+    else:
+        for line_number, line in enumerate(source, start=1):
+            if line.strip():
+                yield line_number, json.loads(line)
+
+
+# Class that turns imported rows into Factor, FifoLayer and StockBalance rows
+# Outputs are costed against in-memory cost states, exactly as the output endpoints would cost them,
+# and rows are written with bulk_create every chunk_size rows
+class LedgerImporter:
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.created_wares = 0
+        self.wares = {}  # Ware by name
+        self.states = {}  # Cost state by ware name
+        self.on_hand = {}  # Units on hand by ware name
+        self.last_created_at = {}  # Timestamp of the ware's latest row by ware name, to check ordering
+        self.ledger_ends = {}  # Timestamp of an existing ware's latest ledger row by ware name
+        self.changes = {}  # (quantity, value) change to each ware's balance by ware name
+        self.pending_wares = []  # New wares not yet inserted
+        self.pending_factors = []  # Factors not yet inserted
+        self.new_layers = []  # FIFO layers not yet inserted
+
+    # Function to process one imported row
+    def add(self, row):
+        ware = self.get_ware(row)
+        state = self.get_state(ware)
+        factor_type = row['type']
+        quantity = int(row['quantity'])
+        if quantity <= 0:
+            raise ValueError("quantity must be a positive integer")
+        created_at = parse_datetime(row['created_at']) if row.get('created_at') else timezone.now()
+        if created_at is None:
+            raise ValueError(f"invalid created_at {row['created_at']!r}")
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+        ledger_end = self.ledger_ends.get(ware.name)
+        if ledger_end is not None and created_at < ledger_end:
+            raise ValueError(
+                f"ware {ware.name!r} already has ledger rows or snapshots up to {ledger_end.isoformat()}; "
+                "earlier rows cannot be imported"
+            )
+        if created_at < self.last_created_at.get(ware.name, created_at):
+            raise ValueError(f"rows for ware {ware.name!r} are not in chronological order")
+        self.last_created_at[ware.name] = created_at
+
+        if factor_type == 'input':
+            # Checked like the input endpoints do, so the stored cost matches the price outputs are costed at
+            try:
+                purchase_price = PURCHASE_PRICE_FIELD.to_internal_value(row['purchase_price'])
+            except ValidationError as error:
+                raise ValueError(f"invalid purchase_price {row['purchase_price']!r}: {' '.join(error.detail)}")
+            if purchase_price <= 0:
+                raise ValueError("purchase_price must be a positive number for input rows")
+            factor = Factor(
+                ware=ware,
+                quantity=quantity,
+                purchase_price=purchase_price,
+                total_cost=quantity * purchase_price,
+                type='input',
+                created_at=created_at
+            )
+            if ware.cost_method == 'fifo':
+                layer = FifoLayer(
+                    ware=ware,
+                    factor=factor,
+                    purchase_price=purchase_price,
+                    remaining_quantity=quantity,
+                    created_at=created_at
+                )
+                state.add_layer(layer)
+                self.new_layers.append(layer)
+            else:
+                state.add_input(quantity, purchase_price)
+            self.on_hand[ware.name] += quantity
+        elif factor_type == 'output':
+            total_cost = state.consume(quantity) if self.on_hand[ware.name] >= quantity else None
+            if total_cost is None:
+                raise ValueError(f"insufficient stock of {ware.name!r} for an output of {quantity}")
+            factor = Factor(
+                ware=ware,
+                quantity=quantity,
+                # Round the cost the same way the database stores it, so the balance matches the ledger
+                total_cost=total_cost.quantize(Decimal('0.01')),
+                type='output',
+                created_at=created_at
+            )
+            self.on_hand[ware.name] -= quantity
+        else:
+            raise ValueError("type must be 'input' or 'output'")
+
+        sign = 1 if factor_type == 'input' else -1
+        quantity_change, value_change = self.changes.get(ware.name, (0, Decimal('0.00')))
+        self.changes[ware.name] = (quantity_change + sign * quantity, value_change + sign * factor.total_cost)
+
+        self.pending_factors.append(factor)
+        self.rows += 1
+        if len(self.pending_factors) >= self.chunk_size:
+            self.flush()
+
+    # Function to find a ware by name, queueing it for creation if it does not exist yet
+    def get_ware(self, row):
+        name = row['ware']
+        ware = self.wares.get(name)
+        if ware is None:
+            ware = Ware.objects.filter(name=name).first()
+            if ware is None:
+                if row.get('cost_method') not in ('fifo', 'weighted_mean'):
+                    raise ValueError(f"ware {name!r} does not exist and the row has no valid cost_method")
+                ware = Ware(name=name, cost_method=row['cost_method'])
+                self.pending_wares.append(ware)
+                self.created_wares += 1
+            self.wares[name] = ware
+        return ware
+
+    # Function to load the cost state of a ware the first time it is seen
+    def get_state(self, ware):
+        state = self.states.get(ware.name)
+        if state is None:
+            # A new ware (not saved yet) starts with an empty state and no stock
+            state = get_cost_state(ware)
+            self.on_hand[ware.name] = 0
+            if ware.pk is not None:
+                # Held until the import commits, so no output takes from the layers loaded below meanwhile
+                lock_stock_balances([ware.id])
+                self.ledger_ends[ware.name] = self.get_ledger_end(ware)
+                if ware.cost_method == 'fifo':
+                    state.load_all()  # Imported layers go after all existing open layers
+                balance = StockBalance.objects.filter(ware=ware).first()
+                self.on_hand[ware.name] = balance.quantity if balance else 0
+            self.states[ware.name] = state
+        return state
+
+    # Function to return the timestamp of an existing ware's latest ledger row or valuation snapshot,
+    # archived rows included
+    def get_ledger_end(self, ware):
+        ends = [
+            Factor.objects.filter(ware=ware).aggregate(Max('created_at'))['created_at__max'],
+            ValuationSnapshot.objects.filter(ware=ware).aggregate(Max('taken_at'))['taken_at__max'],
+        ]
+        ledger_end = max((end for end in ends if end is not None), default=None)
+        carry = LedgerCarryForward.objects.filter(ware=ware).first()
+        if carry is not None:
+            archived_end = archive_cutoff(carry.archived_before)
+            ledger_end = archived_end if ledger_end is None else max(ledger_end, archived_end)
+        return ledger_end
+
+    # Function to write the pending wares and factors, and the layers that can no longer change
+    def flush(self):
+        Ware.objects.bulk_create(self.pending_wares)
+        self.pending_wares = []
+        Factor.objects.bulk_create(self.pending_factors)
+        update_cogs_rollups(self.pending_factors)
+        self.pending_factors = []
+
+        # Exhausted layers are final; open ones may still be consumed by later rows
+        exhausted = [layer for layer in self.new_layers if layer.remaining_quantity == 0]
+        FifoLayer.objects.bulk_create(exhausted)
+        self.new_layers = [layer for layer in self.new_layers if layer.remaining_quantity > 0]
+
+    # Function to write everything still pending and update the balances
+    def finish(self):
+        self.flush()
+        FifoLayer.objects.bulk_create(self.new_layers)
+        self.new_layers = []
+        for state in self.states.values():
+            state.save()  # Existing layers consumed by imported outputs
+        for name, (quantity, value) in self.changes.items():
+            update_stock_balance(self.wares[name], quantity, value)
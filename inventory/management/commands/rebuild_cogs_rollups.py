@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from inventory.models import CogsRollup
+from inventory.views import calculate_ledger_cogs_rollups, rebuild_cogs_rollups, unarchived_days
+
+
+# Command to rebuild (or just verify) the daily COGS rollups from the Factor ledger
+# The rollups of days before a ware's archive cutoff are kept as they are
+# Usage: python manage.py rebuild_cogs_rollups [--verify] [--ware ID ...]
+class Command(BaseCommand):
+    help = "Rebuild or verify the daily cost of goods sold rollups from the Factor ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help="Only compare the rollups with the ledger and report mismatches; nothing is written."
+        )
+        parser.add_argument(
+            '--ware',
+            type=int,
+            nargs='+',
+            dest='ware_ids',
+            help="Limit the command to these ware IDs."
+        )
+
+    def handle(self, *args, **options):
+        ware_ids = options['ware_ids']
+        if not options['verify']:
+            with transaction.atomic():
+                rebuild_cogs_rollups(ware_ids)
+            self.stdout.write(self.style.SUCCESS("Rebuilt the COGS rollups from the ledger."))
+            return
+
+        expected = calculate_ledger_cogs_rollups(ware_ids)
+        # Days archived by archive_ledger can no longer be checked against the ledger
+        rollups = CogsRollup.objects.filter(unarchived_days())
+        if ware_ids:
+            rollups = rollups.filter(ware_id__in=ware_ids)
+        stored = {
+            (row[0], row[1]): tuple(row[2:])
+            for row in rollups.values_list('ware_id', 'day', 'input_quantity', 'input_value', 'output_quantity', 'cogs')
+        }
+
+        mismatches = 0
+        for key in sorted(expected.keys() | stored.keys()):
+            if expected.get(key) != stored.get(key):
+                mismatches += 1
+                self.stdout.write(f"Ware {key[0]} on {key[1]}: rollup {stored.get(key)}, ledger {expected.get(key)}")
+        if mismatches:
+            raise CommandError(f"{mismatches} COGS rollup(s) do not match the ledger.")
+        self.stdout.write(self.style.SUCCESS("All COGS rollups match the ledger."))
@@ -0,0 +1,293 @@
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import F
+from inventory.cache import bump_ledger_version_on_commit
+from inventory.costing import LotBook, MovingAverage
+from inventory.models import Ware, Factor, StockBalance, FifoLayer, LedgerCarryForward, ValuationSnapshot
+from inventory.views import lock_stock_balances, rebuild_cogs_rollups
+
+# Number of Factor rows fetched at a time while a ware is replayed
+REPLAY_CHUNK_SIZE = 2000
+
+# Number of rows written per bulk query
+WRITE_BATCH_SIZE = 500
+
+# Number of times a ware is replayed when its ledger keeps changing before the corrections are written
+REPLAY_ATTEMPTS = 3
+
+# Columns of the --report file
+REPORT_FIELDS = ['ware_id', 'kind', 'object_id', 'stored', 'replayed']
+
+
+# Command to recompute output costs, FIFO layers and balances by replaying each ware's ledger
+# Wares are replayed in a process pool, one ware per task; the workers only read, and this process
+# writes the corrections in bulk, one transaction per ware. The write locks the ware's balance and
+# checks that nothing was recorded since the replay; if something was, the ware is replayed again.
+# Usage: python manage.py rebuild_costing [--dry-run] [--workers N] [--ware ID ...] [--report FILE]
+class Command(BaseCommand):
+    help = "Replay every ware's ledger to recompute output costs, FIFO layers and stock balances."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Only report the differences with the stored data; nothing is written."
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of worker processes; 1 replays in this process."
+        )
+        parser.add_argument(
+            '--ware',
+            type=int,
+            nargs='+',
+            dest='ware_ids',
+            help="Limit the command to these ware IDs."
+        )
+        parser.add_argument('--report', help="Write every difference to this CSV file.")
+
+    def handle(self, *args, **options):
+        wares = Ware.objects.order_by('id')
+        if options['ware_ids']:
+            wares = wares.filter(id__in=options['ware_ids'])
+        ware_ids = list(wares.values_list('id', flat=True))
+        started = time.perf_counter()
+
+        report = None
+        if options['report']:
+            report_file = open(options['report'], 'w', newline='')
+            report = csv.writer(report_file)
+            report.writerow(REPORT_FIELDS)
+
+        changed_wares = 0
+        differences = 0
+        try:
+            for result in self.replay(ware_ids, options['workers']):
+                result, diffs = self.settle(result, options['dry_run'])
+                if not diffs:
+                    continue
+                changed_wares += 1
+                differences += len(diffs)
+                for kind, object_id, stored, replayed in diffs:
+                    self.stdout.write(f"Ware {result['ware_id']}: {kind} {object_id}: {stored} -> {replayed}")
+                    if report is not None:
+                        report.writerow([result['ware_id'], kind, object_id, stored, replayed])
+        finally:
+            if report is not None:
+                report_file.close()
+
+        elapsed = time.perf_counter() - started
+        action = "Found" if options['dry_run'] else "Corrected"
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {differences} difference(s) in {changed_wares} of {len(ware_ids)} ware(s) in {elapsed:.2f}s."
+        ))
+
+    # Writes the corrections of a replay result unless this is a dry run
+    # A ware whose ledger changed since it was replayed is replayed again, here, with the new rows
+    # Returns the result that was written (or would be) and its differences
+    def settle(self, result, dry_run):
+        for _ in range(REPLAY_ATTEMPTS):
+            diffs = result_differences(result)
+            if not diffs or dry_run or apply_result(result):
+                return result, diffs
+            result = replay_ware(result['ware_id'])
+        raise CommandError(f"Ware {result['ware_id']} kept changing while it was replayed; run the command again.")
+
+    # Yields the replay result of every ware, computed in worker processes when workers > 1
+    def replay(self, ware_ids, workers):
+        if workers <= 1 or len(ware_ids) <= 1:
+            for ware_id in ware_ids:
+                yield replay_ware(ware_id)
+            return
+
+        # Workers open their own connections; none may be shared with this process
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            yield from pool.map(replay_ware, ware_ids, chunksize=max(1, len(ware_ids) // (workers * 4)))
+
+
+# Function run once in each worker process
+def init_worker():
+    django.setup()
+    connections.close_all()
+
+
+# Function to replay the ledger of one ware, oldest transaction first
+# Returns the stored and replayed output costs, FIFO layer quantities and balance of the ware
+def replay_ware(ware_id):
+    ware = Ware.objects.get(id=ware_id)
+    # Read before the ledger: every change bumps the version, so an unchanged version when the
+    # corrections are written means the rows read below are still the whole ledger
+    balance = StockBalance.objects.filter(ware_id=ware_id).values_list('quantity', 'total_value', 'version').first()
+    fifo = ware.cost_method == 'fifo'
+    book = LotBook()
+    average = MovingAverage()
+    lot_factors = []  # Input factor ID of each lot in the book
+    output_costs = {}  # Factor ID -> (stored, replayed) total cost of each output
+    shortages = []  # Output factor IDs that took more units than were on hand
+    corrected_from = None  # Creation time of the first output whose stored cost differs
+    quantity = 0
+    value = Decimal('0.00')
+    carried = 0  # Units the archived outputs took from lots still in the ledger
+
+    # Archived rows are replaced by their carry-forward totals
+    carry = LedgerCarryForward.objects.filter(ware_id=ware_id).first()
+    if carry is not None:
+        quantity = carry.input_quantity - carry.output_quantity
+        value = carry.input_cost - carry.output_cost
+        if fifo:
+            # Only fully consumed lots are archived, so the rest of what the archived outputs
+            # took comes from the oldest lots left in the ledger
+            carried = carry.output_quantity - carry.input_quantity
+        else:
+            average = MovingAverage(quantity, value)
+
+    factors = Factor.objects.filter(ware_id=ware_id).order_by('created_at', 'id').values_list(
+        'id', 'type', 'quantity', 'purchase_price', 'total_cost', 'created_at'
+    )
+    rows = factors.iterator(chunk_size=REPLAY_CHUNK_SIZE)
+    for factor_id, factor_type, factor_quantity, purchase_price, total_cost, created_at in rows:
+        if factor_type == 'input':
+            # An input recorded without a price opens its lot at 0.00, like FactorInputView does
+            purchase_price = purchase_price or Decimal('0.00')
+            if fifo:
+                book.add(factor_quantity, purchase_price)
+                lot_factors.append(factor_id)
+                if carried and book.available >= carried:
+                    book.consume(carried)
+                    carried = 0
+            else:
+                average.add(factor_quantity, purchase_price)
+            quantity += factor_quantity
+            value += total_cost
+            continue
+
+        state = book if fifo else average
+        available = book.available if fifo else average.total_quantity
+        if factor_quantity > available:
+            # Cost what was on hand; the ledger itself needs fixing
+            shortages.append(factor_id)
+            plan = state.consume(available) if available else None
+            cost = (plan.cost if fifo else plan) if plan is not None else Decimal('0.00')
+        else:
+            plan = state.consume(factor_quantity)
+            cost = plan.cost if fifo else plan
+        output_costs[factor_id] = (total_cost, cost)
+        if corrected_from is None and total_cost != cost:
+            corrected_from = created_at
+        quantity -= factor_quantity
+        value -= cost
+
+    stored_layers = {
+        factor_id: (layer_id, remaining_quantity)
+        for layer_id, factor_id, remaining_quantity in FifoLayer.objects.filter(ware_id=ware_id).values_list(
+            'id', 'factor_id', 'remaining_quantity'
+        )
+    }
+    layers = {}  # Input factor ID -> (layer ID or None, stored remaining, replayed remaining)
+    if fifo:
+        for index, factor_id in enumerate(lot_factors):
+            layer_id, stored = stored_layers.get(factor_id, (None, None))
+            layers[factor_id] = (layer_id, stored, book.remaining(index))
+
+    return {
+        'ware_id': ware_id,
+        'version': balance[2] if balance else None,
+        'output_costs': output_costs,
+        'layers': layers,
+        'shortages': shortages,
+        'corrected_from': corrected_from,
+        'balance': (balance[:2] if balance else None, (quantity, value)),
+    }
+
+
+# Function to list the differences in a replay result as (kind, object ID, stored, replayed)
+def result_differences(result):
+    diffs = [
+        ('output_cost', factor_id, stored, replayed)
+        for factor_id, (stored, replayed) in result['output_costs'].items()
+        if stored != replayed
+    ]
+    diffs += [
+        ('layer_remaining', factor_id, stored, replayed)
+        for factor_id, (_, stored, replayed) in result['layers'].items()
+        if stored != replayed
+    ]
+    diffs += [('insufficient_stock', factor_id, None, None) for factor_id in result['shortages']]
+    stored_balance, replayed_balance = result['balance']
+    if (tuple(stored_balance) if stored_balance else (0, 0)) != replayed_balance:
+        diffs.append(('balance', result['ware_id'], stored_balance, replayed_balance))
+    return diffs
+
+
+# Function to write the replayed values of one ware in bulk, in one transaction
+# Returns False, writing nothing, when the ware's ledger changed since the replay
+def apply_result(result):
+    ware_id = result['ware_id']
+    with transaction.atomic():
+        # Outputs on the ware wait until the corrections are written
+        lock_stock_balances([ware_id])
+        version = StockBalance.objects.filter(ware_id=ware_id).values_list('version', flat=True).first()
+        if version != result['version']:
+            return False
+
+        corrected = [
+            Factor(id=factor_id, total_cost=replayed)
+            for factor_id, (stored, replayed) in result['output_costs'].items()
+            if stored != replayed
+        ]
+        Factor.objects.bulk_update(corrected, ['total_cost'], batch_size=WRITE_BATCH_SIZE)
+        if corrected:
+            # Snapshots taken since the first corrected output hold its old cost; point-in-time
+            # valuations fall back to older snapshots until snapshot_valuations takes new ones
+            ValuationSnapshot.objects.filter(ware_id=ware_id, taken_at__gte=result['corrected_from']).delete()
+
+        layers = result['layers'].items()
+        FifoLayer.objects.bulk_update(
+            [
+                FifoLayer(id=layer_id, remaining_quantity=replayed)
+                for _, (layer_id, stored, replayed) in layers
+                if layer_id is not None and stored != replayed
+            ],
+            ['remaining_quantity'],
+            batch_size=WRITE_BATCH_SIZE
+        )
+        # Inputs that lost their layer get it back
+        missing = [factor_id for factor_id, (layer_id, _, _) in layers if layer_id is None]
+        FifoLayer.objects.bulk_create(
+            [
+                FifoLayer(
+                    ware_id=ware_id,
+                    factor=factor,
+                    purchase_price=factor.purchase_price or Decimal('0.00'),
+                    remaining_quantity=result['layers'][factor.id][2],
+                    created_at=factor.created_at
+                )
+                for factor in Factor.objects.filter(id__in=missing)
+            ],
+            batch_size=WRITE_BATCH_SIZE
+        )
+
+        stored_balance, (quantity, value) = result['balance']
+        if stored_balance is None:
+            StockBalance.objects.create(ware_id=ware_id, quantity=quantity, total_value=value, version=1)
+        else:
+            StockBalance.objects.filter(ware_id=ware_id).update(
+                quantity=quantity,
+                total_value=value,
+                version=F('version') + 1
+            )
+        bump_ledger_version_on_commit(ware_id)
+
+        # Corrected output costs change the ware's cost of goods sold
+        rebuild_cogs_rollups([ware_id])
+    return True
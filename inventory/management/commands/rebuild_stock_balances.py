@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from inventory.cache import bump_ledger_version_on_commit
+from inventory.models import Ware, StockBalance
+from inventory.views import calculate_ledger_valuation, lock_stock_balances
+
+
+# Command to rebuild (or just verify) the StockBalance table from the Factor ledger
+# The balance rows are also the moving-average cost state of weighted-mean wares, so --verify checks that state too
+# Usage: python manage.py rebuild_stock_balances [--verify] [--ware ID ...]
+class Command(BaseCommand):
+    help = "Rebuild or verify per-ware stock balances from the Factor ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help="Only compare balances with the ledger and report mismatches; nothing is written."
+        )
+        parser.add_argument(
+            '--ware',
+            type=int,
+            nargs='+',
+            dest='ware_ids',
+            help="Limit the command to these ware IDs."
+        )
+
+    def handle(self, *args, **options):
+        wares = Ware.objects.order_by('id')
+        if options['ware_ids']:
+            wares = wares.filter(id__in=options['ware_ids'])
+
+        mismatches = 0
+        for ware in wares.iterator():
+            # Compare and rewrite each ware in its own transaction
+            with transaction.atomic():
+                if not options['verify']:
+                    # Outputs on the ware wait, so the ledger read below is still current when the balance is written
+                    lock_stock_balances([ware.id])
+                quantity, value = calculate_ledger_valuation(ware)
+                balance = StockBalance.objects.filter(ware=ware).first()
+                current = (balance.quantity, balance.total_value) if balance else (0, 0)
+
+                if current == (quantity, value):
+                    continue
+
+                mismatches += 1
+                self.stdout.write(
+                    f"Ware {ware.id} ({ware.name}): balance {current[0]} units / {current[1]}, "
+                    f"ledger {quantity} units / {value}"
+                )
+                if not options['verify']:
+                    if balance:
+                        StockBalance.objects.filter(ware=ware).update(
+                            quantity=quantity,
+                            total_value=value,
+                            version=F('version') + 1
+                        )
+                    else:
+                        StockBalance.objects.create(ware=ware, quantity=quantity, total_value=value, version=1)
+                    bump_ledger_version_on_commit(ware.id)
+
+        if options['verify']:
+            if mismatches:
+                raise CommandError(f"{mismatches} stock balance(s) do not match the ledger.")
+            self.stdout.write(self.style.SUCCESS("All stock balances match the ledger."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {mismatches} stock balance(s)."))
@@ -0,0 +1,52 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from inventory.management.commands.export_ledger import aware_datetime
+from inventory.models import Ware, ValuationSnapshot
+from inventory.views import calculate_valuation_as_of
+
+
+# Command to record a valuation snapshot of every ware, for point-in-time valuations
+# Meant to run periodically (e.g. nightly from cron): python manage.py snapshot_valuations
+class Command(BaseCommand):
+    help = "Record the stock level and value of every ware at a point in time."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--at',
+            type=aware_datetime,
+            help="ISO timestamp to take the snapshot at, e.g. a past month end. Defaults to now minus --lag."
+        )
+        parser.add_argument(
+            '--lag',
+            type=int,
+            default=60,
+            help="Seconds to stay behind the current time, so transactions still in flight are not missed."
+        )
+        parser.add_argument('--ware', type=int, nargs='+', dest='ware_ids', help="Limit the snapshot to these ware IDs.")
+
+    def handle(self, *args, **options):
+        taken_at = options['at'] or timezone.now() - timedelta(seconds=options['lag'])
+        if taken_at > timezone.now():
+            raise CommandError("Snapshots cannot be taken in the future.")
+
+        wares = Ware.objects.order_by('id')
+        if options['ware_ids']:
+            wares = wares.filter(id__in=options['ware_ids'])
+
+        # Each snapshot is derived from the previous one plus the transactions in between,
+        # so it agrees exactly with what a point-in-time valuation replays
+        snapshots = []
+        for ware in wares.iterator():
+            try:
+                quantity, value = calculate_valuation_as_of(ware, taken_at, raw=True)
+            except ValueError:
+                # The ledger of this ware is archived past that time
+                self.stdout.write(f"Skipped ware {ware.id}: its ledger before {taken_at.isoformat()} is archived.")
+                continue
+            snapshots.append(ValuationSnapshot(ware=ware, taken_at=taken_at, quantity=quantity, total_value=value))
+
+        with transaction.atomic():
+            ValuationSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f"Recorded {len(snapshots)} valuation snapshot(s) at {taken_at.isoformat()}."))
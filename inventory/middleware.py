@@ -0,0 +1,95 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('inventory.timing')
+
+
+# Middleware that measures each request: wall time, time spent in the database and number of queries
+# The numbers are sent back in a Server-Timing header and written as one JSON log line per request.
+# When INVENTORY_PROFILE_DIR is set, a sample of requests is also profiled and the profiles of slow
+# ones are dumped there (open them with python -m pstats or snakeviz).
+# Enabled with INVENTORY_TIMING_ENABLED; when disabled Django drops it at startup, so it costs nothing.
+# Queries are only timed on this thread's connections while the response is built, which misses
+# those of async views (run on the async ORM's thread) and of streaming bodies (run while the body
+# is sent). For those the database figures are left out instead of reported as zero.
+class RequestTimingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'INVENTORY_TIMING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.profile_dir = getattr(settings, 'INVENTORY_PROFILE_DIR', None)
+        self.profile_sample_rate = getattr(settings, 'INVENTORY_PROFILE_SAMPLE_RATE', 0.1)
+        self.profile_slow_ms = getattr(settings, 'INVENTORY_PROFILE_SLOW_MS', 200)
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        profiler = None
+        if self.profile_dir and random.random() < self.profile_sample_rate:
+            profiler = cProfile.Profile()
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            if profiler is not None:
+                try:
+                    profiler.enable()
+                except ValueError:
+                    profiler = None  # Another profiler is already running in this thread
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        total_ms = (time.perf_counter() - started) * 1000
+
+        match = request.resolver_match
+        view = match.view_name if match else None
+        timed = not response.streaming and not (match and iscoroutinefunction(match.func))
+        response['Server-Timing'] = f'total;dur={total_ms:.1f}'
+        if timed:
+            response['Server-Timing'] += f', db;dur={timer.duration * 1000:.1f};desc="{timer.count} queries"'
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 1),
+            'db_ms': round(timer.duration * 1000, 1) if timed else None,
+            'queries': timer.count if timed else None,
+        }))
+        if profiler is not None and total_ms >= self.profile_slow_ms:
+            self.dump_profile(profiler, view, total_ms)
+        return response
+
+    # Function to write a profile to the dump directory, named so slow views are easy to spot
+    def dump_profile(self, profiler, view, total_ms):
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{view or 'unresolved'}-{total_ms:.0f}ms-{os.getpid()}.prof"
+        profiler.dump_stats(os.path.join(self.profile_dir, name.replace(':', '_')))
+
+
+# Database execute wrapper that counts queries and adds up the time spent running them
+class QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:54
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def backfill_stock_balances(apps, schema_editor):
+    # Seed one balance row per existing ware from the current state of the ledger
+    Ware = apps.get_model('inventory', 'Ware')
+    Factor = apps.get_model('inventory', 'Factor')
+    StockBalance = apps.get_model('inventory', 'StockBalance')
+
+    balances = []
+    for ware in Ware.objects.all():
+        inputs = Factor.objects.filter(ware=ware, type='input')
+        if ware.cost_method == 'fifo':
+            # FIFO input rows already hold their remaining quantity
+            quantity = sum(f.quantity for f in inputs)
+            value = sum((f.quantity * f.purchase_price for f in inputs), Decimal('0.00'))
+        else:
+            outputs = Factor.objects.filter(ware=ware, type='output')
+            quantity = sum(f.quantity for f in inputs) - sum(f.quantity for f in outputs)
+            value = (
+                sum((f.total_cost for f in inputs), Decimal('0.00'))
+                - sum((f.total_cost for f in outputs), Decimal('0.00'))
+            )
+        balances.append(StockBalance(ware=ware, quantity=quantity, total_value=value))
+    StockBalance.objects.bulk_create(balances)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockBalance',
+            fields=[
+                ('ware', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='inventory.ware')),
+                ('quantity', models.IntegerField(default=0)),
+                ('total_value', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+            ],
+        ),
+        migrations.RunPython(backfill_stock_balances, migrations.RunPython.noop),
+    ]
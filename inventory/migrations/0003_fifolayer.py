@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:54
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def create_layers_from_inputs(apps, schema_editor):
+    # Until now FIFO outputs reduced Factor.quantity on the input rows themselves.
+    # Move that remaining quantity into a layer and restore the original receipt
+    # quantity on the Factor, which is recoverable from its untouched total_cost.
+    Factor = apps.get_model('inventory', 'Factor')
+    FifoLayer = apps.get_model('inventory', 'FifoLayer')
+
+    inputs = Factor.objects.filter(ware__cost_method='fifo', type='input').order_by('created_at', 'id')
+    for factor in inputs.iterator():
+        FifoLayer.objects.create(
+            ware_id=factor.ware_id,
+            factor=factor,
+            purchase_price=factor.purchase_price or Decimal('0.00'),
+            remaining_quantity=factor.quantity,
+            created_at=factor.created_at
+        )
+        if factor.purchase_price:
+            factor.quantity = int(factor.total_cost / factor.purchase_price)
+            factor.save(update_fields=['quantity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0002_stockbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FifoLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('purchase_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('remaining_quantity', models.IntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('factor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fifo_layer', to='inventory.factor')),
+                ('ware', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fifo_layers', to='inventory.ware')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('remaining_quantity__gt', 0)), fields=['ware', 'created_at', 'id'], name='fifo_layer_open_idx')],
+            },
+        ),
+        migrations.RunPython(create_layers_from_inputs, migrations.RunPython.noop),
+    ]
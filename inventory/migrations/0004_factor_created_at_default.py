@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:01
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_fifolayer'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='factor',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_factor_created_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValuationSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('quantity', models.IntegerField()),
+                ('total_value', models.DecimalField(decimal_places=2, max_digits=15)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='factor',
+            index=models.Index(fields=['ware', 'created_at'], name='factor_ware_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='valuationsnapshot',
+            name='ware',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='valuation_snapshots', to='inventory.ware'),
+        ),
+        migrations.AddIndex(
+            model_name='valuationsnapshot',
+            index=models.Index(fields=['ware', 'taken_at'], name='snapshot_ware_taken_idx'),
+        ),
+    ]
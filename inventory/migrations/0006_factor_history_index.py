@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_valuationsnapshot'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='factor',
+            name='factor_ware_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='factor',
+            index=models.Index(fields=['ware', 'created_at', 'id'], name='factor_ware_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:18
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_cogs_rollups(apps, schema_editor):
+    # Seed the daily rollups from the existing ledger with one grouped query
+    Factor = apps.get_model('inventory', 'Factor')
+    CogsRollup = apps.get_model('inventory', 'CogsRollup')
+
+    money = models.DecimalField(max_digits=20, decimal_places=2)
+    rows = Factor.objects.annotate(day=TruncDate('created_at')).values('ware_id', 'day').annotate(
+        input_quantity=Sum('quantity', filter=Q(type='input'), default=0),
+        input_value=Sum('total_cost', filter=Q(type='input'), output_field=money, default=Decimal('0.00')),
+        output_quantity=Sum('quantity', filter=Q(type='output'), default=0),
+        cogs=Sum('total_cost', filter=Q(type='output'), output_field=money, default=Decimal('0.00')),
+    ).order_by()
+    CogsRollup.objects.bulk_create(
+        [
+            CogsRollup(
+                ware_id=row['ware_id'],
+                day=row['day'],
+                input_quantity=row['input_quantity'],
+                input_value=Decimal(row['input_value']).quantize(Decimal('0.01')),
+                output_quantity=row['output_quantity'],
+                cogs=Decimal(row['cogs']).quantize(Decimal('0.01')),
+            )
+            for row in rows
+        ],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_stockbalance_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CogsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('input_quantity', models.IntegerField(default=0)),
+                ('input_value', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('output_quantity', models.IntegerField(default=0)),
+                ('cogs', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('ware', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cogs_rollups', to='inventory.ware')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='cogs_rollup_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ware', 'day'), name='cogs_rollup_ware_day_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_cogs_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:20
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_cogsrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerCarryForward',
+            fields=[
+                ('ware', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='carry_forward', serialize=False, to='inventory.ware')),
+                ('archived_before', models.DateField()),
+                ('input_quantity', models.IntegerField(default=0)),
+                ('input_cost', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('output_quantity', models.IntegerField(default=0)),
+                ('output_cost', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('archived_rows', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def set_journal_mode(apps, schema_editor):
+    # The journal mode is stored in the database file, so it is set once here rather than on every connection
+    # The setting is only read here, so it takes effect for databases migrated after it was set
+    journal_mode = getattr(settings, 'INVENTORY_SQLITE_JOURNAL_MODE', None)
+    if schema_editor.connection.vendor != 'sqlite' or journal_mode is None:
+        return
+    if journal_mode.upper() not in ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'):
+        raise ValueError(f"Invalid SQLite journal mode {journal_mode!r}")
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+
+
+class Migration(migrations.Migration):
+    # SQLite cannot change into WAL mode inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('inventory', '0009_ledgercarryforward'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_journal_mode, migrations.RunPython.noop),
+    ]
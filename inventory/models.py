@@ -1,4 +1,6 @@
+from decimal import Decimal
 from django.db import models
+from django.utils import timezone
 
 # This model represents an individual product in the warehouse
 class Ware(models.Model):
@@ -43,8 +45,162 @@ class Factor(models.Model):
     )
     
     # Automatically record when the transaction was created
-    created_at = models.DateTimeField(auto_now_add=True)
+    # A default rather than auto_now_add, so historical imports can keep their original timestamps
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # Serves per-ware reads over a time range (e.g. replaying the rows after a valuation snapshot)
+            # and keyset pagination of a ware's history in (created_at, id) order
+            models.Index(fields=['ware', 'created_at', 'id'], name='factor_ware_created_id_idx'),
+        ]
 
     # String representation to display transaction info easily
     def __str__(self):
         return f"{self.type} - {self.ware.name} - {self.quantity} units"
+
+
+# This model keeps a running stock balance for each ware
+# It is updated in the same transaction as every input/output, so valuation never has to scan the ledger
+class StockBalance(models.Model):
+    # One balance row per ware; the ware's ID doubles as the primary key
+    ware = models.OneToOneField(
+        Ware,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='balance'
+    )
+
+    # Number of units currently on hand
+    quantity = models.IntegerField(default=0)
+
+    # Value of the units on hand (cost of inputs minus cost of outputs)
+    total_value = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+
+    # Incremented on every change to the balance; a cheap version of the ware's ledger for ETags
+    version = models.PositiveBigIntegerField(default=0)
+
+    # String representation to display the balance easily
+    def __str__(self):
+        return f"{self.ware.name} - {self.quantity} units on hand"
+
+
+# This model represents a FIFO cost layer (lot) opened by an input transaction
+# Outputs consume layers oldest first; the input Factor itself keeps the original receipt quantity
+class FifoLayer(models.Model):
+    # The ware this layer belongs to
+    ware = models.ForeignKey(Ware, on_delete=models.CASCADE, related_name='fifo_layers')
+
+    # The input transaction that opened this layer
+    factor = models.OneToOneField(Factor, on_delete=models.CASCADE, related_name='fifo_layer')
+
+    # Unit cost of the units in this layer
+    purchase_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    # Units of this layer not yet consumed by outputs
+    remaining_quantity = models.IntegerField()
+
+    # Copied from the input transaction so layers can be read in FIFO order without a join
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Only open layers are ever scanned, so exhausted ones are left out of the index
+            models.Index(
+                fields=['ware', 'created_at', 'id'],
+                condition=models.Q(remaining_quantity__gt=0),
+                name='fifo_layer_open_idx'
+            ),
+        ]
+
+    # String representation to display the layer easily
+    def __str__(self):
+        return f"{self.ware.name} - {self.remaining_quantity} units @ {self.purchase_price}"
+
+
+# This model records the stock level and value of a ware at a point in time
+# Snapshots are written periodically so past valuations only replay the transactions after one
+class ValuationSnapshot(models.Model):
+    # The ware that was valued
+    ware = models.ForeignKey(Ware, on_delete=models.CASCADE, related_name='valuation_snapshots')
+
+    # When the valuation was taken; it includes every transaction created up to this moment
+    taken_at = models.DateTimeField()
+
+    # Number of units on hand at that time
+    quantity = models.IntegerField()
+
+    # Value of the units on hand at that time
+    total_value = models.DecimalField(max_digits=15, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            # Finds the latest snapshot of a ware taken before a given time
+            models.Index(fields=['ware', 'taken_at'], name='snapshot_ware_taken_idx'),
+        ]
+
+    # String representation to display the snapshot easily
+    def __str__(self):
+        return f"{self.ware.name} - {self.quantity} units at {self.taken_at}"
+
+
+# This model holds the daily transaction totals of a ware, for cost of goods sold (COGS) reports
+# Every write path adds its transactions to the matching row in the same database transaction,
+# so reports never scan the ledger; rebuild_cogs_rollups recomputes the rows from the ledger
+class CogsRollup(models.Model):
+    # The ware the totals belong to
+    ware = models.ForeignKey(Ware, on_delete=models.CASCADE, related_name='cogs_rollups')
+
+    # The day (in TIME_ZONE) the transactions were created on
+    day = models.DateField()
+
+    # Units received and their cost
+    input_quantity = models.IntegerField(default=0)
+    input_value = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+
+    # Units shipped and their cost, the cost of goods sold
+    output_quantity = models.IntegerField(default=0)
+    cogs = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ware', 'day'], name='cogs_rollup_ware_day_unique'),
+        ]
+        indexes = [
+            # Warehouse-wide reports read a range of days across all wares
+            models.Index(fields=['day'], name='cogs_rollup_day_idx'),
+        ]
+
+    # String representation to display the rollup easily
+    def __str__(self):
+        return f"{self.ware.name} - {self.day}: {self.output_quantity} units shipped, COGS {self.cogs}"
+
+
+# This model sums up the part of a ware's ledger that was moved out of the Factor table by archive_ledger
+# Ledger-based calculations start from these totals, so they stay exact after archiving
+class LedgerCarryForward(models.Model):
+    # One row per archived ware; the ware's ID doubles as the primary key
+    ware = models.OneToOneField(
+        Ware,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='carry_forward'
+    )
+
+    # First day (in TIME_ZONE) that was not archived; every archived row was created before it
+    archived_before = models.DateField()
+
+    # Totals of the archived input rows
+    input_quantity = models.IntegerField(default=0)
+    input_cost = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+
+    # Totals of the archived output rows
+    output_quantity = models.IntegerField(default=0)
+    output_cost = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+
+    # Number of Factor rows archived
+    archived_rows = models.PositiveIntegerField(default=0)
+
+    # String representation to display the carry-forward easily
+    def __str__(self):
+        return f"{self.ware.name} - {self.archived_rows} rows archived before {self.archived_before}"
@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('inventory.output_queue')
+
+# Ticket statuses
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+# One queued output: its ware, quantity and, once applied, its result or error
+class OutputTicket:
+    def __init__(self, ware, quantity):
+        self.id = uuid.uuid4().hex
+        self.ware = ware
+        self.quantity = quantity
+        self.status = PENDING
+        self.result = None  # Response body of the recorded output
+        self.error = None  # Message of a failed output
+        self.enqueued_at = time.monotonic()
+        self.finished_at = None
+        self.finished = threading.Event()
+
+    def finish(self, result, error):
+        self.result = result
+        self.error = error
+        self.status = DONE if error is None else FAILED
+        self.finished_at = time.monotonic()
+        self.finished.set()
+
+
+# In-process queue of output transactions with one writer thread per ware
+# Outputs of a ware are applied in the order they were accepted, up to a batch of them per
+# transaction, so they never wait on each other's write lock. A ware's thread is started by the
+# first output queued for it and ends once its queue is empty.
+# The queue lives in memory: tickets are only known to the process that accepted them, and
+# outputs still queued when the process stops are lost.
+class OutputQueue:
+    def __init__(self, apply):
+        # apply(ware, quantities) records the outputs in one transaction and returns a
+        # (result, error) pair for each of them
+        self.apply = apply
+        self.lock = threading.Lock()
+        self.pending = {}  # Ware ID -> deque of tickets waiting for the ware's thread
+        self.tickets = {}  # Ticket ID -> ticket
+        self.finished = deque()  # Finished tickets, in the order they finished
+
+    # Queues an output and returns its ticket
+    def submit(self, ware, quantity):
+        ticket = OutputTicket(ware, quantity)
+        with self.lock:
+            self.prune()
+            self.tickets[ticket.id] = ticket
+            waiting = self.pending.get(ware.id)
+            if waiting is None:
+                waiting = self.pending[ware.id] = deque()
+                threading.Thread(target=self.drain, args=(ware.id,), name=f'output-queue-{ware.id}', daemon=True).start()
+            waiting.append(ticket)
+        return ticket
+
+    def get(self, ticket_id):
+        with self.lock:
+            return self.tickets.get(ticket_id)
+
+    # Drops finished tickets older than INVENTORY_OUTPUT_QUEUE_TICKET_TTL seconds; called with the lock held
+    # Pending tickets are not in the finished deque, so one stuck output does not keep the rest around
+    def prune(self):
+        expired_before = time.monotonic() - getattr(settings, 'INVENTORY_OUTPUT_QUEUE_TICKET_TTL', 3600)
+        while self.finished and self.finished[0].finished_at <= expired_before:
+            del self.tickets[self.finished.popleft().id]
+
+    # Body of a ware's thread: applies its queued outputs a batch at a time until none are left
+    def drain(self, ware_id):
+        batch_size = getattr(settings, 'INVENTORY_OUTPUT_QUEUE_BATCH_SIZE', 50)
+        try:
+            while True:
+                with self.lock:
+                    waiting = self.pending[ware_id]
+                    if not waiting:
+                        # The next output of the ware starts a new thread
+                        del self.pending[ware_id]
+                        return
+                    batch = [waiting.popleft() for _ in range(min(batch_size, len(waiting)))]
+                self.apply_batch(batch)
+        finally:
+            connections.close_all()
+
+    def apply_batch(self, batch):
+        try:
+            outcomes = self.apply(batch[0].ware, [ticket.quantity for ticket in batch])
+        except Exception:
+            logger.exception("Queued outputs of ware %s could not be recorded", batch[0].ware.id)
+            outcomes = [(None, "Output could not be recorded")] * len(batch)
+        with self.lock:
+            # Finished under the lock, so the finished deque stays in finishing order across wares
+            for ticket, (result, error) in zip(batch, outcomes):
+                ticket.finish(result, error)
+                self.finished.append(ticket)
@@ -1,6 +1,7 @@
 from decimal import Decimal
+from django.conf import settings
 from rest_framework import serializers
-from .models import Ware, Factor
+from .models import Ware, Factor, LedgerCarryForward
 
 # Serializer for the Ware model
 # This handles the creation and listing of Ware objects with their ID, name, and cost method
@@ -40,13 +41,53 @@ class FactorInputSerializer(serializers.ModelSerializer):
         return value
 
 
+# Serializer for a single line of a batch input request
+# Wares are looked up by the view in one query for the whole batch, so ware_id is a plain integer here
+class FactorInputBatchItemSerializer(serializers.Serializer):
+    ware_id = serializers.IntegerField()  # ID of the ware receiving stock
+    quantity = serializers.IntegerField()  # Quantity of ware received
+    purchase_price = serializers.DecimalField(max_digits=10, decimal_places=2)  # Unit price of the receipt
+
+    # Validates that the quantity is a positive integer
+    def validate_quantity(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Quantity must be a positive integer.")
+        return value
+
+    # Validates that the purchase price is a positive value
+    def validate_purchase_price(self, value):
+        if value <= Decimal('0.00'):
+            raise serializers.ValidationError("Purchase price must be a positive number for input transactions.")
+        return value
+
+
+# Serializer for the envelope of a batch request
+# Items are validated one by one by the view so that each line gets its own result
+class BatchRequestSerializer(serializers.Serializer):
+    items = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+    # 'all_or_nothing' rejects the whole batch if any line fails, 'partial' keeps the valid lines
+    mode = serializers.ChoiceField(choices=['all_or_nothing', 'partial'], default='all_or_nothing')
+
+    # Validates that the batch is not larger than the configured maximum
+    def validate_items(self, value):
+        max_size = getattr(settings, 'INVENTORY_BATCH_MAX_SIZE', 1000)
+        if len(value) > max_size:
+            raise serializers.ValidationError(f"A batch may contain at most {max_size} items.")
+        return value
+
+
 # Serializer for output transactions (removing stock from the inventory)
 # This serializer only requires the ware ID and quantity for stock output
 class FactorOutputSerializer(serializers.Serializer):
     ware_id = serializers.IntegerField()  # ID of the ware from which stock is being removed
     quantity = serializers.IntegerField()  # Quantity of ware to be removed
 
-    # You can add a validation function here to check if the quantity is available in stock
+    # Validates that the quantity is a positive integer
+    # Whether that quantity is available in stock is checked by the view while costing the output
+    def validate_quantity(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Quantity must be a positive integer.")
+        return value
 
 
 # Serializer for inventory valuation
@@ -55,6 +96,77 @@ class InventoryValuationSerializer(serializers.Serializer):
     ware_id = serializers.IntegerField()  # ID of the ware
     quantity_in_stock = serializers.IntegerField()  # Current quantity of ware in stock
     total_inventory_value = serializers.DecimalField(max_digits=15, decimal_places=2)  # Total value of ware in stock
+    as_of = serializers.DateTimeField(required=False)  # Point in time of a historical valuation, if one was asked for
+
+
+# Serializer for one row of the warehouse-wide valuation report
+class WareValuationSerializer(InventoryValuationSerializer):
+    name = serializers.CharField()  # Name of the ware
+    cost_method = serializers.CharField()  # Cost method of the ware
+
+
+# Serializer for the query parameters of the warehouse-wide valuation report
+class WarehouseValuationQuerySerializer(serializers.Serializer):
+    after = serializers.IntegerField(required=False)  # Return wares with an ID greater than this one (the cursor)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)  # Page size
+    cost_method = serializers.ChoiceField(choices=['fifo', 'weighted_mean'], required=False)  # Only wares using this method
+
+
+# Serializer for the query parameters of the inventory aging report
+class InventoryAgingQuerySerializer(serializers.Serializer):
+    ware_id = serializers.IntegerField(required=False)  # Only lots of this ware
+
+
+# Serializer for the query parameters of the cost of goods sold report
+class CogsReportQuerySerializer(serializers.Serializer):
+    start = serializers.DateField()  # First day of the range
+    end = serializers.DateField()  # Last day of the range, included
+    period = serializers.ChoiceField(choices=['day', 'month'], default='day')  # Length of each reported period
+    ware_id = serializers.IntegerField(required=False)  # Only this ware
+
+    def validate(self, data):
+        if data['start'] > data['end']:
+            raise serializers.ValidationError("start must not be after end.")
+        return data
+
+
+# Serializer for the filters of a ledger export
+class LedgerExportQuerySerializer(serializers.Serializer):
+    ware_id = serializers.IntegerField(required=False)  # Only rows of this ware
+    type = serializers.ChoiceField(choices=['input', 'output'], required=False)  # Only inputs or outputs
+    created_after = serializers.DateTimeField(required=False)  # Rows created at or after this time
+    created_before = serializers.DateTimeField(required=False)  # Rows created before this time
+    after_id = serializers.IntegerField(required=False)  # Resume after the last factor ID received
+    # Named file_format because DRF reserves ?format= for choosing a renderer
+    file_format = serializers.ChoiceField(choices=['ndjson', 'csv'], default='ndjson')
+
+
+# Serializer for the rows of a ware's transaction history
+class FactorSerializer(serializers.ModelSerializer):
+    factor_id = serializers.IntegerField(source='id')  # Renaming 'id' field to 'factor_id' like the other responses
+    ware_id = serializers.IntegerField()  # ID of the ware, read without loading the ware itself
+
+    class Meta:
+        model = Factor
+        fields = ['factor_id', 'ware_id', 'type', 'quantity', 'purchase_price', 'total_cost', 'created_at']
+
+
+# Serializer for the archived part of a ware's ledger, shown with its transaction history
+class LedgerCarryForwardSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LedgerCarryForward
+        fields = [
+            'archived_before', 'archived_rows', 'input_quantity', 'input_cost', 'output_quantity', 'output_cost'
+        ]
+
+
+# Serializer for the query parameters of a ware's transaction history
+class FactorHistoryQuerySerializer(serializers.Serializer):
+    cursor = serializers.CharField(required=False)  # The "next" value of the previous page
+    limit = serializers.IntegerField(min_value=1, max_value=500, default=50)  # Page size
+    type = serializers.ChoiceField(choices=['input', 'output'], required=False)  # Only inputs or outputs
+    created_after = serializers.DateTimeField(required=False)  # Rows created at or after this time
+    created_before = serializers.DateTimeField(required=False)  # Rows created before this time
 
 
 # Serializer for output transaction responses
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .cache import reset_ledger_version
+from .models import Ware
+
+
+# Start every new ware with a fresh ledger version, and drop it with the ware,
+# so cached valuations can never be served for a ware ID that was used before
+@receiver(post_save, sender=Ware)
+def reset_version_of_new_ware(sender, instance, created, **kwargs):
+    if created:
+        reset_ledger_version(instance.id)
+
+
+@receiver(post_delete, sender=Ware)
+def reset_version_of_deleted_ware(sender, instance, **kwargs):
+    reset_ledger_version(instance.id)
+
+
+# Pragmas that may be set through INVENTORY_SQLITE_PRAGMAS: the ones that only last for the connection
+# Settings stored in the database file, like journal_mode, are set once by a migration instead
+ALLOWED_SQLITE_PRAGMAS = {'synchronous', 'busy_timeout', 'mmap_size', 'cache_size', 'temp_store', 'foreign_keys'}
+
+
+# Apply INVENTORY_SQLITE_PRAGMAS to every new SQLite connection
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'INVENTORY_SQLITE_PRAGMAS', {}).items():
+            cursor.execute(sqlite_pragma_sql(name, value))
+
+
+# Function to build a PRAGMA statement, refusing names and values that are not plain settings
+# PRAGMA takes no query parameters, so the SQL is built from the setting itself
+def sqlite_pragma_sql(name, value):
+    if name not in ALLOWED_SQLITE_PRAGMAS:
+        raise ImproperlyConfigured(f"SQLite pragma {name!r} is not allowed in INVENTORY_SQLITE_PRAGMAS")
+    if not (isinstance(value, int) or (isinstance(value, str) and value.isalnum())):
+        raise ImproperlyConfigured(f"Invalid value {value!r} for SQLite pragma {name!r}")
+    return f'PRAGMA {name} = {value}'
@@ -1,8 +1,42 @@
-from django.test import TestCase
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import Ware, Factor
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from urllib.parse import urlencode
+from django.test.utils import CaptureQueriesContext
+from .models import Ware, Factor, StockBalance, FifoLayer, ValuationSnapshot, CogsRollup, LedgerCarryForward
+from .cache import get_valuation_cache, get_ledger_version
+from .views import (
+    calculate_inventory_valuation,
+    calculate_fifo_cost,
+    calculate_ledger_valuation,
+    record_inputs,
+    output_queue,
+    WeightedMeanCostState,
+)
+from .costing import LotBook
+from .output_queue import OutputQueue
+from .signals import sqlite_pragma_sql
+from .management.commands import rebuild_costing
 from decimal import Decimal
+from io import StringIO
+from datetime import datetime, timedelta, timezone as dt_timezone
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
 
 # Test case for the Warehouse Management System
 class WarehouseManagementTestCase(TestCase):
@@ -160,3 +194,1606 @@ class WarehouseManagementTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['quantity_in_stock'], 30)
         self.assertAlmostEqual(float(response.data['total_inventory_value']), 620.00, places=2)  # Approximate calculation
+
+
+# Test case for the materialized stock balance table
+class StockBalanceTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware_fifo = Ware.objects.create(name="Balance FIFO", cost_method="fifo")
+        self.ware_weighted = Ware.objects.create(name="Balance Weighted", cost_method="weighted_mean")
+
+    def post_input(self, ware, quantity, price):
+        return self.client.post('/api/inventory/input/', {
+            'ware_id': ware.id,
+            'quantity': quantity,
+            'purchase_price': price
+        }, format='json')
+
+    def post_output(self, ware, quantity):
+        return self.client.post('/api/inventory/output/', {
+            'ware_id': ware.id,
+            'quantity': quantity
+        }, format='json')
+
+    # Inputs and outputs should keep the balance row in step with the ledger
+    def test_balance_follows_transactions(self):
+        self.post_input(self.ware_fifo, 100, '20.00')
+        self.post_input(self.ware_fifo, 50, '22.00')
+        self.post_output(self.ware_fifo, 120)
+
+        balance = StockBalance.objects.get(ware=self.ware_fifo)
+        self.assertEqual(balance.quantity, 30)
+        self.assertEqual(balance.total_value, Decimal('660.00'))
+
+        self.post_input(self.ware_weighted, 100, '20.00')
+        self.post_input(self.ware_weighted, 50, '22.00')
+        self.post_output(self.ware_weighted, 120)
+
+        balance = StockBalance.objects.get(ware=self.ware_weighted)
+        self.assertEqual(balance.quantity, 30)
+        self.assertEqual(balance.total_value, Decimal('620.00'))
+
+    # A rejected output must not touch the balance
+    def test_insufficient_stock_leaves_balance(self):
+        self.post_input(self.ware_fifo, 10, '5.00')
+        response = self.post_output(self.ware_fifo, 11)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        balance = StockBalance.objects.get(ware=self.ware_fifo)
+        self.assertEqual(balance.quantity, 10)
+        self.assertEqual(balance.total_value, Decimal('50.00'))
+
+    # Valuation should be answered from the balance row in a single query
+    def test_valuation_reads_balance(self):
+        self.post_input(self.ware_fifo, 100, '20.00')
+        with self.assertNumQueries(1):
+            quantity, value = calculate_inventory_valuation(self.ware_fifo)
+        self.assertEqual(quantity, 100)
+        self.assertEqual(value, Decimal('2000.00'))
+
+        # A ware without transactions is valued at zero
+        self.assertEqual(calculate_inventory_valuation(self.ware_weighted), (0, Decimal('0.00')))
+
+    # The management command should detect and repair a drifted balance
+    def test_rebuild_stock_balances_command(self):
+        self.post_input(self.ware_weighted, 100, '20.00')
+        self.post_output(self.ware_weighted, 40)
+        StockBalance.objects.filter(ware=self.ware_weighted).update(quantity=0, total_value=Decimal('0.00'))
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_stock_balances', '--verify', stdout=StringIO())
+
+        call_command('rebuild_stock_balances', stdout=StringIO())
+        balance = StockBalance.objects.get(ware=self.ware_weighted)
+        self.assertEqual(balance.quantity, 60)
+        self.assertEqual(balance.total_value, Decimal('1200.00'))
+
+        call_command('rebuild_stock_balances', '--verify', stdout=StringIO())
+
+
+# Test case for FIFO cost layers
+class FifoLayerTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware = Ware.objects.create(name="Layered FIFO", cost_method="fifo")
+        for quantity, price in [(10, '1.00'), (10, '2.00'), (10, '3.00')]:
+            self.client.post('/api/inventory/input/', {
+                'ware_id': self.ware.id,
+                'quantity': quantity,
+                'purchase_price': price
+            }, format='json')
+
+    # Outputs consume layers oldest first and the input ledger keeps the receipt quantities
+    def test_output_consumes_layers(self):
+        response = self.client.post('/api/inventory/output/', {'ware_id': self.ware.id, 'quantity': 15}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_cost'], '20.00')  # 10 @ 1.00 + 5 @ 2.00
+
+        remaining = list(FifoLayer.objects.filter(ware=self.ware).order_by('id').values_list('remaining_quantity', flat=True))
+        self.assertEqual(remaining, [0, 5, 10])
+        receipts = list(Factor.objects.filter(ware=self.ware, type='input').order_by('id').values_list('quantity', flat=True))
+        self.assertEqual(receipts, [10, 10, 10])
+
+    # Exhausted layers are skipped and the consumption is written in a single bulk update
+    def test_output_reads_only_open_layers(self):
+        calculate_fifo_cost(self.ware, 10)
+        with CaptureQueriesContext(connection) as queries:
+            quantity, total_cost = calculate_fifo_cost(self.ware, 12)
+        self.assertEqual((quantity, total_cost), (12, Decimal('26.00')))
+        self.assertEqual(len(queries), 2)  # one ordered read of open layers, one bulk update
+
+    # An output that cannot be filled leaves every layer untouched
+    def test_insufficient_stock_keeps_layers(self):
+        self.assertEqual(calculate_fifo_cost(self.ware, 31), (None, None))
+        remaining = list(FifoLayer.objects.filter(ware=self.ware).values_list('remaining_quantity', flat=True))
+        self.assertEqual(remaining, [10, 10, 10])
+
+
+# Test case for the batch input endpoint
+class FactorInputBatchTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware_fifo = Ware.objects.create(name="Batch FIFO", cost_method="fifo")
+        self.ware_weighted = Ware.objects.create(name="Batch Weighted", cost_method="weighted_mean")
+
+    # A valid batch creates every factor, the FIFO layers and the balances
+    def test_batch_input_creates_all_items(self):
+        items = [
+            {'ware_id': self.ware_fifo.id, 'quantity': 10, 'purchase_price': '2.00'},
+            {'ware_id': self.ware_weighted.id, 'quantity': 5, 'purchase_price': '4.00'},
+            {'ware_id': self.ware_fifo.id, 'quantity': 20, 'purchase_price': '3.00'},
+        ]
+        response = self.client.post('/api/inventory/input/batch/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([r['status'] for r in response.data['results']], ['created'] * 3)
+        self.assertEqual(response.data['results'][2]['quantity'], 20)
+
+        self.assertEqual(Factor.objects.filter(type='input').count(), 3)
+        self.assertEqual(FifoLayer.objects.filter(ware=self.ware_fifo).count(), 2)
+        self.assertEqual(calculate_inventory_valuation(self.ware_fifo), (30, Decimal('80.00')))
+        self.assertEqual(calculate_inventory_valuation(self.ware_weighted), (5, Decimal('20.00')))
+
+    # The number of queries must not grow with the number of lines
+    def test_batch_input_query_count(self):
+        items = [{'ware_id': self.ware_fifo.id, 'quantity': 1, 'purchase_price': '1.00'}] * 200
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/inventory/input/batch/', items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertLess(len(queries), 20)  # Constant: balance and COGS rollup rows are written once per ware
+
+    # In all-or-nothing mode a single bad line rejects the whole batch
+    def test_batch_input_all_or_nothing(self):
+        items = [
+            {'ware_id': self.ware_fifo.id, 'quantity': 10, 'purchase_price': '2.00'},
+            {'ware_id': 9999, 'quantity': 10, 'purchase_price': '2.00'},
+            {'ware_id': self.ware_fifo.id, 'quantity': 0, 'purchase_price': '2.00'},
+        ]
+        response = self.client.post('/api/inventory/input/batch/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], ['skipped', 'error', 'error'])
+        self.assertIn('ware_id', results[1]['errors'])
+        self.assertIn('quantity', results[2]['errors'])
+        self.assertFalse(Factor.objects.exists())
+
+    # In partial mode the valid lines are stored and the bad ones reported
+    def test_batch_input_partial(self):
+        items = [
+            {'ware_id': 9999, 'quantity': 10, 'purchase_price': '2.00'},
+            {'ware_id': self.ware_fifo.id, 'quantity': 10, 'purchase_price': '2.00'},
+        ]
+        response = self.client.post('/api/inventory/input/batch/', {'items': items, 'mode': 'partial'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([r['status'] for r in response.data['results']], ['error', 'created'])
+        self.assertEqual(Factor.objects.count(), 1)
+
+    # A partial batch in which no line is valid records nothing and is refused
+    def test_batch_input_partial_all_invalid(self):
+        items = [
+            {'ware_id': 9999, 'quantity': 10, 'purchase_price': '2.00'},
+            {'ware_id': self.ware_fifo.id, 'quantity': 0, 'purchase_price': '2.00'},
+        ]
+        response = self.client.post('/api/inventory/input/batch/', {'items': items, 'mode': 'partial'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([r['status'] for r in response.data['results']], ['error', 'error'])
+        self.assertFalse(Factor.objects.exists())
+
+    # Balance rows are written in ware ID order whatever the order of the lines, as they are locked
+    def test_batch_writes_balances_in_ware_order(self):
+        wares = sorted([self.ware_fifo, self.ware_weighted], key=lambda ware: -ware.id)  # Highest ID first
+        for path, items in (
+            ('/api/inventory/input/batch/', [{'ware_id': ware.id, 'quantity': 5, 'purchase_price': '1.00'} for ware in wares]),
+            ('/api/inventory/output/batch/', [{'ware_id': ware.id, 'quantity': 1} for ware in wares]),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(path, {'items': items}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED, path)
+            written = [
+                query['sql'] for query in queries
+                if query['sql'].startswith('UPDATE "inventory_stockbalance"') and '"version"' in query['sql']
+            ]
+            self.assertEqual(len(written), 2, path)
+            self.assertIn(f'"ware_id" = {wares[1].id}', written[0], path)
+
+    # Batches above the configured size are refused outright
+    @override_settings(INVENTORY_BATCH_MAX_SIZE=2)
+    def test_batch_input_max_size(self):
+        items = [{'ware_id': self.ware_fifo.id, 'quantity': 1, 'purchase_price': '1.00'}] * 3
+        response = self.client.post('/api/inventory/input/batch/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('items', response.data)
+
+
+# Test case for the batch output endpoint
+class FactorOutputBatchTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware_fifo = Ware.objects.create(name="Picking FIFO", cost_method="fifo")
+        self.ware_weighted = Ware.objects.create(name="Picking Weighted", cost_method="weighted_mean")
+        self.client.post('/api/inventory/input/batch/', [
+            {'ware_id': self.ware_fifo.id, 'quantity': 10, 'purchase_price': '1.00'},
+            {'ware_id': self.ware_fifo.id, 'quantity': 10, 'purchase_price': '2.00'},
+            {'ware_id': self.ware_weighted.id, 'quantity': 100, 'purchase_price': '20.00'},
+            {'ware_id': self.ware_weighted.id, 'quantity': 50, 'purchase_price': '22.00'},
+        ], format='json')
+
+    # Lines for the same ware are costed in order against one cost state
+    def test_batch_output_costs_lines_in_order(self):
+        items = [
+            {'ware_id': self.ware_fifo.id, 'quantity': 5},
+            {'ware_id': self.ware_weighted.id, 'quantity': 120},
+            {'ware_id': self.ware_fifo.id, 'quantity': 10},
+        ]
+        response = self.client.post('/api/inventory/output/batch/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        results = response.data['results']
+        self.assertEqual(results[0]['total_cost'], '5.00')  # 5 @ 1.00
+        self.assertEqual(results[1]['total_cost'], '2480.00')
+        self.assertEqual(results[2]['total_cost'], '15.00')  # 5 @ 1.00 + 5 @ 2.00
+
+        self.assertEqual(Factor.objects.filter(type='output').count(), 3)
+        self.assertEqual(calculate_inventory_valuation(self.ware_fifo), (5, Decimal('10.00')))
+        self.assertEqual(calculate_inventory_valuation(self.ware_weighted), (30, Decimal('620.00')))
+
+    # The number of queries depends on the number of wares, not lines
+    def test_batch_output_query_count(self):
+        items = [{'ware_id': self.ware_fifo.id, 'quantity': 1}] * 20
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/inventory/output/batch/', items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertLess(len(queries), 12)
+
+    # In all-or-nothing mode a line without enough stock rejects the batch
+    def test_batch_output_all_or_nothing(self):
+        items = [
+            {'ware_id': self.ware_fifo.id, 'quantity': 15},
+            {'ware_id': self.ware_fifo.id, 'quantity': 10},
+        ]
+        response = self.client.post('/api/inventory/output/batch/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['results'][1]['errors'], {'error': 'Insufficient stock'})
+        self.assertFalse(Factor.objects.filter(type='output').exists())
+        self.assertEqual(calculate_inventory_valuation(self.ware_fifo), (20, Decimal('30.00')))
+
+    # In partial mode the lines that can be filled are shipped
+    def test_batch_output_partial(self):
+        items = [
+            {'ware_id': self.ware_fifo.id, 'quantity': 15},
+            {'ware_id': self.ware_fifo.id, 'quantity': 10},
+            {'ware_id': self.ware_fifo.id, 'quantity': 5},
+            {'ware_id': 9999, 'quantity': 1},
+        ]
+        response = self.client.post('/api/inventory/output/batch/', {'items': items, 'mode': 'partial'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([r['status'] for r in response.data['results']], ['created', 'error', 'created', 'error'])
+        self.assertEqual(calculate_inventory_valuation(self.ware_fifo), (0, Decimal('0.00')))
+
+    # A partial batch in which every line is invalid or out of stock ships nothing and is refused
+    def test_batch_output_partial_all_failed(self):
+        items = [
+            {'ware_id': self.ware_fifo.id, 'quantity': 100},
+            {'ware_id': 9999, 'quantity': 1},
+            {'ware_id': self.ware_fifo.id, 'quantity': 0},
+        ]
+        response = self.client.post('/api/inventory/output/batch/', {'items': items, 'mode': 'partial'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([r['status'] for r in response.data['results']], ['error', 'error', 'error'])
+        self.assertFalse(Factor.objects.filter(type='output').exists())
+        self.assertEqual(calculate_inventory_valuation(self.ware_fifo), (20, Decimal('30.00')))
+
+
+# Stress test firing many outputs at the same ware from parallel threads
+# TransactionTestCase is needed so the threads see committed data through their own connections
+class ConcurrentOutputStressTestCase(TransactionTestCase):
+    THREADS = 8
+    OUTPUTS_PER_THREAD = 10
+
+    def setUp(self):
+        self.ware_fifo = Ware.objects.create(name="Contended FIFO", cost_method="fifo")
+        self.ware_weighted = Ware.objects.create(name="Contended Weighted", cost_method="weighted_mean")
+        client = APIClient()
+        for ware in (self.ware_fifo, self.ware_weighted):
+            # Less stock than the threads will try to ship in total
+            client.post('/api/inventory/input/batch/', [
+                {'ware_id': ware.id, 'quantity': 5, 'purchase_price': '1.00'},
+                {'ware_id': ware.id, 'quantity': 45, 'purchase_price': '2.00'},
+            ], format='json')
+
+    def ship(self, ware):
+        client = APIClient()
+        codes = []
+        try:
+            for _ in range(self.OUTPUTS_PER_THREAD):
+                response = client.post('/api/inventory/output/', {'ware_id': ware.id, 'quantity': 1}, format='json')
+                codes.append(response.status_code)
+        finally:
+            connection.close()
+        return codes
+
+    def run_outputs(self, ware):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            codes = [code for result in pool.map(self.ship, [ware] * self.THREADS) for code in result]
+        elapsed = time.perf_counter() - started
+        return codes, len(codes) / elapsed
+
+    def assert_no_oversell(self, ware, codes):
+        # 80 outputs of 1 unit against 50 units on hand: exactly 50 may succeed
+        self.assertEqual(codes.count(status.HTTP_201_CREATED), 50)
+        self.assertEqual(codes.count(status.HTTP_400_BAD_REQUEST), 30)
+
+        balance = StockBalance.objects.get(ware=ware)
+        self.assertEqual(balance.quantity, 0)
+        self.assertEqual(balance.total_value, Decimal('0.00'))
+        self.assertEqual(Factor.objects.filter(ware=ware, type='output').count(), 50)
+
+    # Wall-clock speed depends on the machine, so it is only checked when WMS_PERF_TESTS is set;
+    # use bench --concurrency to measure it
+    def assert_throughput(self, throughput):
+        if os.environ.get('WMS_PERF_TESTS'):
+            self.assertGreater(throughput, 20)  # outputs per second
+
+    def test_concurrent_fifo_outputs(self):
+        codes, throughput = self.run_outputs(self.ware_fifo)
+        self.assert_no_oversell(self.ware_fifo, codes)
+        self.assertFalse(FifoLayer.objects.filter(ware=self.ware_fifo, remaining_quantity__lt=0).exists())
+        # 5 units @ 1.00 + 45 units @ 2.00, each unit shipped exactly once
+        costs = Factor.objects.filter(ware=self.ware_fifo, type='output').values_list('total_cost', flat=True)
+        self.assertEqual(sum(costs), Decimal('95.00'))
+        self.assert_throughput(throughput)
+
+    def test_concurrent_weighted_mean_outputs(self):
+        codes, throughput = self.run_outputs(self.ware_weighted)
+        self.assert_no_oversell(self.ware_weighted, codes)
+        self.assert_throughput(throughput)
+
+
+# Test case for the database-side ledger aggregates
+class LedgerAggregationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware = Ware.objects.create(name="Aggregated Weighted", cost_method="weighted_mean")
+        # Prices that are not exact in binary floating point
+        self.client.post('/api/inventory/input/batch/', [
+            {'ware_id': self.ware.id, 'quantity': 3, 'purchase_price': '0.10'},
+        ] * 500 + [
+            {'ware_id': self.ware.id, 'quantity': 7, 'purchase_price': '0.70'},
+        ] * 500, format='json')
+        self.client.post('/api/inventory/output/', {'ware_id': self.ware.id, 'quantity': 1000}, format='json')
+
+    # The ledger valuation is a single query with exact cents
+    def test_ledger_valuation_single_query(self):
+        with self.assertNumQueries(1):
+            quantity, value = calculate_ledger_valuation(self.ware)
+        # 1500 @ 0.10 + 3500 @ 0.70 = 2600.00, less 1000 units at the 0.52 average
+        self.assertEqual(quantity, 4000)
+        self.assertEqual(value, Decimal('2080.00'))
+
+    # The weighted mean cost state is read from the balance row in a single query
+    def test_weighted_mean_state_single_query(self):
+        with self.assertNumQueries(1):
+            state = WeightedMeanCostState(self.ware)
+        self.assertEqual(state.total_quantity, 4000)
+        self.assertEqual(state.total_cost, Decimal('2080.00'))
+        self.assertEqual(state.consume(10), Decimal('5.20'))
+
+
+# Test case for the warehouse-wide valuation report
+class WarehouseValuationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.wares = [
+            Ware.objects.create(name=f"Report {i}", cost_method='fifo' if i % 2 else 'weighted_mean')
+            for i in range(5)
+        ]
+        self.client.post('/api/inventory/input/batch/', [
+            {'ware_id': ware.id, 'quantity': 10 * (i + 1), 'purchase_price': '2.00'}
+            for i, ware in enumerate(self.wares[:4])
+        ], format='json')
+
+    # Every ware is listed, including those without transactions, and the totals cover the warehouse
+    def test_valuation_all(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/inventory/valuation/all/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['quantity_in_stock'] for r in response.data['results']], [10, 20, 30, 40, 0])
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(response.data['totals'], {
+            'ware_count': 5,
+            'quantity_in_stock': 100,
+            'total_inventory_value': '200.00'
+        })
+
+    # Pages follow the ware ID cursor
+    def test_valuation_all_keyset_pages(self):
+        response = self.client.get('/api/inventory/valuation/all/?limit=2')
+        self.assertEqual([r['ware_id'] for r in response.data['results']], [w.id for w in self.wares[:2]])
+        self.assertEqual(response.data['next'], self.wares[1].id)
+
+        response = self.client.get(f'/api/inventory/valuation/all/?limit=2&after={response.data["next"]}')
+        self.assertEqual([r['ware_id'] for r in response.data['results']], [w.id for w in self.wares[2:4]])
+
+    # Filtering by cost method applies to the rows and the totals
+    def test_valuation_all_cost_method_filter(self):
+        response = self.client.get('/api/inventory/valuation/all/?cost_method=fifo')
+        self.assertEqual([r['ware_id'] for r in response.data['results']], [self.wares[1].id, self.wares[3].id])
+        self.assertEqual(response.data['totals']['quantity_in_stock'], 60)
+
+        response = self.client.get('/api/inventory/valuation/all/?cost_method=lifo')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# Test case for the streaming ledger export
+class LedgerExportTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware_fifo = Ware.objects.create(name="Export FIFO", cost_method="fifo")
+        self.ware_weighted = Ware.objects.create(name="Export Weighted", cost_method="weighted_mean")
+        self.client.post('/api/inventory/input/batch/', [
+            {'ware_id': self.ware_fifo.id, 'quantity': 10, 'purchase_price': '1.50'},
+            {'ware_id': self.ware_weighted.id, 'quantity': 20, 'purchase_price': '2.00'},
+        ], format='json')
+        self.client.post('/api/inventory/output/', {'ware_id': self.ware_fifo.id, 'quantity': 4}, format='json')
+
+    def stream(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    # Every row is exported as one JSON object per line with exact decimals
+    def test_export_ndjson(self):
+        rows = [json.loads(line) for line in self.stream('/api/inventory/factors/export/').splitlines()]
+        self.assertEqual([row['type'] for row in rows], ['input', 'input', 'output'])
+        self.assertEqual(rows[0]['purchase_price'], '1.50')
+        self.assertEqual(rows[2]['total_cost'], '6.00')
+        self.assertIsNone(rows[2]['purchase_price'])
+
+    # Filters and the resume cursor narrow the export
+    def test_export_filters_and_resume(self):
+        first_id = Factor.objects.order_by('id').first().id
+        lines = self.stream(f'/api/inventory/factors/export/?ware_id={self.ware_fifo.id}&type=output').splitlines()
+        self.assertEqual(len(lines), 1)
+
+        lines = self.stream(f'/api/inventory/factors/export/?after_id={first_id}').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [first_id + 1, first_id + 2])
+
+    # CSV exports start with a header row
+    def test_export_csv(self):
+        rows = list(csv.reader(StringIO(self.stream('/api/inventory/factors/export/?file_format=csv'))))
+        self.assertEqual(rows[0], ['id', 'ware_id', 'type', 'quantity', 'purchase_price', 'total_cost', 'created_at'])
+        self.assertEqual(len(rows), 4)
+
+    # The management command writes the same rows
+    def test_export_ledger_command(self):
+        out = StringIO()
+        call_command('export_ledger', '--type', 'input', '--chunk-size', '1', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row['quantity'] for row in rows], [10, 20])
+
+    # Timestamps that cannot be parsed are rejected; naive ones are read in TIME_ZONE
+    def test_export_ledger_command_timestamps(self):
+        with self.assertRaises(CommandError):
+            call_command('export_ledger', '--created-after', 'garbage', stdout=StringIO())
+        out = StringIO()
+        call_command('export_ledger', '--created-before', '2000-01-01T00:00:00', stdout=out)
+        self.assertEqual(out.getvalue(), '')
+
+
+# Test case for the historical ledger import command
+class ImportLedgerTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', newline='') as output:
+            output.write(content)
+        return path
+
+    # Imported outputs are costed exactly like the output endpoint would cost them
+    def test_import_csv(self):
+        path = self.write_file('ledger.csv', (
+            "ware,cost_method,type,quantity,purchase_price,created_at\n"
+            "Imported FIFO,fifo,input,100,20.00,2023-01-01T08:00:00Z\n"
+            "Imported FIFO,,input,50,22.00,2023-01-02T08:00:00Z\n"
+            "Imported Weighted,weighted_mean,input,100,20.00,2023-01-02T09:00:00Z\n"
+            "Imported Weighted,,input,50,22.00,2023-01-03T08:00:00Z\n"
+            "Imported FIFO,,output,120,,2023-01-04T08:00:00Z\n"
+            "Imported Weighted,,output,120,,2023-01-04T09:00:00Z\n"
+        ))
+        out = StringIO()
+        call_command('import_ledger', path, '--chunk-size', '2', stdout=out)
+        self.assertIn('Imported 6 rows for 2 wares (2 new)', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+
+        fifo = Ware.objects.get(name="Imported FIFO")
+        weighted = Ware.objects.get(name="Imported Weighted")
+        self.assertEqual(Factor.objects.get(ware=fifo, type='output').total_cost, Decimal('2440.00'))
+        self.assertEqual(Factor.objects.get(ware=weighted, type='output').total_cost, Decimal('2480.00'))
+        self.assertEqual(Factor.objects.filter(ware=fifo).earliest('created_at').created_at.year, 2023)
+        self.assertEqual(
+            list(FifoLayer.objects.filter(ware=fifo).order_by('created_at').values_list('remaining_quantity', flat=True)),
+            [0, 30]
+        )
+        self.assertEqual(calculate_inventory_valuation(fifo), (30, Decimal('660.00')))
+        self.assertEqual(calculate_inventory_valuation(weighted), (30, Decimal('620.00')))
+        call_command('rebuild_stock_balances', '--verify', stdout=StringIO())
+
+    # Imported rows continue the stock of an existing ware
+    def test_import_ndjson_into_existing_ware(self):
+        ware = Ware.objects.create(name="Existing FIFO", cost_method="fifo")
+        APIClient().post('/api/inventory/input/', {'ware_id': ware.id, 'quantity': 10, 'purchase_price': '1.00'}, format='json')
+        path = self.write_file('ledger.ndjson', (
+            '{"ware": "Existing FIFO", "type": "input", "quantity": 10, "purchase_price": "3.00"}\n'
+            '{"ware": "Existing FIFO", "type": "output", "quantity": 15}\n'
+        ))
+        call_command('import_ledger', path, stdout=StringIO())
+        self.assertEqual(Factor.objects.get(ware=ware, type='output').total_cost, Decimal('25.00'))
+        self.assertEqual(calculate_inventory_valuation(ware), (5, Decimal('15.00')))
+
+    # Rows dated before an existing ware's ledger would be costed after it, so they are refused
+    def test_import_rejects_rows_before_existing_ledger(self):
+        ware = Ware.objects.create(name="Existing FIFO", cost_method="fifo")
+        APIClient().post('/api/inventory/input/', {'ware_id': ware.id, 'quantity': 10, 'purchase_price': '1.00'}, format='json')
+        path = self.write_file('ledger.ndjson', (
+            '{"ware": "Existing FIFO", "type": "input", "quantity": 10, "purchase_price": "3.00", "created_at": "2023-01-01T08:00:00Z"}\n'
+        ))
+        with self.assertRaisesMessage(CommandError, 'Line 1: ware \'Existing FIFO\' already has ledger rows or snapshots up to'):
+            call_command('import_ledger', path, stdout=StringIO())
+        self.assertEqual(Factor.objects.filter(ware=ware).count(), 1)
+
+    # Rows dated before a snapshot of the ware would be missing from the valuations built on it
+    def test_import_rejects_rows_before_snapshot(self):
+        path = self.write_file('first.ndjson', (
+            '{"ware": "Snapped", "cost_method": "fifo", "type": "input", "quantity": 10, "purchase_price": "1.00", "created_at": "2024-01-01T12:00:00Z"}\n'
+        ))
+        call_command('import_ledger', path, stdout=StringIO())
+        call_command('snapshot_valuations', '--at', '2024-01-02T00:00:00Z', stdout=StringIO())
+        path = self.write_file('second.ndjson', (
+            '{"ware": "Snapped", "type": "input", "quantity": 10, "purchase_price": "2.00", "created_at": "2024-01-01T18:00:00Z"}\n'
+        ))
+        with self.assertRaisesMessage(CommandError, 'snapshots up to 2024-01-02T00:00:00+00:00'):
+            call_command('import_ledger', path, stdout=StringIO())
+        self.assertEqual(Factor.objects.filter(ware__name="Snapped").count(), 1)
+
+    # Prices are checked like the input endpoints check them
+    def test_import_rejects_invalid_price(self):
+        for price in ('1.005', '123456789.00', 'abc'):
+            path = self.write_file('ledger.ndjson', (
+                f'{{"ware": "Priced", "cost_method": "fifo", "type": "input", "quantity": 3, "purchase_price": "{price}"}}\n'
+            ))
+            with self.assertRaisesMessage(CommandError, 'Line 1: invalid purchase_price'):
+                call_command('import_ledger', path, stdout=StringIO())
+        self.assertFalse(Ware.objects.filter(name="Priced").exists())
+
+    # A row that cannot be applied aborts the whole import
+    def test_import_rejects_oversell(self):
+        path = self.write_file('ledger.ndjson', (
+            '{"ware": "Short", "cost_method": "fifo", "type": "input", "quantity": 1, "purchase_price": "1.00"}\n'
+            '{"ware": "Short", "type": "output", "quantity": 2}\n'
+        ))
+        with self.assertRaisesMessage(CommandError, 'Line 2: insufficient stock'):
+            call_command('import_ledger', path, stdout=StringIO())
+        self.assertFalse(Ware.objects.filter(name="Short").exists())
+
+
+# Test case for point-in-time valuations backed by snapshots
+class ValuationAsOfTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware = Ware.objects.create(name="Audited FIFO", cost_method="fifo")
+        self.day = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        # Day 1: receive 100 @ 20.00, day 2: receive 50 @ 22.00, day 3: ship 120, day 5: receive 10 @ 30.00
+        for offset, payload in [
+            (1, {'quantity': 100, 'purchase_price': '20.00'}),
+            (2, {'quantity': 50, 'purchase_price': '22.00'}),
+            (5, {'quantity': 10, 'purchase_price': '30.00'}),
+        ]:
+            response = self.client.post('/api/inventory/input/', {'ware_id': self.ware.id, **payload}, format='json')
+            self.set_created_at(response.data['factor_id'], offset)
+        response = self.client.post('/api/inventory/output/', {'ware_id': self.ware.id, 'quantity': 120}, format='json')
+        self.set_created_at(response.data['factor_id'], 3)
+
+    def set_created_at(self, factor_id, offset):
+        Factor.objects.filter(id=factor_id).update(created_at=self.day + timedelta(days=offset))
+
+    def valuation(self, offset):
+        as_of = (self.day + timedelta(days=offset)).isoformat().replace('+00:00', 'Z')
+        response = self.client.get('/api/inventory/valuation/', {'ware_id': self.ware.id, 'as_of': as_of})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['quantity_in_stock'], response.data['total_inventory_value']
+
+    # Without snapshots the ledger is replayed up to the requested time
+    def test_valuation_as_of_from_ledger(self):
+        self.assertEqual(self.valuation(0), (0, '0.00'))
+        self.assertEqual(self.valuation(2), (150, '3100.00'))
+        self.assertEqual(self.valuation(4), (30, '660.00'))
+        self.assertEqual(self.valuation(6), (40, '960.00'))
+
+    # With a snapshot only the later rows are replayed on top of it
+    def test_valuation_as_of_uses_snapshot(self):
+        call_command('snapshot_valuations', '--at', (self.day + timedelta(days=4)).isoformat(), stdout=StringIO())
+        snapshot = ValuationSnapshot.objects.get(ware=self.ware)
+        self.assertEqual((snapshot.quantity, snapshot.total_value), (30, Decimal('660.00')))
+        self.assertEqual(self.valuation(6), (40, '960.00'))
+
+        # Earlier dates ignore the snapshot, later ones start from it
+        ValuationSnapshot.objects.filter(id=snapshot.id).update(quantity=31, total_value=Decimal('680.00'))
+        get_valuation_cache().clear()  # Snapshots are never edited, so nothing invalidates the cached valuations
+        self.assertEqual(self.valuation(2), (150, '3100.00'))
+        self.assertEqual(self.valuation(6), (41, '980.00'))
+
+    # An unparseable --at is an error rather than a snapshot at the current time
+    def test_snapshot_invalid_at(self):
+        with self.assertRaises(CommandError):
+            call_command('snapshot_valuations', '--at', 'garbage', stdout=StringIO())
+        self.assertFalse(ValuationSnapshot.objects.exists())
+
+    # Invalid timestamps are rejected
+    def test_valuation_as_of_invalid(self):
+        response = self.client.get('/api/inventory/valuation/', {'ware_id': self.ware.id, 'as_of': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# Test case for the keyset-paginated transaction history of a ware
+class WareFactorHistoryTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware = Ware.objects.create(name="History FIFO", cost_method="fifo")
+        self.other = Ware.objects.create(name="History Other", cost_method="fifo")
+        self.client.post('/api/inventory/input/batch/', [
+            {'ware_id': self.ware.id, 'quantity': i + 1, 'purchase_price': '1.00'} for i in range(7)
+        ] + [{'ware_id': self.other.id, 'quantity': 1, 'purchase_price': '1.00'}], format='json')
+        self.client.post('/api/inventory/output/', {'ware_id': self.ware.id, 'quantity': 3}, format='json')
+        # Give several rows the same timestamp so the id tie-breaker matters
+        same_time = timezone.now()
+        Factor.objects.filter(ware=self.ware, quantity__in=[2, 3, 4]).update(created_at=same_time)
+
+    def url(self, **params):
+        return f'/api/wares/{self.ware.id}/factors/?' + urlencode(params)
+
+    # Following the cursor visits every row exactly once, in (created_at, id) order
+    def test_history_pages(self):
+        expected = list(Factor.objects.filter(ware=self.ware).order_by('created_at', 'id').values_list('id', flat=True))
+        seen = []
+        response = self.client.get(self.url(limit=3))
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [row['factor_id'] for row in response.data['results']]
+            if response.data['next'] is None:
+                break
+            response = self.client.get(self.url(limit=3, cursor=response.data['next']))
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), 8)
+
+    # Filters narrow the history
+    def test_history_filters(self):
+        response = self.client.get(self.url(type='output'))
+        self.assertEqual([row['type'] for row in response.data['results']], ['output'])
+        self.assertEqual(response.data['results'][0]['total_cost'], '3.00')
+
+        response = self.client.get(self.url(created_before='2000-01-01T00:00:00Z'))
+        self.assertEqual(response.data['results'], [])
+
+    # Bad cursors and unknown wares are reported
+    def test_history_errors(self):
+        response = self.client.get(self.url(cursor='not-a-cursor'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/wares/9999/factors/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    # Deep pages are an index range read rather than an OFFSET scan
+    def test_history_uses_index(self):
+        plan = Factor.objects.filter(ware=self.ware).filter(
+            Q(created_at__gt=timezone.now()) | Q(created_at=timezone.now(), id__gt=1)
+        ).order_by('created_at', 'id')[:50].explain()
+        if connection.vendor == 'sqlite':
+            self.assertIn('factor_ware_created_id_idx', plan)
+
+
+# Test case for the valuation cache
+class ValuationCacheTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        get_valuation_cache().clear()
+        self.ware = Ware.objects.create(name="Cached FIFO", cost_method="fifo")
+
+    def post_input(self, quantity):
+        # Run the on-commit invalidation as a real commit would
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/inventory/input/', {
+                'ware_id': self.ware.id,
+                'quantity': quantity,
+                'purchase_price': '2.00'
+            }, format='json')
+
+    def valuation(self, as_of=None):
+        query = {'ware_id': self.ware.id}
+        if as_of:
+            query['as_of'] = as_of.isoformat()
+        response = self.client.get(f'/api/inventory/valuation/?{urlencode(query)}')
+        return response.data['quantity_in_stock']
+
+    def stats(self):
+        return self.client.get('/api/inventory/valuation/cache-stats/').data
+
+    # Repeated past valuations are served from the cache until the ledger changes
+    def test_cache_hits_and_invalidation(self):
+        self.post_input(10)
+        as_of = timezone.now()
+        self.assertEqual(self.valuation(as_of), 10)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.valuation(as_of), 10)
+        self.assertEqual(len(queries), 2)  # ETag version and ware lookup; the valuation came from the cache
+
+        self.post_input(5)
+        self.assertEqual(self.valuation(as_of), 10)
+        self.assertEqual(self.valuation(), 15)
+        self.assertEqual(self.stats(), {'hits': 1, 'misses': 2, 'hit_rate': 0.3333})
+
+    # The current valuation and valuations as of a time still to come are never cached
+    def test_current_valuation_not_cached(self):
+        self.post_input(10)
+        self.valuation()
+        self.valuation(timezone.now() + timedelta(days=1))
+        self.post_input(5)
+        self.assertEqual(self.valuation(), 15)
+        self.assertEqual(self.valuation(timezone.now() + timedelta(days=1)), 15)
+        self.assertEqual(self.stats(), {'hits': 0, 'misses': 0, 'hit_rate': None})
+
+    # A transaction that does not commit leaves the cached valuation valid
+    def test_cache_not_invalidated_without_commit(self):
+        self.post_input(10)
+        self.valuation()
+        version = get_ledger_version(self.ware.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/inventory/output/', {'ware_id': self.ware.id, 'quantity': 11}, format='json')
+        self.assertEqual(get_ledger_version(self.ware.id), version)
+
+    # A new ware never inherits cached valuations of an ID used before
+    def test_new_ware_starts_fresh_version(self):
+        version = get_ledger_version(self.ware.id)
+        ware_id = self.ware.id
+        self.ware.delete()
+        self.assertNotEqual(get_ledger_version(ware_id), version)
+
+
+# Test case for conditional GET on ware reads
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware = Ware.objects.create(name="Polled FIFO", cost_method="fifo")
+        self.client.post('/api/inventory/input/', {
+            'ware_id': self.ware.id,
+            'quantity': 10,
+            'purchase_price': '2.00'
+        }, format='json')
+        self.url = f'/api/inventory/valuation/?ware_id={self.ware.id}'
+
+    # A matching If-None-Match is answered with 304 from a single version read
+    def test_valuation_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+    # Any ledger change gives the ware a new ETag
+    def test_valuation_etag_changes_with_ledger(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.post('/api/inventory/output/', {'ware_id': self.ware.id, 'quantity': 1}, format='json')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    # The transaction history carries an ETag per page and filter
+    def test_history_etag(self):
+        url = f'/api/wares/{self.ware.id}/factors/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotEqual(self.client.get(url + '?type=input')['ETag'], etag)
+
+        # Unknown wares still get their 404
+        self.assertEqual(self.client.get('/api/wares/9999/factors/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BenchCommandTestCase(TestCase):
+    # A small run reports every endpoint and leaves a consistent ledger behind
+    def test_bench_reports_endpoints(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.json')
+            call_command(
+                'bench', '--current-db', '--wares', '4', '--factors', '40', '--valuations', '10',
+                '--preload', '3', '--lot-size', 'fixed:10', '--json', path, stdout=StringIO()
+            )
+            with open(path) as result_file:
+                results = json.load(result_file)
+
+        endpoints = results['endpoints']
+        self.assertEqual(
+            set(endpoints),
+            {'create-ware', 'inventory-input', 'inventory-output', 'inventory-valuation'}
+        )
+        self.assertEqual(endpoints['create-ware']['requests'], 4)
+        self.assertEqual(endpoints['inventory-input']['requests'] + endpoints['inventory-output']['requests'], 40)
+        for stats in endpoints.values():
+            self.assertLessEqual(stats['latency_ms']['p50'], stats['latency_ms']['p99'])
+            self.assertGreater(stats['queries']['mean'], 0)
+        self.assertEqual(Ware.objects.count(), 4)
+        call_command('rebuild_stock_balances', '--verify', stdout=StringIO())
+
+    # Distribution specs are validated by the argument parser
+    def test_bench_rejects_bad_distribution(self):
+        with self.assertRaises(CommandError):
+            call_command('bench', '--current-db', '--lot-size', 'normal:1', stdout=StringIO())
+
+
+@override_settings(INVENTORY_TIMING_ENABLED=True)
+class RequestTimingMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware = Ware.objects.create(name="Timed ware", cost_method="fifo")
+        with self.assertLogs('inventory.timing', level='INFO'):
+            self.client.post('/api/inventory/input/', {'ware_id': self.ware.id, 'quantity': 5, 'purchase_price': 2}, format='json')
+
+    # Each request gets a Server-Timing header and a JSON log line with its query count
+    def test_timing_header_and_log(self):
+        with self.assertLogs('inventory.timing', level='INFO') as logs:
+            response = self.client.post('/api/inventory/output/', {'ware_id': self.ware.id, 'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$')
+
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['view'], 'inventory-output')
+        self.assertEqual(entry['status'], 201)
+        self.assertGreater(entry['queries'], 0)
+        self.assertLessEqual(entry['db_ms'], entry['total_ms'])
+
+    # Async views and streaming bodies query outside the timer, so they report no database figures
+    def test_untimed_responses(self):
+        for path in (
+            f'/api/async/inventory/valuation/?ware_id={self.ware.id}',
+            '/api/inventory/factors/export/',
+        ):
+            with self.assertLogs('inventory.timing', level='INFO') as logs:
+                response = self.client.get(path)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, path)
+            self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+$', path)
+            entry = json.loads(logs.records[0].getMessage())
+            self.assertIsNone(entry['db_ms'], path)
+            self.assertIsNone(entry['queries'], path)
+
+    # Sampled requests slower than the threshold are dumped as cProfile files
+    def test_slow_requests_profiled(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(INVENTORY_PROFILE_DIR=directory, INVENTORY_PROFILE_SAMPLE_RATE=1, INVENTORY_PROFILE_SLOW_MS=0):
+                with self.assertLogs('inventory.timing', level='INFO'):
+                    APIClient().get(f'/api/inventory/valuation/?ware_id={self.ware.id}')
+            dumps = os.listdir(directory)
+        self.assertEqual(len(dumps), 1)
+        self.assertIn('inventory-valuation', dumps[0])
+
+    # Disabled, the middleware is dropped and adds no header
+    @override_settings(INVENTORY_TIMING_ENABLED=False)
+    def test_disabled(self):
+        response = APIClient().get(f'/api/inventory/valuation/?ware_id={self.ware.id}')
+        self.assertNotIn('Server-Timing', response)
+
+
+class AsyncReadViewTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.async_client = AsyncClient()
+        self.fifo_ware = Ware.objects.create(name="Async FIFO", cost_method="fifo")
+        self.mean_ware = Ware.objects.create(name="Async mean", cost_method="weighted_mean")
+        for ware in (self.fifo_ware, self.mean_ware):
+            self.client.post('/api/inventory/input/', {'ware_id': ware.id, 'quantity': 10, 'purchase_price': 3}, format='json')
+            self.client.post('/api/inventory/output/', {'ware_id': ware.id, 'quantity': 4}, format='json')
+
+    # The async reads return the same bodies as the sync views
+    async def test_matches_sync_views(self):
+        for path in (
+            f'inventory/valuation/?ware_id={self.fifo_ware.id}',
+            f'inventory/valuation/?ware_id={self.mean_ware.id}&as_of=2100-01-01T00:00:00Z',
+            'inventory/valuation/all/?limit=1',
+            f'wares/{self.fifo_ware.id}/factors/?limit=1',
+        ):
+            sync_response = await self.async_client.get(f'/api/{path}')
+            async_response = await self.async_client.get(f'/api/async/{path}')
+            self.assertEqual(async_response.status_code, status.HTTP_200_OK, path)
+            self.assertEqual(async_response.json(), sync_response.json(), path)
+            self.assertEqual('ETag' in async_response, 'ETag' in sync_response, path)
+
+    # Several wares are valued in one request, in the order asked for
+    async def test_many_wares(self):
+        ids = f'{self.mean_ware.id},{self.fifo_ware.id}'
+        response = await self.async_client.get(f'/api/async/inventory/valuation/?ware_ids={ids}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual([result['ware_id'] for result in results], [self.mean_ware.id, self.fifo_ware.id])
+        self.assertEqual([result['total_inventory_value'] for result in results], ['18.00', '18.00'])
+
+        empty_ware = await Ware.objects.acreate(name="Async empty", cost_method="fifo")
+        response = await self.async_client.get(
+            f'/api/async/inventory/valuation/?ware_ids={ids},{empty_ware.id}&as_of=2100-01-01T00:00:00Z'
+        )
+        results = response.json()['results']
+        self.assertEqual([result['total_inventory_value'] for result in results], ['18.00', '18.00', '0.00'])
+        self.assertEqual(results[0]['as_of'], '2100-01-01T00:00:00Z')
+
+        response = await self.async_client.get(f'/api/async/inventory/valuation/?ware_ids={ids},9999')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.get('/api/async/inventory/valuation/?ware_ids=1,x')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # The current valuations of a list of wares take one query for the wares and one for their balances
+    def test_many_wares_queries(self):
+        empty_ware = Ware.objects.create(name="Async empty", cost_method="fifo")
+        ids = f'{self.mean_ware.id},{self.fifo_ware.id},{empty_ware.id}'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/async/inventory/valuation/?ware_ids={ids}')
+        self.assertEqual([result['total_inventory_value'] for result in response.json()['results']], ['18.00', '18.00', '0.00'])
+        self.assertEqual(len(queries), 2)
+
+    # A matching If-None-Match is answered with 304
+    async def test_not_modified(self):
+        url = f'/api/async/wares/{self.fifo_ware.id}/factors/'
+        etag = (await self.async_client.get(url))['ETag']
+        response = await self.async_client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    # The sync write views keep working when served through the ASGI handler
+    async def test_sync_writes_through_asgi(self):
+        response = await self.async_client.post(
+            '/api/inventory/output/', {'ware_id': self.fifo_ware.id, 'quantity': 6}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['total_cost'], '18.00')
+
+        response = await self.async_client.get(f'/api/async/inventory/valuation/?ware_id={self.fifo_ware.id}')
+        self.assertEqual(response.json()['quantity_in_stock'], 0)
+
+
+# Test case for the perpetual moving average used by weighted-mean wares
+class MovingAverageTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware = Ware.objects.create(name="Moving Average", cost_method="weighted_mean")
+
+    def post_input(self, quantity, purchase_price):
+        self.client.post('/api/inventory/input/', {
+            'ware_id': self.ware.id, 'quantity': quantity, 'purchase_price': purchase_price
+        }, format='json')
+
+    def post_output(self, quantity):
+        return self.client.post('/api/inventory/output/', {'ware_id': self.ware.id, 'quantity': quantity}, format='json')
+
+    # Earlier outputs move the average: units left at 3.00 are mixed with the new ones at 5.00
+    def test_average_follows_outputs(self):
+        self.post_input(10, '3.00')
+        self.assertEqual(self.post_output(4).data['total_cost'], '12.00')
+        self.post_input(10, '5.00')
+        # (6 * 3.00 + 10 * 5.00) / 16 = 4.25, not the 4.00 average of all inputs
+        self.assertEqual(self.post_output(8).data['total_cost'], '34.00')
+        self.assertEqual(self.post_output(8).data['total_cost'], '34.00')
+        self.assertEqual(calculate_inventory_valuation(self.ware), (0, Decimal('0.00')))
+        self.assertEqual(StockBalance.objects.get(ware=self.ware).total_value, Decimal('0.00'))
+
+    # Rounding remainders go out with the last units, so the balance keeps matching the ledger
+    def test_rounding_stays_consistent(self):
+        self.post_input(1, '0.50')
+        self.post_input(2, '0.25')
+        costs = [self.post_output(1).data['total_cost'] for _ in range(3)]
+        self.assertEqual(costs, ['0.33', '0.34', '0.33'])
+        call_command('rebuild_stock_balances', '--verify', stdout=StringIO())
+
+    # Costing an output does not depend on how many transactions came before
+    def test_output_cost_does_not_scan_history(self):
+        self.client.post('/api/inventory/input/batch/', [
+            {'ware_id': self.ware.id, 'quantity': 1, 'purchase_price': '2.00'}
+        ] * 200, format='json')
+        with CaptureQueriesContext(connection) as queries:
+            self.post_output(1)
+        self.assertFalse([query for query in queries if 'inventory_factor' in query['sql'] and 'SELECT' in query['sql']])
+
+
+@unittest.skipUnless(
+    connection.vendor == 'sqlite' and settings.INVENTORY_SQLITE_PRAGMAS, "SQLite profile with its pragmas only"
+)
+class SqliteProfileTestCase(TestCase):
+    # New connections get the configured pragmas
+    def test_pragmas_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    # Only connection-level pragmas with plain values are accepted from the settings
+    def test_pragmas_checked(self):
+        self.assertEqual(sqlite_pragma_sql('busy_timeout', 100), 'PRAGMA busy_timeout = 100')
+        for name, value in [('journal_mode', 'WAL'), ('synchronous; DROP TABLE x', 1), ('synchronous', 'NORMAL; --')]:
+            with self.subTest(name=name, value=value), self.assertRaises(ImproperlyConfigured):
+                sqlite_pragma_sql(name, value)
+
+
+# Test case for the database-free FIFO costing engine
+class LotBookTestCase(SimpleTestCase):
+    def setUp(self):
+        self.book = LotBook()
+        for quantity, price in [(100, '20.00'), (50, '22.00'), (5, '1.10')]:
+            self.book.add(quantity, Decimal(price))
+
+    # A consumption is costed from prefix sums and reports the lots it emptied or reduced
+    def test_consume_plan(self):
+        plan = self.book.consume(120)
+        self.assertEqual(plan.cost, Decimal('2440.00'))
+        self.assertEqual(list(plan.exhausted), [0])
+        self.assertEqual(plan.partial, (1, 30))
+
+        plan = self.book.consume(32)
+        self.assertEqual(plan.cost, Decimal('662.20'))  # 30 @ 22.00 + 2 @ 1.10
+        self.assertEqual(list(plan.exhausted), [1])
+        self.assertEqual(plan.partial, (2, 3))
+        self.assertEqual([self.book.remaining(index) for index in range(3)], [0, 0, 3])
+        self.assertEqual(self.book.available, 3)
+
+    # A consumption that ends exactly at a lot boundary leaves no partial lot
+    def test_consume_to_boundary(self):
+        plan = self.book.consume(150)
+        self.assertEqual(list(plan.exhausted), [0, 1])
+        self.assertIsNone(plan.partial)
+        self.assertEqual(self.book.head(), 2)
+
+    # Asking for more than is available changes nothing
+    def test_insufficient(self):
+        self.assertIsNone(self.book.consume(156))
+        self.assertEqual(self.book.available, 155)
+
+    # Matches walking the lots one by one on many small lots
+    def test_matches_lot_walk(self):
+        book = LotBook()
+        lots = [[quantity % 7 + 1, Decimal(quantity % 13 + 1) / 4] for quantity in range(2000)]
+        for quantity, price in lots:
+            book.add(quantity, price)
+        for quantity in (1, 250, 3, 1000, 4000):
+            expected = Decimal('0.00')
+            remaining = quantity
+            for lot in lots:
+                take = min(lot[0], remaining)
+                expected += take * lot[1]
+                lot[0] -= take
+                remaining -= take
+            self.assertEqual(book.consume(quantity).cost, expected.quantize(Decimal('0.01')))
+
+
+# Test case for FIFO outputs costed through the engine
+class FifoEngineOutputTestCase(TestCase):
+    # An output spanning many small lots is written back with one update
+    def test_output_across_many_lots(self):
+        ware = Ware.objects.create(name="Small Lots", cost_method="fifo")
+        with transaction.atomic():
+            record_inputs([(ware, 1, Decimal('0.50'))] * 1500 + [(ware, 10, Decimal('2.00'))])
+
+        with CaptureQueriesContext(connection) as queries:
+            quantity, total_cost = calculate_fifo_cost(ware, 1505)
+        self.assertEqual((quantity, total_cost), (1505, Decimal('760.00')))
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries), 4)  # 1501 layers in batches of 500
+        self.assertEqual(FifoLayer.objects.filter(ware=ware, remaining_quantity__gt=0).get().remaining_quantity, 5)
+
+
+# Test case for the ledger replay command
+class RebuildCostingTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.fifo_ware = Ware.objects.create(name="Replay FIFO", cost_method="fifo")
+        self.mean_ware = Ware.objects.create(name="Replay mean", cost_method="weighted_mean")
+        for ware in (self.fifo_ware, self.mean_ware):
+            for quantity, price in [(10, '1.00'), (10, '2.00')]:
+                self.client.post('/api/inventory/input/', {
+                    'ware_id': ware.id, 'quantity': quantity, 'purchase_price': price
+                }, format='json')
+            self.client.post('/api/inventory/output/', {'ware_id': ware.id, 'quantity': 15}, format='json')
+
+    def corrupt(self):
+        Factor.objects.filter(ware=self.fifo_ware, type='output').update(total_cost=Decimal('1.00'))
+        FifoLayer.objects.filter(ware=self.fifo_ware).update(remaining_quantity=10)
+        StockBalance.objects.filter(ware=self.mean_ware).update(total_value=Decimal('99.00'))
+
+    # Consistent data has nothing to correct
+    def test_consistent_ledger(self):
+        out = StringIO()
+        call_command('rebuild_costing', '--workers', '1', stdout=out)
+        self.assertIn("Corrected 0 difference(s) in 0 of 2 ware(s)", out.getvalue())
+
+    # A dry run reports every difference and writes nothing
+    def test_dry_run_reports(self):
+        self.corrupt()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'diff.csv')
+            call_command('rebuild_costing', '--dry-run', '--workers', '1', '--report', path, stdout=StringIO())
+            with open(path, newline='') as report_file:
+                rows = list(csv.DictReader(report_file))
+
+        kinds = sorted((int(row['ware_id']), row['kind']) for row in rows)
+        self.assertEqual(kinds, sorted([
+            (self.fifo_ware.id, 'output_cost'),
+            (self.fifo_ware.id, 'layer_remaining'),
+            (self.fifo_ware.id, 'layer_remaining'),
+            (self.mean_ware.id, 'balance'),
+        ]))
+        cost_row = next(row for row in rows if row['kind'] == 'output_cost')
+        self.assertEqual((cost_row['stored'], cost_row['replayed']), ('1.00', '20.00'))
+        self.assertEqual(Factor.objects.get(ware=self.fifo_ware, type='output').total_cost, Decimal('1.00'))
+
+    # A real run writes the replayed values back
+    def test_corrects_data(self):
+        self.corrupt()
+        FifoLayer.objects.filter(ware=self.fifo_ware).order_by('id').last().delete()
+        call_command('rebuild_costing', '--workers', '1', stdout=StringIO())
+
+        self.assertEqual(Factor.objects.get(ware=self.fifo_ware, type='output').total_cost, Decimal('20.00'))
+        remaining = list(FifoLayer.objects.filter(ware=self.fifo_ware).order_by('factor_id').values_list('remaining_quantity', flat=True))
+        self.assertEqual(remaining, [0, 5])
+        self.assertEqual(calculate_inventory_valuation(self.mean_ware), (5, Decimal('7.50')))
+        call_command('rebuild_stock_balances', '--verify', stdout=StringIO())
+
+        out = StringIO()
+        call_command('rebuild_costing', '--workers', '1', stdout=out)
+        self.assertIn("Corrected 0 difference(s)", out.getvalue())
+
+    # Snapshots holding a corrected output cost are dropped, so point-in-time valuations use the new cost
+    def test_corrects_snapshots(self):
+        self.corrupt()
+        taken_at = timezone.now()
+        call_command('snapshot_valuations', '--at', taken_at.isoformat(), stdout=StringIO())
+        self.assertEqual(ValuationSnapshot.objects.get(ware=self.fifo_ware).total_value, Decimal('29.00'))
+        call_command('rebuild_costing', '--workers', '1', stdout=StringIO())
+
+        self.assertFalse(ValuationSnapshot.objects.filter(ware=self.fifo_ware).exists())
+        self.assertTrue(ValuationSnapshot.objects.filter(ware=self.mean_ware).exists())
+        as_of = (taken_at + timedelta(seconds=1)).isoformat()
+        response = self.client.get('/api/inventory/valuation/', {'ware_id': self.fifo_ware.id, 'as_of': as_of})
+        self.assertEqual(response.data['total_inventory_value'], '10.00')
+
+    # Inputs recorded without a price are replayed at 0.00, as the input endpoint costs them
+    def test_input_without_price(self):
+        ware = Ware.objects.create(name="Replay free", cost_method="fifo")
+        self.client.post('/api/inventory/input/', {'ware_id': ware.id, 'quantity': 4}, format='json')
+        self.client.post('/api/inventory/input/', {'ware_id': ware.id, 'quantity': 4, 'purchase_price': '2.00'}, format='json')
+        self.client.post('/api/inventory/output/', {'ware_id': ware.id, 'quantity': 6}, format='json')
+        FifoLayer.objects.filter(ware=ware).delete()
+
+        call_command('rebuild_costing', '--workers', '1', '--ware', str(ware.id), stdout=StringIO())
+        self.assertEqual(Factor.objects.get(ware=ware, type='output').total_cost, Decimal('4.00'))
+        layers = FifoLayer.objects.filter(ware=ware).order_by('factor_id').values_list('purchase_price', 'remaining_quantity')
+        self.assertEqual(list(layers), [(Decimal('0.00'), 0), (Decimal('2.00'), 2)])
+
+    # An output recorded between the replay and the write is not overwritten: the ware is replayed again
+    def test_ledger_changed_since_replay(self):
+        self.corrupt()
+        replay_ware = rebuild_costing.replay_ware
+        replays = []
+
+        def replay_then_output(ware_id):
+            result = replay_ware(ware_id)
+            if not replays:
+                self.client.post('/api/inventory/output/', {'ware_id': ware_id, 'quantity': 2}, format='json')
+            replays.append(ware_id)
+            return result
+
+        stale = replay_ware(self.fifo_ware.id)
+        self.client.post('/api/inventory/output/', {'ware_id': self.fifo_ware.id, 'quantity': 1}, format='json')
+        self.assertFalse(rebuild_costing.apply_result(stale))
+
+        with mock.patch.object(rebuild_costing, 'replay_ware', replay_then_output):
+            call_command('rebuild_costing', '--workers', '1', '--ware', str(self.fifo_ware.id), stdout=StringIO())
+        self.assertEqual(replays, [self.fifo_ware.id, self.fifo_ware.id])
+        self.assertEqual(calculate_inventory_valuation(self.fifo_ware), (2, Decimal('4.00')))
+        call_command('rebuild_stock_balances', '--verify', '--ware', str(self.fifo_ware.id), stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_costing', '--workers', '1', '--ware', str(self.fifo_ware.id), stdout=out)
+        self.assertIn("Corrected 0 difference(s)", out.getvalue())
+
+
+# The replay also runs in worker processes, which need committed data
+class ParallelRebuildCostingTestCase(TransactionTestCase):
+    def test_parallel_replay(self):
+        client = APIClient()
+        wares = [Ware.objects.create(name=f"Parallel {index}", cost_method="fifo") for index in range(4)]
+        for ware in wares:
+            client.post('/api/inventory/input/', {'ware_id': ware.id, 'quantity': 4, 'purchase_price': '2.50'}, format='json')
+            client.post('/api/inventory/output/', {'ware_id': ware.id, 'quantity': 1}, format='json')
+        Factor.objects.filter(type='output').update(total_cost=Decimal('0.00'))
+
+        out = StringIO()
+        call_command('rebuild_costing', '--workers', '2', stdout=out)
+        # The balances were written with the right costs, so only the output costs differ
+        self.assertIn("Corrected 4 difference(s) in 4 of 4 ware(s)", out.getvalue())
+        self.assertEqual(set(Factor.objects.filter(type='output').values_list('total_cost', flat=True)), {Decimal('2.50')})
+
+
+# Test case for the inventory aging report
+class InventoryAgingTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware = Ware.objects.create(name="Aging FIFO", cost_method="fifo")
+        self.other = Ware.objects.create(name="Aging other", cost_method="fifo")
+        self.mean_ware = Ware.objects.create(name="Aging mean", cost_method="weighted_mean")
+        now = timezone.now()
+        for ware, quantity, price, days in [
+            (self.ware, 10, '1.00', 200),
+            (self.ware, 10, '2.00', 100),
+            (self.ware, 10, '3.00', 45),
+            (self.ware, 10, '4.00', 1),
+            (self.other, 5, '10.00', 10),
+            (self.mean_ware, 5, '10.00', 10),
+        ]:
+            self.client.post('/api/inventory/input/', {
+                'ware_id': ware.id, 'quantity': quantity, 'purchase_price': price
+            }, format='json')
+            FifoLayer.objects.filter(factor=Factor.objects.latest('id')).update(created_at=now - timedelta(days=days))
+        # Takes the oldest lot and part of the next one
+        self.client.post('/api/inventory/output/', {'ware_id': self.ware.id, 'quantity': 14}, format='json')
+
+    # Remaining lots are bucketed by age, per ware and for the whole warehouse, in one query
+    def test_aging_report(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/inventory/aging/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        results = response.data['results']
+        self.assertEqual([ware['ware_id'] for ware in results], [self.ware.id, self.other.id])
+        self.assertEqual(results[0]['buckets'], {
+            '0-30': {'quantity': 10, 'value': '40.00'},
+            '31-90': {'quantity': 10, 'value': '30.00'},
+            '91-180': {'quantity': 6, 'value': '12.00'},
+            '180+': {'quantity': 0, 'value': '0.00'},
+        })
+        self.assertEqual((results[0]['quantity'], results[0]['value']), (26, '82.00'))
+
+        totals = response.data['totals']
+        self.assertEqual(totals['buckets']['0-30'], {'quantity': 15, 'value': '90.00'})
+        self.assertEqual((totals['quantity'], totals['value']), (31, '132.00'))
+
+    # The report can be limited to one ware
+    def test_aging_single_ware(self):
+        response = self.client.get(f'/api/inventory/aging/?ware_id={self.other.id}')
+        self.assertEqual([ware['ware_id'] for ware in response.data['results']], [self.other.id])
+        self.assertEqual(response.data['totals']['value'], '50.00')
+
+
+# Test case for the COGS rollups and report
+class CogsReportTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        rows = [
+            {'ware': 'Cogs FIFO', 'cost_method': 'fifo', 'type': 'input', 'quantity': 10, 'purchase_price': '2.00', 'created_at': '2026-01-30T10:00:00Z'},
+            {'ware': 'Cogs FIFO', 'type': 'output', 'quantity': 4, 'created_at': '2026-01-31T10:00:00Z'},
+            {'ware': 'Cogs FIFO', 'type': 'output', 'quantity': 1, 'created_at': '2026-01-31T12:00:00Z'},
+            {'ware': 'Cogs FIFO', 'type': 'output', 'quantity': 2, 'created_at': '2026-02-01T10:00:00Z'},
+            {'ware': 'Cogs mean', 'cost_method': 'weighted_mean', 'type': 'input', 'quantity': 5, 'purchase_price': '3.00', 'created_at': '2026-01-31T09:00:00Z'},
+            {'ware': 'Cogs mean', 'type': 'output', 'quantity': 5, 'created_at': '2026-02-02T09:00:00Z'},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ledger.ndjson')
+            with open(path, 'w') as ledger_file:
+                ledger_file.writelines(json.dumps(row) + '\n' for row in rows)
+            call_command('import_ledger', path, stdout=StringIO())
+        self.fifo_ware = Ware.objects.get(name='Cogs FIFO')
+        self.mean_ware = Ware.objects.get(name='Cogs mean')
+
+    # Daily rows come from the rollups, which are kept in step with the ledger
+    def test_daily_report(self):
+        response = self.client.get('/api/reports/cogs/?start=2026-01-31&end=2026-02-01')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['ware_id'], str(row['period']), row['output_quantity'], row['cogs']) for row in response.data['results']],
+            [
+                (self.fifo_ware.id, '2026-01-31', 5, '10.00'),
+                (self.mean_ware.id, '2026-01-31', 0, '0.00'),
+                (self.fifo_ware.id, '2026-02-01', 2, '4.00'),
+            ]
+        )
+        self.assertEqual(response.data['totals']['input_value'], '15.00')
+        self.assertEqual(response.data['totals']['cogs'], '14.00')
+        call_command('rebuild_cogs_rollups', '--verify', stdout=StringIO())
+
+    # Months are summed from the daily rows
+    def test_monthly_report(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/reports/cogs/?start=2026-01-01&end=2026-02-28&period=month&ware_id={self.fifo_ware.id}')
+        self.assertEqual(
+            [(str(row['period']), row['input_quantity'], row['output_quantity'], row['cogs']) for row in response.data['results']],
+            [('2026-01-01', 10, 5, '10.00'), ('2026-02-01', 0, 2, '4.00')]
+        )
+
+    # Transactions recorded through the API update today's rollup
+    def test_api_updates_rollups(self):
+        self.client.post('/api/inventory/input/', {'ware_id': self.fifo_ware.id, 'quantity': 2, 'purchase_price': '5.00'}, format='json')
+        self.client.post('/api/inventory/output/batch/', [{'ware_id': self.fifo_ware.id, 'quantity': 3}], format='json')
+        today = timezone.localdate().isoformat()
+        response = self.client.get(f'/api/reports/cogs/?start={today}&end={today}')
+        self.assertEqual(response.data['totals'], {
+            'input_quantity': 2, 'input_value': '10.00', 'output_quantity': 3, 'cogs': '6.00'
+        })
+        call_command('rebuild_cogs_rollups', '--verify', stdout=StringIO())
+
+    # Rollups that drifted are reported by --verify and fixed by a rebuild
+    def test_rebuild(self):
+        CogsRollup.objects.filter(ware=self.fifo_ware).update(cogs=Decimal('0.00'))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_cogs_rollups', '--verify', stdout=StringIO())
+        call_command('rebuild_cogs_rollups', '--ware', str(self.fifo_ware.id), stdout=StringIO())
+        call_command('rebuild_cogs_rollups', '--verify', stdout=StringIO())
+
+    # An empty or reversed range is rejected
+    def test_invalid_range(self):
+        response = self.client.get('/api/reports/cogs/?start=2026-02-01&end=2026-01-01')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/reports/cogs/').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# Test case for archiving old ledger rows with a per-ware carry-forward
+class ArchiveLedgerTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        rows = [
+            {'ware': 'Archive FIFO', 'cost_method': 'fifo', 'type': 'input', 'quantity': 10, 'purchase_price': '1.00', 'created_at': '2026-01-01T09:00:00Z'},
+            {'ware': 'Archive FIFO', 'type': 'input', 'quantity': 10, 'purchase_price': '2.00', 'created_at': '2026-01-02T09:00:00Z'},
+            {'ware': 'Archive FIFO', 'type': 'output', 'quantity': 15, 'created_at': '2026-01-03T09:00:00Z'},
+            {'ware': 'Archive FIFO', 'type': 'output', 'quantity': 2, 'created_at': '2026-02-01T09:00:00Z'},
+            {'ware': 'Archive mean', 'cost_method': 'weighted_mean', 'type': 'input', 'quantity': 4, 'purchase_price': '3.00', 'created_at': '2026-01-01T09:00:00Z'},
+            {'ware': 'Archive mean', 'type': 'output', 'quantity': 1, 'created_at': '2026-01-05T09:00:00Z'},
+            {'ware': 'Archive mean', 'type': 'input', 'quantity': 2, 'purchase_price': '6.00', 'created_at': '2026-02-01T09:00:00Z'},
+        ]
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        path = os.path.join(self.directory.name, 'ledger.ndjson')
+        with open(path, 'w') as ledger_file:
+            ledger_file.writelines(json.dumps(row) + '\n' for row in rows)
+        call_command('import_ledger', path, stdout=StringIO())
+        self.fifo_ware = Ware.objects.get(name='Archive FIFO')
+        self.mean_ware = Ware.objects.get(name='Archive mean')
+        self.archive_dir = os.path.join(self.directory.name, 'archive')
+
+    def archive(self, *args):
+        out = StringIO()
+        call_command('archive_ledger', '--before', '2026-01-15', '--output-dir', self.archive_dir, *args, stdout=out)
+        return out.getvalue()
+
+    def archived_rows(self, ware):
+        rows = []
+        for name in sorted(os.listdir(self.archive_dir)):
+            if name.startswith(f'ware-{ware.id}-'):
+                with gzip.open(os.path.join(self.archive_dir, name), 'rt') as archive:
+                    rows += [json.loads(line) for line in archive]
+        return rows
+
+    # Settled rows move to the archive files and their totals to the carry-forward rows
+    def test_archive(self):
+        self.assertIn("Archived 4 row(s) of 2 ware(s)", self.archive())
+
+        # The FIFO ware keeps the lot that still has units left and the later output
+        self.assertEqual(
+            [(row['type'], row['quantity']) for row in self.archived_rows(self.fifo_ware)],
+            [('input', 10), ('output', 15)]
+        )
+        self.assertEqual(list(Factor.objects.filter(ware=self.fifo_ware).values_list('quantity', flat=True)), [10, 2])
+        self.assertEqual(FifoLayer.objects.filter(ware=self.fifo_ware).count(), 1)
+        carry = self.fifo_ware.carry_forward
+        self.assertEqual(
+            (carry.input_quantity, carry.input_cost, carry.output_quantity, carry.output_cost, carry.archived_rows),
+            (10, Decimal('10.00'), 15, Decimal('20.00'), 2)
+        )
+        self.assertEqual(len(self.archived_rows(self.mean_ware)), 2)
+
+        # Balances, rollups and cost replays still agree with what is left of the ledger
+        call_command('rebuild_stock_balances', '--verify', stdout=StringIO())
+        call_command('rebuild_cogs_rollups', '--verify', stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_costing', '--dry-run', '--workers', '1', stdout=out)
+        self.assertIn("Found 0 difference(s)", out.getvalue())
+
+        # Archiving again finds nothing new
+        self.assertIn("Archived 0 row(s)", self.archive())
+
+    # Valuations after the cutoff start from the carry-forward; earlier ones are refused
+    def test_valuation_as_of(self):
+        self.archive()
+        for ware, expected in [(self.fifo_ware, (5, '10.00')), (self.mean_ware, (3, '9.00'))]:
+            response = self.client.get('/api/inventory/valuation/', {'ware_id': ware.id, 'as_of': '2026-01-20T00:00:00Z'})
+            self.assertEqual((response.data['quantity_in_stock'], response.data['total_inventory_value']), expected)
+        response = self.client.get('/api/inventory/valuation/', {'ware_id': self.fifo_ware.id, 'as_of': '2026-01-10T00:00:00Z'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # Reports and history still cover the archived period
+    def test_reports_and_history(self):
+        self.archive()
+        response = self.client.get(f'/api/reports/cogs/?start=2026-01-01&end=2026-01-31&ware_id={self.fifo_ware.id}')
+        self.assertEqual(response.data['totals']['cogs'], '20.00')
+
+        response = self.client.get(f'/api/wares/{self.mean_ware.id}/factors/')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['carried_forward'], {
+            'archived_before': '2026-01-15', 'archived_rows': 2,
+            'input_quantity': 4, 'input_cost': '12.00', 'output_quantity': 1, 'output_cost': '3.00'
+        })
+
+    # New outputs keep taking from the lot the archived outputs started on
+    def test_outputs_after_archive(self):
+        self.archive()
+        response = self.client.post('/api/inventory/output/', {'ware_id': self.fifo_ware.id, 'quantity': 3}, format='json')
+        self.assertEqual(response.data['total_cost'], '6.00')
+        out = StringIO()
+        call_command('rebuild_costing', '--dry-run', '--workers', '1', stdout=out)
+        self.assertIn("Found 0 difference(s)", out.getvalue())
+
+    # A dry run changes nothing
+    def test_dry_run(self):
+        self.assertIn("Would archive 4 row(s)", self.archive('--dry-run'))
+        self.assertEqual(Factor.objects.count(), 7)
+        self.assertFalse(LedgerCarryForward.objects.exists())
+        self.assertFalse(os.path.exists(self.archive_dir))
+
+
+# Test case for outputs accepted with a ticket and recorded by the per-ware writer threads
+# TransactionTestCase is needed so the writer threads see committed data through their own connections
+@override_settings(INVENTORY_OUTPUT_QUEUE_ENABLED=True)
+class OutputQueueTestCase(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware = Ware.objects.create(name="Queued FIFO", cost_method="fifo")
+        self.client.post('/api/inventory/input/batch/', [
+            {'ware_id': self.ware.id, 'quantity': 3, 'purchase_price': '1.00'},
+            {'ware_id': self.ware.id, 'quantity': 2, 'purchase_price': '2.00'},
+        ], format='json')
+
+    def wait(self, response):
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(output_queue.get(response.data['ticket_id']).finished.wait(timeout=10))
+        return self.client.get(response['Location']).data
+
+    # Outputs are recorded in the order they were accepted; one that finds too little stock fails alone
+    def test_queued_outputs(self):
+        responses = [
+            self.client.post('/api/inventory/output/', {'ware_id': self.ware.id, 'quantity': quantity}, format='json')
+            for quantity in (2, 2, 3)
+        ]
+        tickets = [self.wait(response) for response in responses]
+        self.assertEqual([ticket['status'] for ticket in tickets], ['done', 'done', 'failed'])
+        self.assertEqual([ticket['result']['total_cost'] for ticket in tickets[:2]], ['2.00', '3.00'])
+        self.assertEqual(tickets[2]['error'], "Insufficient stock")
+
+        balance = StockBalance.objects.get(ware=self.ware)
+        self.assertEqual((balance.quantity, balance.total_value), (1, Decimal('2.00')))
+        call_command('rebuild_costing', '--dry-run', '--workers', '1', stdout=StringIO())
+        call_command('rebuild_stock_balances', '--verify', stdout=StringIO())
+
+    # Validation errors and unknown wares are still answered right away
+    def test_invalid_outputs(self):
+        response = self.client.post('/api/inventory/output/', {'ware_id': self.ware.id, 'quantity': 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/inventory/output/', {'ware_id': 999, 'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/inventory/output/tickets/unknown/').status_code, status.HTTP_404_NOT_FOUND)
+
+    # The benchmark can send outputs through the queue from several threads
+    def test_bench_with_queue(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.json')
+            call_command(
+                'bench', '--current-db', '--wares', '2', '--factors', '40', '--valuations', '1',
+                '--preload', '5', '--concurrency', '2', '--output-queue', '--json', path, stdout=StringIO()
+            )
+            with open(path) as result_file:
+                results = json.load(result_file)
+        endpoints = results['endpoints']
+        self.assertEqual(
+            endpoints['inventory-output']['requests'],
+            endpoints['inventory-output-completion']['requests']
+        )
+        self.assertEqual(list(endpoints['inventory-output']['status_counts']), ['202'])
+        self.assertEqual(results['transactions']['requests'], 40)
+        call_command('rebuild_stock_balances', '--verify', stdout=StringIO())
+
+
+# Test case for expiring finished tickets of the output queue, with outputs applied without a database
+class OutputQueuePruneTestCase(SimpleTestCase):
+    # Finished tickets expire even while an older ticket of another ware is still pending
+    @override_settings(INVENTORY_OUTPUT_QUEUE_TICKET_TTL=0)
+    def test_prune_skips_pending_tickets(self):
+        release = threading.Event()
+
+        def apply(ware, quantities):
+            if ware.id == 1:
+                release.wait(timeout=10)
+            return [({'quantity': quantity}, None) for quantity in quantities]
+
+        queue = OutputQueue(apply)
+        stuck = queue.submit(Ware(id=1, name="Stuck"), 1)
+        done = [queue.submit(Ware(id=2, name="Quick"), quantity) for quantity in (1, 2)]
+        for ticket in done:
+            self.assertTrue(ticket.finished.wait(timeout=10))
+
+        latest = queue.submit(Ware(id=2, name="Quick"), 3)
+        self.assertEqual([queue.get(ticket.id) for ticket in done], [None, None])
+        self.assertIs(queue.get(stuck.id), stuck)
+        self.assertIs(queue.get(latest.id), latest)
+
+        release.set()
+        self.assertTrue(stuck.finished.wait(timeout=10))
+        self.assertTrue(latest.finished.wait(timeout=10))
+
+
+# Test case for the fast validation path of the single input and output endpoints
+class FastValidationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ware = Ware.objects.create(name="Fast FIFO", cost_method="fifo")
+
+    # Sends a payload with the fast path off and on and returns both (status code, body) pairs
+    def post_both_ways(self, path, payload):
+        responses = []
+        for fast in (False, True):
+            with override_settings(INVENTORY_FAST_VALIDATION=fast), transaction.atomic():
+                response = self.client.post(path, payload, format='json')
+                responses.append((response.status_code, response.json()))
+                transaction.set_rollback(True)  # Each way starts from the same data
+        return responses
+
+    # Invalid payloads get exactly the serializers' errors
+    def test_same_errors(self):
+        ware_id = self.ware.id
+        for payload in [
+            {},
+            {'ware_id': ware_id},
+            {'ware_id': 999, 'quantity': 1, 'purchase_price': '1.00'},
+            {'ware_id': 'abc', 'quantity': 1, 'purchase_price': '1.00'},
+            {'ware_id': True, 'quantity': 1, 'purchase_price': '1.00'},
+            {'ware_id': ware_id, 'quantity': 0, 'purchase_price': '1.00'},
+            {'ware_id': ware_id, 'quantity': 1.5, 'purchase_price': '1.00'},
+            {'ware_id': ware_id, 'quantity': '2', 'purchase_price': '1.005'},
+            {'ware_id': ware_id, 'quantity': 2, 'purchase_price': 'free'},
+            {'ware_id': ware_id, 'quantity': 2, 'purchase_price': '-1.00', 'type': 'input'},
+        ]:
+            with self.subTest(payload=payload):
+                slow, fast = self.post_both_ways('/api/inventory/input/', payload)
+                self.assertEqual(slow[0], status.HTTP_400_BAD_REQUEST)
+                self.assertEqual(fast, slow)
+
+        self.client.post('/api/inventory/input/', {'ware_id': ware_id, 'quantity': 5, 'purchase_price': '2.00'}, format='json')
+        for payload in [{}, {'ware_id': 999, 'quantity': 1}, {'ware_id': ware_id, 'quantity': -1}, {'ware_id': ware_id, 'quantity': 6}]:
+            with self.subTest(payload=payload):
+                slow, fast = self.post_both_ways('/api/inventory/output/', payload)
+                self.assertIn(slow[0], (status.HTTP_400_BAD_REQUEST, status.HTTP_404_NOT_FOUND))
+                self.assertEqual(fast, slow)
+
+    # Valid payloads record the same transactions with the same queries
+    def test_valid_payloads(self):
+        payload = {'ware_id': self.ware.id, 'quantity': '4', 'purchase_price': 2.5}
+        self.client.post('/api/inventory/input/', payload, format='json')
+        counts = []
+        for fast in (False, True):
+            with override_settings(INVENTORY_FAST_VALIDATION=fast), CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/inventory/input/', payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.data['purchase_price'], '2.50')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+        with override_settings(INVENTORY_FAST_VALIDATION=True):
+            response = self.client.post('/api/inventory/output/', {'ware_id': str(self.ware.id), 'quantity': 3}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_cost'], '7.50')
+        call_command('rebuild_stock_balances', '--verify', stdout=StringIO())
@@ -2,13 +2,41 @@ from django.urls import path
 from .views import (
     WareCreateView,
     FactorInputView,
+    FactorInputBatchView,
     FactorOutputView,
+    FactorOutputBatchView,
+    OutputTicketView,
     InventoryValuationView,
+    WarehouseValuationView,
+    ValuationCacheStatsView,
+    LedgerExportView,
+    WareFactorHistoryView,
+    InventoryAgingView,
+    CogsReportView,
+)
+from .async_views import (
+    AsyncInventoryValuationView,
+    AsyncWarehouseValuationView,
+    AsyncWareFactorHistoryView,
 )
 
 urlpatterns = [
     path('wares/', WareCreateView.as_view(), name='create-ware'),
+    path('wares/<int:ware_id>/factors/', WareFactorHistoryView.as_view(), name='ware-factor-history'),
     path('inventory/input/', FactorInputView.as_view(), name='inventory-input'),
+    path('inventory/input/batch/', FactorInputBatchView.as_view(), name='inventory-input-batch'),
     path('inventory/output/', FactorOutputView.as_view(), name='inventory-output'),
+    path('inventory/output/batch/', FactorOutputBatchView.as_view(), name='inventory-output-batch'),
+    path('inventory/output/tickets/<str:ticket_id>/', OutputTicketView.as_view(), name='inventory-output-ticket'),
     path('inventory/valuation/', InventoryValuationView.as_view(), name='inventory-valuation'),
+    path('inventory/valuation/all/', WarehouseValuationView.as_view(), name='inventory-valuation-all'),
+    path('inventory/valuation/cache-stats/', ValuationCacheStatsView.as_view(), name='inventory-valuation-cache-stats'),
+    path('inventory/aging/', InventoryAgingView.as_view(), name='inventory-aging'),
+    path('reports/cogs/', CogsReportView.as_view(), name='reports-cogs'),
+    path('inventory/factors/export/', LedgerExportView.as_view(), name='inventory-factor-export'),
+
+    # Async versions of the read endpoints, for ASGI deployments
+    path('async/wares/<int:ware_id>/factors/', AsyncWareFactorHistoryView.as_view(), name='async-ware-factor-history'),
+    path('async/inventory/valuation/', AsyncInventoryValuationView.as_view(), name='async-inventory-valuation'),
+    path('async/inventory/valuation/all/', AsyncWarehouseValuationView.as_view(), name='async-inventory-valuation-all'),
 ]
@@ -1,18 +1,101 @@
-from rest_framework import generics, status
+from rest_framework import generics, serializers, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.exceptions import ValidationError
 from django.shortcuts import get_object_or_404
-from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.conf import settings
+from django.db import connection, transaction, OperationalError
+from django.db.models import Case, DecimalField, F, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth
+from datetime import datetime, timedelta
 from decimal import Decimal
-from .models import Ware, Factor
+from .models import Ware, Factor, StockBalance, FifoLayer, ValuationSnapshot, CogsRollup, LedgerCarryForward
+from .exports import EXPORT_FORMATS, ledger_queryset, ledger_rows
+from .costing import LotBook, MovingAverage
+from .cache import bump_ledger_version_on_commit, get_cached_valuation, get_cache_stats
+from .output_queue import OutputQueue, PENDING, DONE
 from .serializers import (
     WareSerializer,
     FactorInputSerializer,
+    FactorInputBatchItemSerializer,
+    BatchRequestSerializer,
     FactorOutputSerializer,
     InventoryValuationSerializer,
+    WareValuationSerializer,
+    WarehouseValuationQuerySerializer,
+    LedgerExportQuerySerializer,
+    FactorSerializer,
+    FactorHistoryQuerySerializer,
     FactorOutputResponseSerializer,
+    InventoryAgingQuerySerializer,
+    CogsReportQuerySerializer,
+    LedgerCarryForwardSerializer,
 )
-from collections import deque
+from array import array
+from functools import wraps
+import base64
+import binascii
+import hashlib
+import random
+import time
+
+# Decorator that retries a view method when SQLite gives up waiting for its write lock
+# Under bursts a transaction can still fail with "database is locked" once the busy timeout
+# expires; the transaction was rolled back, so it is safe to run the method again
+def retry_on_database_lock(method):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        retries = getattr(settings, 'INVENTORY_LOCK_RETRIES', 3)
+        for attempt in range(retries + 1):
+            try:
+                return method(*args, **kwargs)
+            except OperationalError as exc:
+                # Never retry inside an outer transaction, which is already broken
+                if attempt == retries or transaction.get_connection().in_atomic_block or 'locked' not in str(exc):
+                    raise
+                time.sleep(random.uniform(0.01, 0.05) * (attempt + 1))
+    return wrapper
+
+# Helper functions for conditional GET
+# Reads of a ware carry an ETag built from its balance version, which changes with every
+# ledger change. A client sending it back in If-None-Match gets 304 Not Modified after a
+# single primary-key read, without the response being computed.
+
+# Function to read the ledger version of a ware; None if the ware does not exist
+def get_ware_version(ware_id):
+    version = StockBalance.objects.filter(ware_id=ware_id).values_list('version', flat=True).first()
+    if version is None:
+        # No balance row until the first transaction
+        if not Ware.objects.filter(id=ware_id).exists():
+            return None
+        version = 0
+    return version
+
+# Function to build the ETag of a ware read; the request path tells pages and filters apart
+def ware_etag(request, ware_id):
+    try:
+        ware_id = int(ware_id)
+    except (TypeError, ValueError):
+        return None  # Invalid requests are answered normally
+    version = get_ware_version(ware_id)
+    if version is None:
+        return None
+    digest = hashlib.sha1(request.get_full_path().encode()).hexdigest()[:16]
+    return f'"{ware_id}-{version}-{digest}"'
+
+# ETag function for the valuation view, which takes the ware from the query string
+def valuation_etag(request, *args, **kwargs):
+    return ware_etag(request, request.GET.get('ware_id'))
+
+# ETag function for the transaction history view, which takes the ware from the URL
+def ware_history_etag(request, ware_id, *args, **kwargs):
+    return ware_etag(request, ware_id)
 
 # View to handle creation of new Ware objects
 class WareCreateView(generics.CreateAPIView):
@@ -22,55 +105,143 @@ class WareCreateView(generics.CreateAPIView):
 # View to handle input transactions (adding inventory to stock)
 class FactorInputView(APIView):
     def post(self, request):
-        # Deserialize the input data
-        serializer = FactorInputSerializer(data=request.data, context={'request': request})
-        if serializer.is_valid():
-            # Use a transaction to ensure data integrity
-            with transaction.atomic():
-                ware = serializer.validated_data['ware']
-                quantity = serializer.validated_data['quantity']
-                purchase_price = serializer.validated_data.get('purchase_price', None)
-                total_cost = Decimal(quantity) * Decimal(purchase_price) if purchase_price else Decimal('0.00')
+        # Plainly valid payloads skip the serializer when INVENTORY_FAST_VALIDATION is set
+        validated_data = fast_input_data(request.data) if getattr(settings, 'INVENTORY_FAST_VALIDATION', False) else None
+        if validated_data is None:
+            # Deserialize the input data
+            serializer = FactorInputSerializer(data=request.data, context={'request': request})
+            if not serializer.is_valid():
+                # Return validation errors if any
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            validated_data = serializer.validated_data
 
-                # Create a new input transaction (Factor)
-                factor = Factor.objects.create(
+        # Use a transaction to ensure data integrity
+        with transaction.atomic():
+            ware = validated_data['ware']
+            quantity = validated_data['quantity']
+            purchase_price = validated_data.get('purchase_price', None)
+            total_cost = Decimal(quantity) * Decimal(purchase_price) if purchase_price else Decimal('0.00')
+
+            # Create a new input transaction (Factor)
+            factor = Factor.objects.create(
+                ware=ware,
+                quantity=quantity,
+                purchase_price=purchase_price,
+                total_cost=total_cost,
+                type='input'
+            )
+
+            # FIFO wares get a cost layer that outputs will consume from
+            if ware.cost_method == 'fifo':
+                FifoLayer.objects.create(
                     ware=ware,
-                    quantity=quantity,
-                    purchase_price=purchase_price,
-                    total_cost=total_cost,
-                    type='input'
+                    factor=factor,
+                    purchase_price=purchase_price or Decimal('0.00'),
+                    remaining_quantity=quantity,
+                    created_at=factor.created_at
                 )
 
-            # Return a success response with the created factor details
-            return Response({
-                "factor_id": factor.id,
-                "ware_id": factor.ware.id,
-                "quantity": factor.quantity,
-                "purchase_price": str(factor.purchase_price) if factor.purchase_price else None,
-                "created_at": factor.created_at,
-                "type": factor.type
-            }, status=status.HTTP_201_CREATED)
-        
-        # Return validation errors if any
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            # Add the received units and their cost to the ware's running balance
+            update_stock_balance(ware, quantity, total_cost)
+            update_cogs_rollups([factor])
+
+        # Return a success response with the created factor details
+        return Response(input_factor_data(factor), status=status.HTTP_201_CREATED)
+
+# View to handle many input transactions in one request
+# Request body: {"items": [{"ware_id", "quantity", "purchase_price"}, ...], "mode": "all_or_nothing" | "partial"}
+class FactorInputBatchView(APIView):
+    def post(self, request):
+        # Accept a bare list of items as shorthand for the default mode
+        data = {'items': request.data} if isinstance(request.data, list) else request.data
+        batch_serializer = BatchRequestSerializer(data=data)
+        if not batch_serializer.is_valid():
+            return Response(batch_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        items = batch_serializer.validated_data['items']
+        partial = batch_serializer.validated_data['mode'] == 'partial'
+
+        # Validate every line on its own so each one can report its errors
+        item_serializer = FactorInputBatchItemSerializer()
+        validated = [None] * len(items)
+        errors = [None] * len(items)
+        for index, item in enumerate(items):
+            try:
+                validated[index] = item_serializer.run_validation(item)
+            except ValidationError as exc:
+                errors[index] = exc.detail
+
+        # Resolve all referenced wares with a single query
+        ware_ids = {line['ware_id'] for line in validated if line is not None}
+        wares = Ware.objects.in_bulk(ware_ids)
+        for index, line in enumerate(validated):
+            if line is not None and line['ware_id'] not in wares:
+                validated[index] = None
+                errors[index] = {'ware_id': [f'Invalid pk "{line["ware_id"]}" - object does not exist.']}
+
+        has_errors = any(error is not None for error in errors)
+        if has_errors and (not partial or all(line is None for line in validated)):
+            # All-or-nothing: nothing is written if any line is invalid
+            # A partial batch without a single valid line fails as a whole too
+            results = [
+                batch_item_result(index, error=error) if error is not None
+                else {"index": index, "status": "skipped"}
+                for index, error in enumerate(errors)
+            ]
+            return Response({"results": results}, status=status.HTTP_400_BAD_REQUEST)
+
+        entries = [
+            (wares[line['ware_id']], line['quantity'], line['purchase_price'])
+            for line in validated if line is not None
+        ]
+        with transaction.atomic():
+            factors = iter(record_inputs(entries))
+
+        results = [
+            batch_item_result(index, error=error) if error is not None
+            else batch_item_result(index, data=input_factor_data(next(factors)))
+            for index, error in enumerate(errors)
+        ]
+        # 207 tells the client that only part of a partial batch was accepted
+        response_status = status.HTTP_207_MULTI_STATUS if has_errors else status.HTTP_201_CREATED
+        return Response({"results": results}, status=response_status)
 
 # View to handle output transactions (removing inventory from stock)
 class FactorOutputView(APIView):
+    @retry_on_database_lock
     def post(self, request):
-        # Deserialize the output data
-        serializer = FactorOutputSerializer(data=request.data)
-        if serializer.is_valid():
-            ware_id = serializer.validated_data['ware_id']
-            quantity = serializer.validated_data['quantity']
+        # Plainly valid payloads skip the serializer when INVENTORY_FAST_VALIDATION is set
+        validated_data = fast_output_data(request.data) if getattr(settings, 'INVENTORY_FAST_VALIDATION', False) else None
+        if validated_data is None:
+            # Deserialize the output data
+            serializer = FactorOutputSerializer(data=request.data)
+            validated_data = serializer.validated_data if serializer.is_valid() else None
+        if validated_data is not None:
+            ware_id = validated_data['ware_id']
+            quantity = validated_data['quantity']
             ware = get_object_or_404(Ware, id=ware_id)
 
+            if getattr(settings, 'INVENTORY_OUTPUT_QUEUE_ENABLED', False):
+                # Accept the output now; the ware's writer thread records it and the ticket reports the outcome
+                ticket = output_queue.submit(ware, quantity)
+                response = Response(output_ticket_body(ticket), status=status.HTTP_202_ACCEPTED)
+                response['Location'] = reverse('inventory-output-ticket', args=[ticket.id])
+                return response
+
             # Ensure atomicity of operations
             with transaction.atomic():
-                stock, total_cost = calculate_output_cost(ware, quantity)
+                # Lock the ware's stock first so concurrent outputs cannot both take the same units
+                on_hand = lock_stock_balances([ware.id]).get(ware.id, 0)
+                if on_hand >= quantity:
+                    stock, total_cost = calculate_output_cost(ware, quantity)
+                else:
+                    stock = None
                 if stock is None:
                     # Return error if stock is insufficient
                     return Response({"error": "Insufficient stock"}, status=status.HTTP_400_BAD_REQUEST)
 
+                # Round the cost the same way the database stores it, so the balance matches the ledger
+                total_cost = total_cost.quantize(Decimal('0.01'))
+
                 # Create the output transaction
                 factor = Factor.objects.create(
                     ware=ware,
@@ -78,6 +249,10 @@ class FactorOutputView(APIView):
                     total_cost=total_cost,
                     type='output'
                 )
+
+                # Remove the shipped units and their cost from the ware's running balance
+                update_stock_balance(ware, -quantity, -total_cost)
+                update_cogs_rollups([factor])
             
             # Return success response with the transaction details
             response_serializer = FactorOutputResponseSerializer(factor)
@@ -86,16 +261,104 @@ class FactorOutputView(APIView):
         # Return validation errors if any
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+# View to handle many output transactions in one request, e.g. all lines of a picked order
+# Request body: {"items": [{"ware_id", "quantity"}, ...], "mode": "all_or_nothing" | "partial"}
+class FactorOutputBatchView(APIView):
+    @retry_on_database_lock
+    def post(self, request):
+        # Accept a bare list of items as shorthand for the default mode
+        data = {'items': request.data} if isinstance(request.data, list) else request.data
+        batch_serializer = BatchRequestSerializer(data=data)
+        if not batch_serializer.is_valid():
+            return Response(batch_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        items = batch_serializer.validated_data['items']
+        partial = batch_serializer.validated_data['mode'] == 'partial'
+
+        # Validate every line on its own so each one can report its errors
+        item_serializer = FactorOutputSerializer()
+        validated = [None] * len(items)
+        errors = [None] * len(items)
+        for index, item in enumerate(items):
+            try:
+                validated[index] = item_serializer.run_validation(item)
+            except ValidationError as exc:
+                errors[index] = exc.detail
+
+        # Resolve all referenced wares with a single query
+        ware_ids = {line['ware_id'] for line in validated if line is not None}
+        wares = Ware.objects.in_bulk(ware_ids)
+        for index, line in enumerate(validated):
+            if line is not None and line['ware_id'] not in wares:
+                validated[index] = None
+                errors[index] = {'detail': 'No Ware matches the given query.'}
+
+        with transaction.atomic():
+            # Cost every valid line; nothing is written yet
+            lines = [
+                (index, wares[line['ware_id']], line['quantity'])
+                for index, line in enumerate(validated) if line is not None
+            ]
+            factors, states = cost_outputs([(ware, quantity) for _, ware, quantity in lines])
+            created = {}
+            for (index, _, _), factor in zip(lines, factors):
+                if factor is None:
+                    errors[index] = {'error': 'Insufficient stock'}
+                else:
+                    created[index] = factor
+
+            has_errors = any(error is not None for error in errors)
+            if has_errors and (not partial or not created):
+                # All-or-nothing: nothing is written if any line failed
+                # A partial batch in which every line failed is refused too
+                results = [
+                    batch_item_result(index, error=error) if error is not None
+                    else {"index": index, "status": "skipped"}
+                    for index, error in enumerate(errors)
+                ]
+                return Response({"results": results}, status=status.HTTP_400_BAD_REQUEST)
+
+            save_outputs(list(created.values()), states)
+
+        results = [
+            batch_item_result(index, error=error) if error is not None
+            else batch_item_result(index, data=FactorOutputResponseSerializer(created[index]).data)
+            for index, error in enumerate(errors)
+        ]
+        # 207 tells the client that only part of a partial batch was accepted
+        response_status = status.HTTP_207_MULTI_STATUS if has_errors else status.HTTP_201_CREATED
+        return Response({"results": results}, status=response_status)
+
+# View to report the outcome of an output accepted by the output queue
+class OutputTicketView(APIView):
+    def get(self, request, ticket_id):
+        ticket = output_queue.get(ticket_id)
+        if ticket is None:
+            return Response({"detail": "No ticket matches the given query."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(output_ticket_body(ticket), status=status.HTTP_200_OK)
+
 # View to handle inventory valuation
 class InventoryValuationView(APIView):
+    @method_decorator(condition(etag_func=valuation_etag))
     def get(self, request):
         ware_id = request.query_params.get('ware_id')
         if not ware_id:
             # ware_id is required to fetch inventory valuation
             return Response({"error": "ware_id is required"}, status=status.HTTP_400_BAD_REQUEST)
         
+        # An optional as_of timestamp asks for the valuation at that point in time
+        try:
+            as_of = parse_as_of(request.query_params.get('as_of'))
+        except ValueError:
+            return Response({"error": "as_of must be an ISO 8601 datetime"}, status=status.HTTP_400_BAD_REQUEST)
+
         ware = get_object_or_404(Ware, id=ware_id)
-        total_quantity, total_inventory_value = calculate_inventory_valuation(ware)
+        if as_of:
+            try:
+                total_quantity, total_inventory_value = valuation_as_of(ware, as_of)
+            except ValueError as error:
+                return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            total_quantity, total_inventory_value = calculate_inventory_valuation(ware)
         
         # Serialize the valuation data
         valuation_data = {
@@ -103,82 +366,858 @@ class InventoryValuationView(APIView):
             "quantity_in_stock": total_quantity,
             "total_inventory_value": total_inventory_value
         }
+        if as_of:
+            valuation_data["as_of"] = as_of
         
         serializer = InventoryValuationSerializer(valuation_data)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+# View to report the hit and miss counters of the valuation cache
+class ValuationCacheStatsView(APIView):
+    def get(self, request):
+        return Response(get_cache_stats(), status=status.HTTP_200_OK)
+
+# View to handle the valuation of every ware in the warehouse
+# Pages are keyset-paginated on the ware ID: pass the returned "next" value as ?after= to continue
+class WarehouseValuationView(APIView):
+    def get(self, request):
+        query_serializer = WarehouseValuationQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = query_serializer.validated_data
+
+        wares, page = warehouse_valuation_querysets(params)
+        rows = list(page)
+
+        # One grouped aggregate for the whole warehouse (or the filtered cost method)
+        totals = StockBalance.objects.filter(ware__in=wares).aggregate(**warehouse_totals_aggregates())
+
+        body = warehouse_valuation_body(rows, params['limit'], totals, wares.count())
+        return Response(body, status=status.HTTP_200_OK)
+
+# View to report how old the remaining FIFO stock is
+# Open lots are grouped by ware and age bucket in a single aggregate query over the partial index
+# of open layers; the warehouse-wide totals are summed from the same rows
+class InventoryAgingView(APIView):
+    def get(self, request):
+        query_serializer = InventoryAgingQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = query_serializer.validated_data
+
+        as_of = timezone.now()
+        layers = FifoLayer.objects.filter(remaining_quantity__gt=0)
+        if 'ware_id' in params:
+            layers = layers.filter(ware_id=params['ware_id'])
+        rows = layers.annotate(bucket=aging_bucket(as_of)).values('ware_id', 'ware__name', 'bucket').annotate(
+            quantity=Sum('remaining_quantity'),
+            value=Sum(F('remaining_quantity') * F('purchase_price'), output_field=MONEY_FIELD)
+        ).order_by('ware_id')
+
+        results = {}
+        totals = empty_aging()
+        for row in rows:
+            ware = results.get(row['ware_id'])
+            if ware is None:
+                ware = results[row['ware_id']] = {"ware_id": row['ware_id'], "name": row['ware__name'], **empty_aging()}
+            value = to_money(row['value'])
+            for entry in (ware, totals):
+                entry['buckets'][row['bucket']]['quantity'] += row['quantity']
+                entry['buckets'][row['bucket']]['value'] += value
+                entry['quantity'] += row['quantity']
+                entry['value'] += value
+
+        return Response({
+            "as_of": as_of,
+            "results": [format_aging(ware) for ware in results.values()],
+            "totals": format_aging(totals)
+        }, status=status.HTTP_200_OK)
+
+# View to report the cost of goods sold per ware and day or month
+# Served from the daily COGS rollups, so the cost does not depend on the size of the ledger
+class CogsReportView(APIView):
+    def get(self, request):
+        query_serializer = CogsReportQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = query_serializer.validated_data
+
+        rollups = CogsRollup.objects.filter(day__gte=params['start'], day__lte=params['end'])
+        if 'ware_id' in params:
+            rollups = rollups.filter(ware_id=params['ware_id'])
+
+        # Months are summed from their days in the same grouped query
+        period = TruncMonth('day') if params['period'] == 'month' else F('day')
+        rows = rollups.annotate(period=period).values('ware_id', 'period').annotate(
+            **cogs_rollup_aggregates()
+        ).order_by('period', 'ware_id')
+        totals = rollups.aggregate(**cogs_rollup_aggregates())
+
+        return Response({
+            "period": params['period'],
+            "results": [
+                {"ware_id": row['ware_id'], "period": row['period'], **format_cogs(row)}
+                for row in rows
+            ],
+            "totals": format_cogs(totals)
+        }, status=status.HTTP_200_OK)
+
+# View to stream the Factor ledger as NDJSON or CSV
+# The body is generated while it is sent, so memory use does not depend on the size of the ledger
+class LedgerExportView(APIView):
+    def get(self, request):
+        query_serializer = LedgerExportQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = dict(query_serializer.validated_data)
+
+        file_format = params.pop('file_format')
+        encode, content_type = EXPORT_FORMATS[file_format]
+        if 'type' in params:
+            params['factor_type'] = params.pop('type')
+        factors = ledger_queryset(**params)
+
+        response = StreamingHttpResponse(encode(ledger_rows(factors)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="ledger.{file_format}"'
+        return response
+
+# View to list the transaction history of a ware, oldest first
+# Pages are keyset-paginated on (created_at, id): every page costs one indexed range read,
+# however deep it is. Pass the returned "next" value as ?cursor= to continue.
+class WareFactorHistoryView(APIView):
+    @method_decorator(condition(etag_func=ware_history_etag))
+    def get(self, request, ware_id):
+        query_serializer = FactorHistoryQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = query_serializer.validated_data
+
+        ware = get_object_or_404(Ware, id=ware_id)
+        try:
+            factors = factor_history_queryset(ware.id, params)
+        except ValueError:
+            return Response({"cursor": ["Invalid cursor."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        page = list(factors)
+        carry = LedgerCarryForward.objects.filter(ware=ware).first()
+        return Response(factor_history_body(page, params['limit'], carry), status=status.HTTP_200_OK)
+
+# Helper functions for building responses
+
+# Function to read the optional as_of query parameter; raises ValueError when it is not a datetime
+def parse_as_of(value):
+    if not value:
+        return None
+    as_of = parse_datetime(value)
+    if as_of is None:
+        raise ValueError(value)
+    if timezone.is_naive(as_of):
+        as_of = timezone.make_aware(as_of)
+    return as_of
+
+# Function to calculate a valuation as of a point in time, from the cache once that point has passed
+# A point still to come moves with every new transaction, so its valuation is not cached
+def valuation_as_of(ware, as_of):
+    if as_of > timezone.now():
+        return calculate_valuation_as_of(ware, as_of)
+    return get_cached_valuation(ware, as_of, calculate_valuation_as_of)
+
+# Function to build the querysets of a warehouse valuation page
+# Returns the filtered wares and the page rows: wares joined with their balance rows (missing for
+# wares without transactions), with one extra row that tells whether there is a next page
+def warehouse_valuation_querysets(params):
+    wares = Ware.objects.all()
+    if 'cost_method' in params:
+        wares = wares.filter(cost_method=params['cost_method'])
+
+    page = wares.order_by('id')
+    if 'after' in params:
+        page = page.filter(id__gt=params['after'])
+    page = page.values('id', 'name', 'cost_method', 'balance__quantity', 'balance__total_value')
+    return wares, page[:params['limit'] + 1]
+
+# Function to return the aggregates of the warehouse totals, summed over StockBalance rows
+def warehouse_totals_aggregates():
+    return {
+        'quantity_in_stock': Sum('quantity', filter=Q(quantity__gt=0), default=0),
+        'total_inventory_value': Sum(
+            'total_value',
+            filter=Q(quantity__gt=0),
+            output_field=MONEY_FIELD,
+            default=Decimal('0.00')
+        )
+    }
+
+# Function to build the response body of a warehouse valuation page
+def warehouse_valuation_body(rows, limit, totals, ware_count):
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    results = []
+    for row in rows:
+        quantity = row['balance__quantity'] or 0
+        value = row['balance__total_value'] if quantity > 0 else Decimal('0.00')
+        results.append({
+            "ware_id": row['id'],
+            "name": row['name'],
+            "cost_method": row['cost_method'],
+            "quantity_in_stock": quantity,
+            "total_inventory_value": value
+        })
+
+    return {
+        "results": WareValuationSerializer(results, many=True).data,
+        "next": rows[-1]['id'] if has_more else None,
+        "totals": {
+            "ware_count": ware_count,
+            "quantity_in_stock": totals['quantity_in_stock'],
+            "total_inventory_value": str(to_money(totals['total_inventory_value']))
+        }
+    }
+
+# Age buckets of the aging report: (label, maximum age in days), youngest first; the last has no maximum
+AGING_BUCKETS = [('0-30', 30), ('31-90', 90), ('91-180', 180), ('180+', None)]
+
+# Function to build the expression giving the age bucket of a FIFO layer at the given time
+def aging_bucket(as_of):
+    return Case(
+        *[
+            When(created_at__gte=as_of - timedelta(days=days), then=Value(label))
+            for label, days in AGING_BUCKETS if days is not None
+        ],
+        default=Value(AGING_BUCKETS[-1][0])
+    )
+
+# Function to build an empty aging entry, with every bucket at zero
+def empty_aging():
+    return {
+        "buckets": {label: {"quantity": 0, "value": Decimal('0.00')} for label, _ in AGING_BUCKETS},
+        "quantity": 0,
+        "value": Decimal('0.00')
+    }
+
+# Function to turn the values of an aging entry into strings, like the other money amounts in reports
+def format_aging(entry):
+    return {
+        **entry,
+        "buckets": {
+            label: {"quantity": bucket['quantity'], "value": str(bucket['value'])}
+            for label, bucket in entry['buckets'].items()
+        },
+        "value": str(entry['value'])
+    }
+
+# Function to return the aggregates summed over COGS rollup rows
+def cogs_rollup_aggregates():
+    return {
+        'input_quantity': Sum('input_quantity', default=0),
+        'input_value': Sum('input_value', output_field=MONEY_FIELD, default=Decimal('0.00')),
+        'output_quantity': Sum('output_quantity', default=0),
+        'cogs': Sum('cogs', output_field=MONEY_FIELD, default=Decimal('0.00'))
+    }
+
+# Function to build the totals of a COGS report row, with money amounts as strings
+def format_cogs(row):
+    return {
+        "input_quantity": row['input_quantity'],
+        "input_value": str(to_money(row['input_value'])),
+        "output_quantity": row['output_quantity'],
+        "cogs": str(to_money(row['cogs']))
+    }
+
+# Function to build the queryset of a transaction history page, with one extra row that tells
+# whether there is a next page; raises ValueError for an invalid cursor
+def factor_history_queryset(ware_id, params):
+    factors = Factor.objects.filter(ware_id=ware_id).order_by('created_at', 'id')
+    if 'type' in params:
+        factors = factors.filter(type=params['type'])
+    if 'created_after' in params:
+        factors = factors.filter(created_at__gte=params['created_after'])
+    if 'created_before' in params:
+        factors = factors.filter(created_at__lt=params['created_before'])
+    if 'cursor' in params:
+        created_at, factor_id = decode_history_cursor(params['cursor'])
+        factors = factors.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=factor_id)
+        )
+    return factors[:params['limit'] + 1]
+
+# Function to build the response body of a transaction history page
+# carried_forward sums up the rows archive_ledger moved out of the ledger (None when there are none)
+def factor_history_body(page, limit, carry=None):
+    has_more = len(page) > limit
+    page = page[:limit]
+    return {
+        "results": FactorSerializer(page, many=True).data,
+        "next": encode_history_cursor(page[-1]) if has_more else None,
+        "carried_forward": LedgerCarryForwardSerializer(carry).data if carry is not None else None
+    }
+
+# Helper functions for the fast validation path
+# The single input and output endpoints get a small, fixed payload. With INVENTORY_FAST_VALIDATION
+# they check it directly instead of running the serializers. Only payloads that are plainly valid
+# take this path; anything else goes through the serializer, so errors keep exactly their shape.
+
+# Largest quantity or ID accepted by the fast path; larger values are left to the serializers
+FAST_MAX_INTEGER = 2 ** 31 - 1
+
+# Field that parses purchase prices like FactorInputSerializer does
+PURCHASE_PRICE_FIELD = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+# Function to read a positive integer sent as a JSON number or a string of digits; None otherwise
+def fast_positive_integer(value):
+    if type(value) is str and value.isascii() and value.isdigit() and len(value) <= 10:
+        value = int(value)
+    if type(value) is not int or not 0 < value <= FAST_MAX_INTEGER:
+        return None  # Also rules out booleans, which are ints in Python
+    return value
+
+# Function to validate an input payload like FactorInputSerializer and load its ware
+# Returns the validated data, or None when the serializer must decide
+def fast_input_data(data):
+    if type(data) is not dict:
+        return None
+    ware_id = fast_positive_integer(data.get('ware_id'))
+    quantity = fast_positive_integer(data.get('quantity'))
+    purchase_price = data.get('purchase_price')
+    if ware_id is None or quantity is None or type(purchase_price) not in (str, int, float):
+        return None
+    try:
+        purchase_price = PURCHASE_PRICE_FIELD.to_internal_value(purchase_price)
+    except ValidationError:
+        return None
+    if purchase_price <= 0:
+        return None
+    ware = Ware.objects.filter(id=ware_id).first()
+    if ware is None:
+        return None
+    return {'ware': ware, 'quantity': quantity, 'purchase_price': purchase_price}
+
+# Function to validate an output payload like FactorOutputSerializer
+# Returns the validated data, or None when the serializer must decide
+def fast_output_data(data):
+    if type(data) is not dict:
+        return None
+    ware_id = fast_positive_integer(data.get('ware_id'))
+    quantity = fast_positive_integer(data.get('quantity'))
+    if ware_id is None or quantity is None:
+        return None
+    return {'ware_id': ware_id, 'quantity': quantity}
+
+# Function to build the response body of an output ticket
+# A finished ticket carries the output as FactorOutputView returns it, or the error that stopped it
+def output_ticket_body(ticket):
+    body = {"ticket_id": ticket.id, "status": ticket.status}
+    if ticket.status == DONE:
+        body["result"] = ticket.result
+    elif ticket.status != PENDING:
+        body["error"] = ticket.error
+    return body
+
+# Function to build the response body of a recorded input transaction
+def input_factor_data(factor):
+    return {
+        "factor_id": factor.id,
+        "ware_id": factor.ware.id,
+        "quantity": factor.quantity,
+        "purchase_price": str(factor.purchase_price) if factor.purchase_price else None,
+        "created_at": factor.created_at,
+        "type": factor.type
+    }
+
+# Function to build the result entry of one line in a batch response
+def batch_item_result(index, data=None, error=None):
+    if error is not None:
+        return {"index": index, "status": "error", "errors": error}
+    return {"index": index, "status": "created", **data}
+
+# Function to encode the position after a factor as an opaque history cursor
+def encode_history_cursor(factor):
+    position = f"{factor.created_at.isoformat()}|{factor.id}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+# Function to decode a history cursor into (created_at, id); raises ValueError if it is malformed
+def decode_history_cursor(cursor):
+    try:
+        created_at, factor_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    except (binascii.Error, UnicodeDecodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+    created_at = parse_datetime(created_at)
+    if created_at is None:
+        raise ValueError("Invalid cursor")
+    return created_at, int(factor_id)
+
+# Helper functions for recording transactions
+
+# Function to record many input transactions at once
+# Factors and FIFO layers are bulk-created and each ware's balance is updated once
+# Must be called inside a transaction; returns the created factors in the order given
+def record_inputs(entries):
+    factors = Factor.objects.bulk_create([
+        Factor(
+            ware=ware,
+            quantity=quantity,
+            purchase_price=purchase_price,
+            total_cost=Decimal(quantity) * Decimal(purchase_price),
+            type='input'
+        )
+        for ware, quantity, purchase_price in entries
+    ])
+
+    FifoLayer.objects.bulk_create([
+        FifoLayer(
+            ware=factor.ware,
+            factor=factor,
+            purchase_price=factor.purchase_price,
+            remaining_quantity=factor.quantity,
+            created_at=factor.created_at
+        )
+        for factor in factors if factor.ware.cost_method == 'fifo'
+    ])
+
+    # Sum the changes per ware so each balance row is written once
+    changes = {}
+    for factor in factors:
+        quantity, value = changes.get(factor.ware, (0, Decimal('0.00')))
+        changes[factor.ware] = (quantity + factor.quantity, value + factor.total_cost)
+    # Balance rows are written in ware ID order, the order lock_stock_balances locks them in, so
+    # concurrent batches touching the same wares cannot deadlock
+    for ware, (quantity, value) in sorted(changes.items(), key=lambda item: item[0].id):
+        update_stock_balance(ware, quantity, value)
+    update_cogs_rollups(factors)
+
+    return factors
+
+# Function to cost many output transactions against each ware's stock
+# Each ware's stock is locked and its cost state loaded once, then its lines are costed in the order given
+# Returns an unsaved Factor per line (None where stock ran out) and the cost states to save
+def cost_outputs(lines):
+    on_hand = lock_stock_balances({ware.id for ware, _ in lines})
+    states = {}
+    factors = []
+    for ware, quantity in lines:
+        if on_hand.get(ware.id, 0) < quantity:
+            factors.append(None)
+            continue
+        if ware not in states:
+            states[ware] = get_cost_state(ware)
+        total_cost = states[ware].consume(quantity)
+        if total_cost is None:
+            factors.append(None)
+            continue
+        on_hand[ware.id] -= quantity
+        factors.append(Factor(
+            ware=ware,
+            quantity=quantity,
+            # Round the cost the same way the database stores it, so the balance matches the ledger
+            total_cost=total_cost.quantize(Decimal('0.01')),
+            type='output'
+        ))
+    return factors, states
+
+# Function to store output transactions costed by cost_outputs
+# Must be called inside the same transaction as cost_outputs
+def save_outputs(factors, states):
+    Factor.objects.bulk_create(factors)
+    for state in states.values():
+        state.save()
+
+    # Sum the changes per ware so each balance row is written once
+    changes = {}
+    for factor in factors:
+        quantity, value = changes.get(factor.ware, (0, Decimal('0.00')))
+        changes[factor.ware] = (quantity + factor.quantity, value + factor.total_cost)
+    for ware, (quantity, value) in sorted(changes.items(), key=lambda item: item[0].id):
+        update_stock_balance(ware, -quantity, -value)
+    update_cogs_rollups(factors)
+    return factors
+
+# Function to record queued outputs of one ware in one transaction, in the order they were accepted
+# Returns a (response body, error) pair per output; outputs that find too little stock fail on their own
+@retry_on_database_lock
+def apply_queued_outputs(ware, quantities):
+    with transaction.atomic():
+        factors, states = cost_outputs([(ware, quantity) for quantity in quantities])
+        save_outputs([factor for factor in factors if factor is not None], states)
+    return [
+        (FactorOutputResponseSerializer(factor).data, None) if factor is not None else (None, "Insufficient stock")
+        for factor in factors
+    ]
+
+# The process-wide output queue, used when INVENTORY_OUTPUT_QUEUE_ENABLED is set
+output_queue = OutputQueue(apply_queued_outputs)
+
 # Helper functions for cost calculations
 
+# Decimal type for money sums computed by the database
+MONEY_FIELD = DecimalField(max_digits=20, decimal_places=2)
+
+# Number of open FIFO layers read per query while costing an output
+FIFO_LAYER_BATCH_SIZE = 100
+
+# Number of emptied FIFO layers written per update query (kept under SQLite's parameter limit)
+FIFO_SAVE_BATCH_SIZE = 500
+
 # Function to calculate the total cost of removing items from stock
 def calculate_output_cost(ware, quantity):
     if ware.cost_method == 'fifo':
-        factors = Factor.objects.filter(ware=ware, type='input').order_by('created_at')
-        return calculate_fifo_cost(factors, quantity)
+        return calculate_fifo_cost(ware, quantity)
     elif ware.cost_method == 'weighted_mean':
         return calculate_weighted_mean_cost(ware, quantity)
     else:
         raise ValueError("Invalid cost method")
 
 # Function to calculate the cost using FIFO (First In First Out) method
-def calculate_fifo_cost(factors, quantity):
-    remaining = quantity
-    total_cost = Decimal('0.00')
-    fifo_queue = deque(factors)  # Queue to process input transactions in order of oldest to newest
-
-    while remaining > 0 and fifo_queue:
-        factor = fifo_queue.popleft()
-        available = factor.quantity
-        if available <= 0:
-            continue
-        take = min(available, remaining)
-        total_cost += take * factor.purchase_price
-        remaining -= take
-        factor.quantity -= take  # Reduce the quantity in the input factor after it's partially used
-        factor.save()
-
-    if remaining > 0:
-        # Not enough stock to fulfill the output
+# Only the open layers needed are read, oldest first, and their consumption is written back in bulk
+def calculate_fifo_cost(ware, quantity):
+    state = FifoCostState(ware)
+    total_cost = state.consume(quantity)
+    if total_cost is None:
+        # Not enough stock to fulfill the output; nothing has been written
         return None, None
-    return quantity - remaining, total_cost
+    state.save()
+    return quantity, total_cost
 
-# Function to calculate the cost using Weighted Mean method
+# Function to calculate the cost using Weighted Mean method (perpetual moving average)
 def calculate_weighted_mean_cost(ware, quantity):
-    inputs = Factor.objects.filter(ware=ware, type='input')
-    total_quantity = sum(f.quantity for f in inputs)
-    total_cost = sum(f.quantity * f.purchase_price for f in inputs)
-
-    if total_quantity < quantity:
+    total_cost = WeightedMeanCostState(ware).consume(quantity)
+    if total_cost is None:
         return None, None  # Not enough stock
+    return quantity, total_cost
 
-    average_cost = total_cost / Decimal(total_quantity)
-    total_output_cost = average_cost * Decimal(quantity)
-    
-    return quantity, total_output_cost
-
-# Function to calculate the total inventory valuation
-def calculate_inventory_valuation(ware):
+# Function to create the cost state matching the ware's cost method
+def get_cost_state(ware):
     if ware.cost_method == 'fifo':
-        # FIFO valuation sums the remaining input factors
-        inputs = Factor.objects.filter(ware=ware, type='input').order_by('created_at')
-        total_quantity = sum(f.quantity for f in inputs)
-        total_inventory_value = sum(f.quantity * f.purchase_price for f in inputs)
+        return FifoCostState(ware)
     elif ware.cost_method == 'weighted_mean':
-        # Weighted Mean valuation
-        inputs = Factor.objects.filter(ware=ware, type='input')
-        outputs = Factor.objects.filter(ware=ware, type='output')
-        
-        total_input_cost = sum(f.total_cost for f in inputs)
-        total_output_cost = sum(f.total_cost for f in outputs)
-        
-        remaining_cost = total_input_cost - total_output_cost
-        total_quantity = sum(f.quantity for f in inputs) - sum(f.quantity for f in outputs)
-        
-        if total_quantity > 0:
-            total_inventory_value = remaining_cost
+        return WeightedMeanCostState(ware)
+    else:
+        raise ValueError("Invalid cost method")
+
+# Class holding the open FIFO layers of a ware while one or more outputs are costed against them
+# Layers are read lazily in keyset-ordered batches into a LotBook (see costing.py), which costs each
+# output without walking the layers; nothing is written until save() is called
+class FifoCostState:
+    def __init__(self, ware):
+        self.ware = ware
+        self.book = LotBook()  # Open layers, oldest first
+        self.layer_ids = array('q')  # FifoLayer ID of each lot in the book, 0 for layers not saved yet
+        self.new_layers = {}  # Layers not saved yet, by book index
+        self.emptied_ids = []  # Saved layers emptied since the last save
+        self.partial_index = None  # Book index of the saved layer left partly consumed, if any
+        self.last = None  # (created_at, id) of the last layer read, where the next batch continues from
+        self.exhausted = ware.pk is None  # True once every open layer has been read; a new ware has none
+
+    # Reads the next batch of open layers from the database
+    def load_more(self):
+        layers = FifoLayer.objects.filter(ware=self.ware, remaining_quantity__gt=0).order_by('created_at', 'id')
+        if self.last is not None:
+            # Continue right after the last layer read (keyset on created_at, id)
+            created_at, layer_id = self.last
+            layers = layers.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=layer_id))
+        batch = list(layers.values_list('id', 'purchase_price', 'remaining_quantity', 'created_at')[:FIFO_LAYER_BATCH_SIZE])
+        if len(batch) < FIFO_LAYER_BATCH_SIZE:
+            self.exhausted = True
+        for layer_id, purchase_price, remaining_quantity, created_at in batch:
+            self.book.add(remaining_quantity, purchase_price)
+            self.layer_ids.append(layer_id)
+            self.last = (created_at, layer_id)
+
+    # Takes units from the oldest layers and returns their cost, or None if there is not enough stock
+    def consume(self, quantity):
+        while self.book.available < quantity and not self.exhausted:
+            self.load_more()
+        plan = self.book.consume(quantity)
+        if plan is None:
+            return None
+
+        # Record what the plan changed; layers not saved yet are updated in place for whoever saves them
+        for index in plan.exhausted:
+            if self.layer_ids[index]:
+                self.emptied_ids.append(self.layer_ids[index])
+            else:
+                self.new_layers[index].remaining_quantity = 0
+        if self.partial_index is not None and self.partial_index in plan.exhausted:
+            self.partial_index = None
+        if plan.partial is not None:
+            index, remaining_quantity = plan.partial
+            if self.layer_ids[index]:
+                self.partial_index = index
+            else:
+                self.new_layers[index].remaining_quantity = remaining_quantity
+        return plan.cost
+
+    # Reads every remaining open layer, e.g. before adding newer layers with add_layer()
+    def load_all(self):
+        while not self.exhausted:
+            self.load_more()
+
+    # Appends a newer layer, not saved yet, after all open layers
+    # Every open layer must have been loaded first (see load_all)
+    def add_layer(self, layer):
+        index = self.book.add(layer.remaining_quantity, layer.purchase_price)
+        self.layer_ids.append(0)
+        self.new_layers[index] = layer
+
+    # Writes the consumed layers back in a single update (one per FIFO_SAVE_BATCH_SIZE layers):
+    # emptied layers are set to 0 and the partly consumed one to what is left of it
+    def save(self):
+        layer_ids = self.emptied_ids
+        remaining_quantity = Value(0)
+        if self.partial_index is not None:
+            partial_id = self.layer_ids[self.partial_index]
+            layer_ids = layer_ids + [partial_id]
+            remaining_quantity = Case(
+                When(id=partial_id, then=Value(self.book.remaining(self.partial_index))),
+                default=Value(0)
+            )
+        for start in range(0, len(layer_ids), FIFO_SAVE_BATCH_SIZE):
+            FifoLayer.objects.filter(id__in=layer_ids[start:start + FIFO_SAVE_BATCH_SIZE]).update(
+                remaining_quantity=remaining_quantity
+            )
+        self.emptied_ids = []
+        self.partial_index = None
+
+# Class holding the perpetual (moving) average cost of a ware while one or more outputs are costed
+# The state is the ware's running balance: every input adds its units and cost, every output takes
+# units out at the current average, so each step costs O(1) however long the ledger is
+class WeightedMeanCostState(MovingAverage):
+    def __init__(self, ware):
+        balance = None
+        if ware.pk is not None:
+            # A single primary-key read; outputs have already locked this row
+            balance = StockBalance.objects.filter(ware=ware).values_list('quantity', 'total_value').first()
+        # A new ware, or one without transactions, starts empty
+        super().__init__(*(balance or (0, Decimal('0.00'))))
+
+    # Adds a newer input to the running totals
+    def add_input(self, quantity, purchase_price):
+        self.add(quantity, purchase_price)
+
+    # The running totals are written through update_stock_balance by whoever records the transactions
+    def save(self):
+        pass
+
+# Function to apply a change in stock to the ware's running balance
+# It must be called inside the transaction that records the matching Factor
+# Cached valuations of the ware are invalidated once that transaction commits
+def update_stock_balance(ware, quantity, value):
+    bump_ledger_version_on_commit(ware.id)
+    updated = StockBalance.objects.filter(ware=ware).update(
+        quantity=F('quantity') + quantity,
+        total_value=F('total_value') + value,
+        version=F('version') + 1
+    )
+    if not updated:
+        # First transaction for this ware, so its balance row may not exist yet
+        # get_or_create copes with a concurrent first transaction creating it at the same time
+        balance, created = StockBalance.objects.get_or_create(
+            ware=ware,
+            defaults={'quantity': quantity, 'total_value': value, 'version': 1}
+        )
+        if not created:
+            StockBalance.objects.filter(ware=ware).update(
+                quantity=F('quantity') + quantity,
+                total_value=F('total_value') + value,
+                version=F('version') + 1
+            )
+
+# Function to add transactions to the daily COGS rollups of their wares
+# It must be called inside the transaction that records the factors; each (ware, day) row is written once
+def update_cogs_rollups(factors):
+    changes = {}
+    for factor in factors:
+        key = (factor.ware_id, timezone.localdate(factor.created_at))
+        input_quantity, input_value, output_quantity, cogs = changes.get(key, (0, Decimal('0.00'), 0, Decimal('0.00')))
+        if factor.type == 'input':
+            changes[key] = (input_quantity + factor.quantity, input_value + factor.total_cost, output_quantity, cogs)
         else:
-            total_inventory_value = Decimal('0.00')
+            changes[key] = (input_quantity, input_value, output_quantity + factor.quantity, cogs + factor.total_cost)
+
+    # Written in (ware ID, day) order, like the balance rows, so concurrent writers cannot deadlock
+    for (ware_id, day), (input_quantity, input_value, output_quantity, cogs) in sorted(changes.items()):
+        updated = CogsRollup.objects.filter(ware_id=ware_id, day=day).update(
+            input_quantity=F('input_quantity') + input_quantity,
+            input_value=F('input_value') + input_value,
+            output_quantity=F('output_quantity') + output_quantity,
+            cogs=F('cogs') + cogs
+        )
+        if not updated:
+            # First transaction of the ware that day; get_or_create copes with a concurrent first one
+            rollup, created = CogsRollup.objects.get_or_create(
+                ware_id=ware_id,
+                day=day,
+                defaults={
+                    'input_quantity': input_quantity,
+                    'input_value': input_value,
+                    'output_quantity': output_quantity,
+                    'cogs': cogs
+                }
+            )
+            if not created:
+                CogsRollup.objects.filter(pk=rollup.pk).update(
+                    input_quantity=F('input_quantity') + input_quantity,
+                    input_value=F('input_value') + input_value,
+                    output_quantity=F('output_quantity') + output_quantity,
+                    cogs=F('cogs') + cogs
+                )
+
+# Function to compute the daily COGS rollups from the Factor ledger with one grouped query
+# Returns (input_quantity, input_value, output_quantity, cogs) by (ware ID, day)
+# Days before a ware's archive cutoff are left out: their rows are no longer in the ledger
+def calculate_ledger_cogs_rollups(ware_ids=None):
+    factors = Factor.objects.all()
+    if ware_ids is not None:
+        factors = factors.filter(ware_id__in=ware_ids)
+    rows = factors.annotate(day=TruncDate('created_at')).filter(unarchived_days()).values('ware_id', 'day').annotate(
+        **ledger_aggregates()
+    ).order_by()
+    return {
+        (row['ware_id'], row['day']): (
+            row['input_quantity'],
+            to_money(row['input_cost']),
+            row['output_quantity'],
+            to_money(row['output_cost'])
+        )
+        for row in rows
+    }
+
+# Function to replace the COGS rollups of the given wares (all wares when None) with ones computed from the ledger
+# The rollups of archived days are kept as they are
+def rebuild_cogs_rollups(ware_ids=None):
+    rollups = CogsRollup.objects.filter(unarchived_days())
+    if ware_ids is not None:
+        rollups = rollups.filter(ware_id__in=ware_ids)
+    rollups.delete()
+    CogsRollup.objects.bulk_create(
+        [
+            CogsRollup(
+                ware_id=ware_id,
+                day=day,
+                input_quantity=input_quantity,
+                input_value=input_value,
+                output_quantity=output_quantity,
+                cogs=cogs
+            )
+            for (ware_id, day), (input_quantity, input_value, output_quantity, cogs)
+            in calculate_ledger_cogs_rollups(ware_ids).items()
+        ],
+        batch_size=500
+    )
+
+# Function to return the filter that keeps only the days a ware has not archived
+# Applies to any queryset with a 'day' field or annotation
+def unarchived_days():
+    return Q(ware__carry_forward__isnull=True) | Q(day__gte=F('ware__carry_forward__archived_before'))
+
+# Function to lock the balance rows of the given wares for the rest of the current transaction
+# Outputs call this before reading any cost data, so outputs on the same ware are applied one at a time
+# Returns the on-hand quantity of each ware that has a balance row, by ware ID
+def lock_stock_balances(ware_ids):
+    ware_ids = sorted(ware_ids)  # Always lock in the same order to avoid deadlocks between batches
+    if not connection.features.has_select_for_update:
+        # SQLite has no row locks and ignores select_for_update. Writing first takes the database
+        # write lock now, instead of failing with "database is locked" when the transaction later
+        # tries to upgrade from a read lock that another writer is waiting on.
+        StockBalance.objects.filter(ware_id__in=ware_ids).update(quantity=F('quantity'))
+    balances = StockBalance.objects.select_for_update().filter(ware_id__in=ware_ids).order_by('ware_id')
+    return dict(balances.values_list('ware_id', 'quantity'))
+
+# Function to calculate the total inventory valuation
+# This reads the maintained balance row instead of scanning the ledger
+def calculate_inventory_valuation(ware):
+    balance = StockBalance.objects.filter(ware=ware).values_list('quantity', 'total_value').first()
+    if balance is None:
+        # No transactions have been recorded for this ware yet
+        return 0, Decimal('0.00')
+
+    total_quantity, total_inventory_value = balance
+    if total_quantity <= 0:
+        total_inventory_value = Decimal('0.00')
+    return total_quantity, total_inventory_value
+
+# Function to calculate the stock level and value directly from the Factor ledger
+# Used to rebuild or verify the balance table; it returns the raw remaining value
+def calculate_ledger_valuation(ware):
+    # The totals archive_ledger carried forward are added in the same query (zero when nothing was archived)
+    carried = LedgerCarryForward.objects.filter(ware=ware)
+    totals = ledger_totals(Factor.objects.filter(ware=ware).aggregate(**{
+        field: aggregate + Coalesce(Subquery(carried.values(field)), aggregate.default)
+        for field, aggregate in ledger_aggregates().items()
+    }))
+
+    # Input rows keep their receipt quantity and outputs record the cost they took out,
+    # so the same calculation holds for both FIFO and Weighted Mean wares
+    total_quantity = totals['input_quantity'] - totals['output_quantity']
+    total_inventory_value = totals['input_cost'] - totals['output_cost']
+
+    return total_quantity, total_inventory_value
+
+# Function to calculate the stock level and value of a ware at a past point in time
+# Starts from the latest snapshot taken at or before that time and adds only the transactions after it
+# Set raw to get the remaining value even when nothing is on hand (as stored in snapshots)
+# Raises ValueError for a time before the ware's archive cutoff, which the ledger can no longer replay
+def calculate_valuation_as_of(ware, as_of, raw=False):
+    carry = LedgerCarryForward.objects.filter(ware=ware).first()
+    cutoff = check_as_of_archive(carry, as_of)
+    factors = Factor.objects.filter(ware=ware, created_at__lte=as_of)
+    snapshots = ValuationSnapshot.objects.filter(ware=ware, taken_at__lte=as_of)
+    if cutoff is not None:
+        # Older snapshots would be followed by rows that have been archived since
+        snapshots = snapshots.filter(taken_at__gte=cutoff)
+    snapshot = snapshots.order_by('-taken_at').first()
+    if snapshot is not None:
+        factors = factors.filter(created_at__gt=snapshot.taken_at)
+        total_quantity, total_inventory_value = snapshot.quantity, snapshot.total_value
+    elif carry is not None:
+        total_quantity = carry.input_quantity - carry.output_quantity
+        total_inventory_value = carry.input_cost - carry.output_cost
     else:
-        total_quantity = 0
+        total_quantity, total_inventory_value = 0, Decimal('0.00')
+
+    # Every transaction adds or removes its quantity and cost, so the rows after the snapshot can be summed
+    totals = aggregate_ledger(factors)
+    total_quantity += totals['input_quantity'] - totals['output_quantity']
+    total_inventory_value += totals['input_cost'] - totals['output_cost']
+
+    if total_quantity <= 0 and not raw:
         total_inventory_value = Decimal('0.00')
-    
     return total_quantity, total_inventory_value
+
+# Function to return the archive cutoff of a carry-forward row as a datetime (None when nothing was archived)
+# Raises ValueError when as_of is before it
+def check_as_of_archive(carry, as_of):
+    if carry is None:
+        return None
+    cutoff = archive_cutoff(carry.archived_before)
+    if as_of < cutoff:
+        raise ValueError(f"as_of must not be before {cutoff.isoformat()}; older transactions are archived")
+    return cutoff
+
+# Function to return the start of an archive cutoff day in the current time zone
+def archive_cutoff(day):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+# Function to sum the input and output quantities and costs of a Factor queryset in a single query
+def aggregate_ledger(factors):
+    return ledger_totals(factors.aggregate(**ledger_aggregates()))
+
+# Function to return the aggregates summed by aggregate_ledger
+def ledger_aggregates():
+    return {
+        'input_quantity': Sum('quantity', filter=Q(type='input'), default=0),
+        'output_quantity': Sum('quantity', filter=Q(type='output'), default=0),
+        'input_cost': Sum('total_cost', filter=Q(type='input'), output_field=MONEY_FIELD, default=Decimal('0.00')),
+        'output_cost': Sum('total_cost', filter=Q(type='output'), output_field=MONEY_FIELD, default=Decimal('0.00'))
+    }
+
+# Function to round the cost sums of an aggregate_ledger result
+def ledger_totals(totals):
+    totals['input_cost'] = to_money(totals['input_cost'])
+    totals['output_cost'] = to_money(totals['output_cost'])
+    return totals
+
+# Function to round a database sum to cents
+# SQLite adds decimals as floats, so sums are brought back to the exact two places every stored amount has
+def to_money(value):
+    return Decimal(value).quantize(Decimal('0.01'))
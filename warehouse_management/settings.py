@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the whole request; only active when INVENTORY_TIMING_ENABLED is set
+    "inventory.middleware.RequestTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -75,10 +78,53 @@ WSGI_APPLICATION = "warehouse_management.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
+# The database profile is chosen with the WMS_DB_PROFILE environment variable:
+# - "sqlite" (default): a local db.sqlite3 file, tuned through INVENTORY_SQLITE_PRAGMAS
+# - "postgresql": a PostgreSQL server configured with the WMS_DB_* variables below
+#   (needs the psycopg package: pip install "psycopg[binary]")
+# WMS_DB_CONN_MAX_AGE keeps connections open for that many seconds instead of one per request.
+
+DATABASE_PROFILE = os.environ.get("WMS_DB_PROFILE", "sqlite")
+CONN_MAX_AGE = int(os.environ.get("WMS_DB_CONN_MAX_AGE", "60"))
+
+if DATABASE_PROFILE == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("WMS_DB_NAME", "warehouse_management"),
+            "USER": os.environ.get("WMS_DB_USER", "postgres"),
+            "PASSWORD": os.environ.get("WMS_DB_PASSWORD", ""),
+            "HOST": os.environ.get("WMS_DB_HOST", "localhost"),
+            "PORT": os.environ.get("WMS_DB_PORT", "5432"),
+            # Persistent connections, checked before reuse so a dropped one is replaced transparently
+            "CONN_MAX_AGE": CONN_MAX_AGE,
+            "CONN_HEALTH_CHECKS": True,
+        }
+    }
+elif DATABASE_PROFILE == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("WMS_DB_NAME", BASE_DIR / "db.sqlite3"),
+            "CONN_MAX_AGE": CONN_MAX_AGE,
+            # Tests run against a file rather than the default in-memory database, so
+            # concurrency tests see SQLite's real locking instead of shared-cache table locks
+            "TEST": {
+                "NAME": BASE_DIR / "test_db.sqlite3",
+            },
+        }
+    }
+else:
+    raise ValueError(f"Unknown WMS_DB_PROFILE {DATABASE_PROFILE!r}; use 'sqlite' or 'postgresql'")
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The in-process cache only suits a single process; point this at a shared backend
+# (Redis, Memcached or the database cache) when running several workers
+
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
     }
 }
 
@@ -123,3 +169,78 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Inventory
+# Settings read by the inventory app
+
+# Maximum number of lines accepted by a single batch input/output request
+INVENTORY_BATCH_MAX_SIZE = 1000
+
+# Number of times an output is retried when SQLite reports "database is locked"
+INVENTORY_LOCK_RETRIES = 3
+
+# Cache alias (see CACHES) used for inventory valuations
+INVENTORY_VALUATION_CACHE_ALIAS = "default"
+
+# Seconds a cached point-in-time (as_of) valuation is kept; every ledger change of the ware also invalidates it
+INVENTORY_VALUATION_CACHE_TTL = 300
+
+# Pragmas run on every new SQLite connection (see inventory/signals.py); these only last for the connection
+# NORMAL sync is safe with WAL and skips an fsync per commit, busy_timeout makes writers wait for the lock
+# (milliseconds) and mmap_size maps that many bytes of the file.
+# Set WMS_SQLITE_PRAGMAS=off to keep SQLite's defaults, e.g. to compare benchmarks.
+INVENTORY_SQLITE_PRAGMAS = {} if os.environ.get("WMS_SQLITE_PRAGMAS") == "off" else {
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+# Journal mode written into the SQLite file by migrate (migration 0010), once rather than per connection
+# WAL lets readers work while a writer commits; None leaves the file's journal mode alone.
+# Only read when the database is first migrated: changing it later does not change an existing database.
+INVENTORY_SQLITE_JOURNAL_MODE = None if os.environ.get("WMS_SQLITE_PRAGMAS") == "off" else "WAL"
+
+# Check the payloads of the single input and output endpoints directly instead of through the
+# serializers when they are plainly valid; anything else still gets the serializers' errors
+INVENTORY_FAST_VALIDATION = False
+
+# Accept single outputs with 202 and a ticket, and record them in a writer thread per ware
+# (see inventory/output_queue.py); the ticket is polled at /api/inventory/output/tickets/<id>/.
+# The queue is in memory, so only use it with a single server process.
+INVENTORY_OUTPUT_QUEUE_ENABLED = False
+
+# Maximum number of queued outputs of a ware recorded in one transaction
+INVENTORY_OUTPUT_QUEUE_BATCH_SIZE = 50
+
+# Seconds a finished output ticket can still be looked up
+INVENTORY_OUTPUT_QUEUE_TICKET_TTL = 3600
+
+# Time every request and report it in a Server-Timing header and an "inventory.timing" log line
+INVENTORY_TIMING_ENABLED = False
+
+# Directory where profiles of slow requests are dumped; profiling is off when None
+INVENTORY_PROFILE_DIR = None
+
+# Share of requests that are profiled while INVENTORY_PROFILE_DIR is set
+INVENTORY_PROFILE_SAMPLE_RATE = 0.1
+
+# Profiled requests taking at least this many milliseconds are dumped
+INVENTORY_PROFILE_SLOW_MS = 200
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {
+            "class": "logging.StreamHandler",
+        },
+    },
+    "loggers": {
+        "inventory.timing": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}